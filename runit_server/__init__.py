@@ -1 +1,7 @@
-from .app import app
+def __getattr__(name):
+    # Imported on first use, so worker processes can import the package without the app
+    if name == 'app':
+        from .app import app
+        globals()['app'] = app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
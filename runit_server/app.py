@@ -13,6 +13,7 @@ from fastapi.responses import RedirectResponse, JSONResponse
 from starlette.middleware.sessions import SessionMiddleware
 
 from .core import lifespan, templates, on_startup, on_shutdown, get_uptime, ws_manager
+from .services.invocation_log import InvocationLogMiddleware
 from .exceptions import UnauthorizedException, UnauthorizedAdminException
 from .constants import RUNIT_WORKDIR, SESSION_SECRET_KEY, DOTENV_FILE, VERSION
 
@@ -39,7 +40,16 @@ async def app_lifespan(app: FastAPI):
     await on_startup()
     
     from .services.scheduler import schedule_service
+    from .services.worker_pool import worker_pool
+    from .services.jobs import job_queue
+    from .services.build_queue import build_queue
+    from .services.inloop import in_loop
+    from .services.invocation_log import invocation_log
     await schedule_service.start()
+    await worker_pool.start()
+    await job_queue.start()
+    await build_queue.start()
+    await invocation_log.start()
     
     loop = asyncio.get_event_loop()
     for sig in (signal.SIGINT, signal.SIGTERM):
@@ -51,6 +61,11 @@ async def app_lifespan(app: FastAPI):
     yield
     
     await schedule_service.shutdown()
+    await job_queue.shutdown()
+    await build_queue.shutdown()
+    await worker_pool.shutdown()
+    in_loop.shutdown()
+    await invocation_log.shutdown()
     
     await on_shutdown()
 
@@ -83,6 +98,7 @@ app.add_middleware(
     max_age=3600,
     https_only=False
 )
+app.add_middleware(InvocationLogMiddleware)
 
 
 @app.get('/health')
@@ -109,10 +125,32 @@ async def readiness_check():
 @app.get('/metrics')
 async def metrics():
     """Basic metrics endpoint."""
+    from .services.worker_pool import worker_pool
+    from .common.cache import response_cache
+    from .services.invoker import single_flight
+    from .services.limiter import concurrency_limiter
+    from .services.jobs import job_queue
+    from .services.inloop import in_loop
+    from .services.usage import usage_stats
+    from .services.invocation_log import invocation_log
+    from .services.layers import layer_store
+    from .services.build_queue import build_queue
+    # Reads the layer directory, so it stays off the event loop
+    layers = await asyncio.get_event_loop().run_in_executor(None, layer_store.get_stats)
     return JSONResponse({
         "uptime_seconds": get_uptime(),
         "version": VERSION,
-        "websocket": ws_manager.get_stats()
+        "websocket": ws_manager.get_stats(),
+        "workers": worker_pool.get_stats(),
+        "response_cache": response_cache.get_stats(),
+        "coalescing": single_flight.get_stats(),
+        "concurrency": concurrency_limiter.get_stats(),
+        "jobs": job_queue.get_stats(),
+        "inloop": in_loop.get_stats(),
+        "usage": usage_stats.get_stats(),
+        "invocation_log": invocation_log.get_stats(),
+        "layers": layers,
+        "builds": build_queue.get_stats()
     })
 
 static = Path(__file__).resolve().parent / "static"
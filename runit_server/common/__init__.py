@@ -1,9 +1,23 @@
-from .utils import Utils
-
-from .security import UserData
-from .security import identity
-from .security import get_session
-from .security import authenticate
-from .security import get_session_user
-from .security import get_current_user
-from .security import get_admin_session
\ No newline at end of file
+from importlib import import_module
+
+# Loaded on first use: security pulls in the models, which workers never need
+_EXPORTS = {
+    'Utils': '.utils',
+    'UserData': '.security',
+    'identity': '.security',
+    'get_session': '.security',
+    'authenticate': '.security',
+    'get_session_user': '.security',
+    'get_current_user': '.security',
+    'get_admin_session': '.security',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
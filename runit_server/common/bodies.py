@@ -0,0 +1,191 @@
+"""
+Reading invocation request bodies without holding large payloads in memory.
+"""
+import os
+import json
+import asyncio
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiofiles
+from fastapi import Request
+from starlette.datastructures import UploadFile
+from fastapi.responses import Response
+from starlette.background import BackgroundTask
+
+from ..exceptions import PayloadTooLargeException
+from ..constants import RUNIT_WORKDIR, MAX_REQUEST_BODY, BODY_SPILL_SIZE
+
+BODY_DIR = Path(RUNIT_WORKDIR, 'tmp', 'bodies')
+CHUNK_SIZE = 64 * 1024
+
+
+def check_content_length(request: Request, limit: int):
+    """Reject a request up front when its declared length is over `limit`."""
+    length = request.headers.get('Content-Length', '')
+    if length.isdigit() and int(length) > limit:
+        raise PayloadTooLargeException(limit)
+
+
+def _body_file() -> Tuple[int, str]:
+    BODY_DIR.mkdir(parents=True, exist_ok=True)
+    return tempfile.mkstemp(prefix='body-', dir=BODY_DIR)
+
+
+async def read_body(request: Request, spill_size: int = BODY_SPILL_SIZE,
+                    limit: int = MAX_REQUEST_BODY) -> Tuple[Optional[bytes], Optional[str]]:
+    """
+    Read a request body as it arrives.
+
+    Returns (data, None) for bodies of up to `spill_size` bytes, else
+    (None, path) of a temporary file the body was written to. Raises
+    PayloadTooLargeException as soon as the body exceeds `limit`.
+    """
+    check_content_length(request, limit)
+    buffer = bytearray()
+    size = 0
+    path = None
+    file = None
+
+    try:
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > limit:
+                raise PayloadTooLargeException(limit)
+            if file is None and size <= spill_size:
+                buffer += chunk
+                continue
+            if file is None:
+                fd, path = _body_file()
+                os.close(fd)
+                file = await aiofiles.open(path, 'wb')
+                await file.write(bytes(buffer))
+                buffer = bytearray()
+            await file.write(chunk)
+    except BaseException:
+        if path:
+            discard_file(path)
+        raise
+    finally:
+        if file is not None:
+            await file.close()
+
+    return (None, path) if path else (bytes(buffer), None)
+
+
+async def save_upload(upload: UploadFile, directory: Path, limit: int = MAX_REQUEST_BODY,
+                      prefix: str = 'body-', digest: bool = False) -> Tuple[str, int, Optional[str]]:
+    """
+    Copy an uploaded file to a new temporary file in `directory`, chunk by chunk.
+
+    Returns the path, the size and, if `digest` is set, the SHA-256 hex
+    digest of the file. Raises PayloadTooLargeException as soon as the
+    upload exceeds `limit` bytes.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix=prefix, dir=directory)
+    os.close(fd)
+    hasher = hashlib.sha256() if digest else None
+    size = 0
+    try:
+        async with aiofiles.open(path, 'wb') as file:
+            while chunk := await upload.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > limit:
+                    raise PayloadTooLargeException(limit)
+                if hasher is not None:
+                    hasher.update(chunk)
+                await file.write(chunk)
+    except BaseException:
+        discard_file(path)
+        raise
+    finally:
+        await upload.close()
+    return path, size, hasher.hexdigest() if hasher is not None else None
+
+
+def _load_json(path: str) -> Any:
+    with open(path, 'rb') as file:
+        return json.load(file)
+
+
+def _is_text(content_type: str) -> bool:
+    return content_type.startswith('text/') or 'xml' in content_type
+
+
+async def body_params(request: Request, limit: int = MAX_REQUEST_BODY) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Turn an invocation's request body into function parameters.
+
+    JSON objects and form fields become parameters of their own. Uploaded
+    files are handed over as the path of a temporary copy. Any other body
+    is passed as `body` when it is small text, else as `body_file`, the
+    path of the temporary file it was streamed to.
+
+    Returns the parameters and the temporary files created for them, which
+    are removed with discard_body_files() once the invocation is done.
+    Parameter values are never taken for files to remove, since clients
+    choose them.
+    """
+    content_type = request.headers.get('Content-Type', '').lower()
+    params: Dict[str, Any] = {}
+    files: List[str] = []
+
+    if 'application/json' in content_type:
+        data, path = await read_body(request, limit=limit)
+        if path:
+            # Large documents are parsed off the event loop, from the file they were spilled to
+            try:
+                body = await asyncio.get_event_loop().run_in_executor(None, _load_json, path)
+            finally:
+                discard_file(path)
+        else:
+            body = json.loads(data) if data else None
+        if isinstance(body, dict):
+            params.update(body)
+    elif 'form' in content_type:
+        check_content_length(request, limit)
+        form = await request.form(max_part_size=limit)
+        size = 0
+        try:
+            for name, value in form.multi_items():
+                if isinstance(value, UploadFile):
+                    path, written, _ = await save_upload(value, BODY_DIR, limit - size)
+                    files.append(path)
+                    params[name] = path
+                    size += written
+                else:
+                    params[name] = value
+        except BaseException:
+            discard_body_files(files)
+            raise
+    else:
+        data, path = await read_body(request, BODY_SPILL_SIZE if _is_text(content_type) else 0, limit)
+        if path:
+            files.append(path)
+            params['body_file'] = path
+        elif data:
+            params['body'] = data.decode('utf-8', 'replace')
+    return params, files
+
+
+def discard_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def discard_body_files(files: List[str]):
+    """Remove the temporary files body_params() created."""
+    for path in files:
+        discard_file(path)
+
+
+def discard_after(response: Response, files: List[str]) -> Response:
+    """Remove an invocation's body files once its response has been sent."""
+    if files:
+        response.background = BackgroundTask(discard_body_files, list(files))
+    return response
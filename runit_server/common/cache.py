@@ -4,10 +4,14 @@ Caching utilities for runit-server with TTL support.
 import time
 import hashlib
 import json
-from typing import Any, Callable, Dict, Optional, TypeVar, Union
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Set, Tuple, TypeVar, Union
 from threading import Lock
 from functools import wraps
 
+from ..constants import RESPONSE_CACHE_SIZE
+from .runtime import project_settings
+
 T = TypeVar('T')
 
 
@@ -161,4 +165,107 @@ def cached_async(ttl: int = 300, key_prefix: str = ""):
     return decorator
 
 
+class ResponseCache:
+    """
+    Bounded LRU cache for results of functions a project declares cacheable.
+
+    Policies come from the `cache` section of the project's runit.json:
+
+        "cache": {"lookup": {"ttl": 60, "vary": ["id"]}}
+
+    `vary` lists the query parameters that make up the key; when omitted,
+    all parameters do.
+    """
+    
+    def __init__(self, max_items: int = RESPONSE_CACHE_SIZE):
+        self._items: 'OrderedDict[tuple, CacheItem]' = OrderedDict()
+        self._keys: Dict[str, Set[tuple]] = {}
+        self._policies: Dict[str, Dict[str, Any]] = {}
+        self._lock = Lock()
+        self._max_items = max_items
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+    
+    def policy(self, project_id: str, function: str) -> Optional[Dict[str, Any]]:
+        """Get the cache policy of a project function, if it is cacheable."""
+        with self._lock:
+            policies = self._policies.get(project_id)
+        
+        if policies is None:
+            policies = project_settings(project_id, 'cache')
+            with self._lock:
+                self._policies[project_id] = policies
+        
+        policy = policies.get(function)
+        if not isinstance(policy, dict) or not policy.get('ttl'):
+            return None
+        return policy
+    
+    def key_for(self, project_id: str, function: str, params: Dict[str, Any]) -> Optional[Tuple[tuple, int]]:
+        """Build the cache key and TTL of an invocation, or None if it is not cacheable."""
+        policy = self.policy(project_id, function)
+        if policy is None:
+            return None
+        
+        vary = policy.get('vary')
+        names = sorted(params) if vary is None else sorted(vary)
+        key = (project_id, function, json.dumps([(name, params.get(name)) for name in names], default=str))
+        return key, int(policy['ttl'])
+    
+    def lookup(self, key: tuple) -> Tuple[bool, Any]:
+        """Return (hit, value) for a key."""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item.is_expired():
+                if item is not None:
+                    self._discard(key)
+                self._misses += 1
+                return False, None
+            self._items.move_to_end(key)
+            self._hits += 1
+            return True, item.value
+    
+    def set(self, key: tuple, value: Any, ttl: int) -> None:
+        """Store a result, evicting the least recently used entries when full."""
+        with self._lock:
+            self._items[key] = CacheItem(value, ttl)
+            self._items.move_to_end(key)
+            self._keys.setdefault(key[0], set()).add(key)
+            
+            while len(self._items) > self._max_items:
+                oldest = next(iter(self._items))
+                self._discard(oldest)
+                self._evictions += 1
+    
+    def _discard(self, key: tuple) -> None:
+        self._items.pop(key, None)
+        keys = self._keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys[key[0]]
+    
+    def invalidate(self, project_id: str) -> int:
+        """Drop cached results and the cache policy of a project."""
+        with self._lock:
+            self._policies.pop(project_id, None)
+            keys = self._keys.pop(project_id, set())
+            for key in keys:
+                self._items.pop(key, None)
+            return len(keys)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get response cache statistics."""
+        with self._lock:
+            return {
+                "items": len(self._items),
+                "max_items": self._max_items,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions
+            }
+
+
 cache = MemoryCache()
+response_cache = ResponseCache()
@@ -129,6 +129,45 @@ class APIResponse:
         )
         return response
 
+    @staticmethod
+    def gateway_timeout(
+        timeout: float,
+        **kwargs
+    ) -> JSONResponse:
+        """Build a 504 Gateway Timeout response."""
+        return APIResponse.error(
+            message=f"Function timed out after {timeout:g}s",
+            error_code="TIMEOUT",
+            status_code=504,
+            **kwargs
+        )
+
+    @staticmethod
+    def payload_too_large(
+        limit: int,
+        **kwargs
+    ) -> JSONResponse:
+        """Build a 413 Payload Too Large response."""
+        return APIResponse.error(
+            message=f"Request body exceeds the limit of {limit} bytes",
+            error_code="PAYLOAD_TOO_LARGE",
+            status_code=413,
+            **kwargs
+        )
+
+    @staticmethod
+    def result_too_large(
+        limit: int,
+        **kwargs
+    ) -> JSONResponse:
+        """Build a 502 Bad Gateway response for a result over the size cap."""
+        return APIResponse.error(
+            message=f"Function result exceeds the limit of {limit} bytes",
+            error_code="RESULT_TOO_LARGE",
+            status_code=502,
+            **kwargs
+        )
+
 
 class ErrorCodes:
     """Standard error codes for the API."""
@@ -138,6 +177,9 @@ class ErrorCodes:
     FORBIDDEN = "FORBIDDEN"
     VALIDATION_ERROR = "VALIDATION_ERROR"
     RATE_LIMITED = "RATE_LIMITED"
+    TIMEOUT = "TIMEOUT"
+    PAYLOAD_TOO_LARGE = "PAYLOAD_TOO_LARGE"
+    RESULT_TOO_LARGE = "RESULT_TOO_LARGE"
     INTERNAL_ERROR = "INTERNAL_ERROR"
     DATABASE_ERROR = "DATABASE_ERROR"
     PROJECT_NOT_FOUND = "PROJECT_NOT_FOUND"
@@ -0,0 +1,147 @@
+"""
+Encoding of function results between worker processes and the server.
+"""
+import os
+import ast
+import json
+import weakref
+import tempfile
+from pathlib import Path
+from typing import Any, Optional
+
+from ..exceptions import ResultTooLargeException
+from ..constants import RUNIT_WORKDIR, RESULT_MEMORY_LIMIT, RESULT_MAX_SIZE
+
+JSON = 'application/json'
+OCTET_STREAM = 'application/octet-stream'
+
+RESULT_DIR = Path(RUNIT_WORKDIR, 'tmp', 'results')
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class EncodedResult:
+    """
+    A function result serialised by the worker process.
+
+    `body` is sent to the client as-is with `content_type`, so the server
+    does not parse and re-serialise results on the event loop. `usage`
+    holds the resources used by the execution that produced the result.
+
+    Results spooled to disk by spool_result() have an empty `body` and
+    their `path` set instead. The file belongs to the object and is
+    removed once it is garbage collected; when the object is pickled to
+    another process, the file goes with it.
+    """
+
+    __slots__ = ('content_type', 'body', 'usage', 'path', 'size', '_finalizer', '__weakref__')
+
+    def __init__(self, content_type: str, body: bytes, usage=None,
+                 path: Optional[str] = None, size: Optional[int] = None):
+        self.content_type = content_type
+        self.body = body
+        self.usage = usage
+        self.path = path
+        self.size = len(body) if size is None else size
+        self._finalizer = weakref.finalize(self, _remove, path) if path else None
+
+    def __reduce__(self):
+        if self._finalizer is not None:
+            self._finalizer.detach()
+        return EncodedResult, (self.content_type, self.body, self.usage, self.path, self.size)
+
+    def read(self) -> bytes:
+        """The encoded result, read back from disk if it was spooled."""
+        if self.path is None:
+            return self.body
+        with open(self.path, 'rb') as file:
+            return file.read()
+
+    def decode(self) -> Any:
+        """Turn the result back into a Python value, for callers that need one."""
+        if self.content_type == JSON:
+            return json.loads(self.read())
+        return self.read()
+
+    def json(self) -> bytes:
+        """The result as a JSON document; binary bodies become a string."""
+        if self.content_type == JSON:
+            return self.read()
+        return json.dumps(self.read().decode('utf-8', 'replace')).encode()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __repr__(self) -> str:
+        where = f', spooled to {self.path}' if self.path else ''
+        return f'EncodedResult({self.content_type!r}, {self.size} bytes{where})'
+
+
+def parse_text(text: str) -> Any:
+    """
+    Parse textual output that holds a JSON document or a Python literal.
+
+    Runtimes that print their result (PHP, JavaScript, subprocess Python)
+    hand back strings. Only output that is a whole object or array is
+    parsed; anything else, including text that merely contains braces or
+    apostrophes, is kept verbatim.
+    """
+    stripped = text.strip()
+    if not stripped or (stripped[0], stripped[-1]) not in (('{', '}'), ('[', ']')):
+        return text
+
+    try:
+        return json.loads(stripped)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(stripped)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return text
+
+
+def spool_result(result: EncodedResult, memory_limit: int = RESULT_MEMORY_LIMIT,
+                 max_size: int = RESULT_MAX_SIZE) -> EncodedResult:
+    """
+    Move a result larger than `memory_limit` bytes to a temporary file.
+
+    Raises ResultTooLargeException for results larger than `max_size`
+    bytes. Either limit is disabled by 0.
+    """
+    if max_size and result.size > max_size:
+        raise ResultTooLargeException(max_size)
+    if result.path is not None or not memory_limit or result.size <= memory_limit:
+        return result
+
+    RESULT_DIR.mkdir(parents=True, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix='result-', dir=RESULT_DIR)
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(result.body)
+    except BaseException:
+        _remove(path)
+        raise
+    return EncodedResult(result.content_type, b'', result.usage, path, result.size)
+
+
+def encode_result(result: Any, spool: bool = True) -> EncodedResult:
+    """
+    Serialise a function result; called in the worker process.
+
+    Large results are spooled to disk unless `spool` is false, as for the
+    chunks of a stream, which are sent on one by one.
+    """
+    if isinstance(result, EncodedResult):
+        encoded = result
+    elif isinstance(result, (bytes, bytearray)):
+        encoded = EncodedResult(OCTET_STREAM, bytes(result))
+    else:
+        if isinstance(result, str):
+            result = parse_text(result)
+        encoded = EncodedResult(JSON, json.dumps(result, default=str).encode())
+    return spool_result(encoded) if spool else encoded
@@ -0,0 +1,72 @@
+import json
+import inspect
+from pathlib import Path
+from typing import Any, Dict
+
+from runit import RunIt
+
+from ..constants import CONFIG_FILE, PROJECTS_DIR
+
+
+class ServerRunIt(RunIt):
+    '''
+    RunIt project that tolerates server-side sections in runit.json
+    (e.g. "workers") which the RunIt constructor does not accept.
+    '''
+    CONFIG_KEYS = frozenset(inspect.signature(RunIt.__init__).parameters) - {'self'}
+
+    @staticmethod
+    def load_config() -> dict:
+        '''
+        Load runit.json from the current directory,
+        keeping only the keys understood by RunIt
+
+        @params None
+        @return Dictionary
+        '''
+        config = RunIt.load_config()
+        return {key: value for key, value in config.items() if key in ServerRunIt.CONFIG_KEYS}
+
+    def update_config(self):
+        '''
+        Rewrite runit.json without dropping server-side sections
+
+        @params None
+        @return None
+        '''
+        extras = {key: value for key, value in RunIt.load_config().items()
+                  if key not in ServerRunIt.CONFIG_KEYS}
+        super().update_config()
+
+        if extras:
+            config = RunIt.load_config()
+            config.update(extras)
+            with open(CONFIG_FILE, 'wt') as file:
+                json.dump(config, file, indent=4)
+
+
+def project_config(project_id: str, projects_dir=PROJECTS_DIR) -> Dict[str, Any]:
+    '''
+    Read a project's runit.json
+
+    @param project_id Project _id
+    @return Dictionary, empty if the file is missing or invalid
+    '''
+    try:
+        with open(Path(projects_dir, project_id, CONFIG_FILE), 'rt') as file:
+            config = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return config if isinstance(config, dict) else {}
+
+
+def project_settings(project_id: str, section: str, projects_dir=PROJECTS_DIR) -> Dict[str, Any]:
+    '''
+    Read a server-side section of a project's runit.json
+
+    @param project_id Project _id
+    @param section Name of the section, e.g. "workers"
+    @return Dictionary, empty if the file or section is missing
+    '''
+    settings = project_config(project_id, projects_dir).get(section, {})
+    return settings if isinstance(settings, dict) else {}
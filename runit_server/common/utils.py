@@ -7,6 +7,8 @@ from collections import defaultdict
 from threading import Lock
 from typing import Dict, Tuple, Optional, List
 
+from starlette.requests import HTTPConnection
+
 
 class RateLimiter:
     """Thread-safe rate limiter for API endpoints."""
@@ -73,6 +75,14 @@ class RateLimiter:
 rate_limiter = RateLimiter()
 
 
+def get_client_ip(request: HTTPConnection) -> str:
+    """Extract client IP address from request."""
+    forwarded = request.headers.get("X-Forwarded-For")
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
 import secrets
 from typing import Optional
 
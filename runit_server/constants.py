@@ -38,7 +38,53 @@ load_dotenv(find_dotenv(str(DOTENV_FILE)))
 GITHUB_APP_CLIENT_ID = os.getenv('GITHUB_APP_CLIENT_ID','')
 GITHUB_APP_CLIENT_SECRET = os.getenv('GITHUB_APP_CLIENT_SECRET','')
 
+# Pools grow on demand up to this size, so by default a project's workers
+# can serve as many calls as the per-project concurrency limit admits
+WORKER_POOL_SIZE = int(os.getenv('RUNIT_WORKER_POOL_SIZE', os.getenv('RUNIT_PROJECT_CONCURRENCY', '4')))
+WORKER_IDLE_TTL = int(os.getenv('RUNIT_WORKER_IDLE_TTL', '300'))
+WORKER_MAX_PROJECTS = int(os.getenv('RUNIT_WORKER_MAX_PROJECTS', '32'))
+EXECUTION_MODE = os.getenv('RUNIT_EXECUTION_MODE', 'warm')
+INVOCATION_TIMEOUT = float(os.getenv('RUNIT_INVOCATION_TIMEOUT', '60'))
+WORKER_START_METHOD = os.getenv('RUNIT_WORKER_START_METHOD', 'forkserver')
+WORKER_MAX_REQUESTS = int(os.getenv('RUNIT_WORKER_MAX_REQUESTS', '0'))
+WORKER_MAX_MEMORY_MB = float(os.getenv('RUNIT_WORKER_MAX_MEMORY_MB', '0'))
+ZYGOTE_PRELOAD = [name.strip() for name in os.getenv('RUNIT_ZYGOTE_PRELOAD', '').split(',') if name.strip()]
+RESPONSE_CACHE_SIZE = int(os.getenv('RUNIT_RESPONSE_CACHE_SIZE', '1024'))
+PROJECT_CONCURRENCY = int(os.getenv('RUNIT_PROJECT_CONCURRENCY', '4'))
+USER_CONCURRENCY = int(os.getenv('RUNIT_USER_CONCURRENCY', '8'))
+INVOCATION_QUEUE_SIZE = int(os.getenv('RUNIT_INVOCATION_QUEUE_SIZE', '32'))
+JOB_WORKERS = int(os.getenv('RUNIT_JOB_WORKERS', '4'))
+JOB_MAX_WAIT = int(os.getenv('RUNIT_JOB_MAX_WAIT', '30'))
+BUILD_WORKERS = int(os.getenv('RUNIT_BUILD_WORKERS', '2'))
+BUILD_MAX_WAIT = int(os.getenv('RUNIT_BUILD_MAX_WAIT', '120'))
+BUILD_LOG_LIMIT = int(os.getenv('RUNIT_BUILD_LOG_LIMIT', str(64 * 1024)))
+BATCH_MAX_CALLS = int(os.getenv('RUNIT_BATCH_MAX_CALLS', '100'))
+STREAM_BUFFER_SIZE = int(os.getenv('RUNIT_STREAM_BUFFER_SIZE', '16'))
+METADATA_CACHE_TTL = int(os.getenv('RUNIT_METADATA_CACHE_TTL', '60'))
+INLOOP_PROJECTS = {name.strip() for name in os.getenv('RUNIT_INLOOP_PROJECTS', '').split(',') if name.strip()}
+INLOOP_CONCURRENCY = int(os.getenv('RUNIT_INLOOP_CONCURRENCY', '256'))
+USAGE_SAMPLES = int(os.getenv('RUNIT_USAGE_SAMPLES', '1000'))
+INVOCATION_LOG_BUFFER = int(os.getenv('RUNIT_INVOCATION_LOG_BUFFER', '10000'))
+INVOCATION_LOG_BATCH = int(os.getenv('RUNIT_INVOCATION_LOG_BATCH', '500'))
+INVOCATION_LOG_INTERVAL = float(os.getenv('RUNIT_INVOCATION_LOG_INTERVAL', '5'))
+INVOCATION_LOG_RETENTION_DAYS = int(os.getenv('RUNIT_INVOCATION_LOG_RETENTION_DAYS', '7'))
+IMPORT_PROFILE_TIMEOUT = float(os.getenv('RUNIT_IMPORT_PROFILE_TIMEOUT', '30'))
+MAX_REQUEST_BODY = int(os.getenv('RUNIT_MAX_REQUEST_BODY', str(32 * 1024 * 1024)))
+BODY_SPILL_SIZE = int(os.getenv('RUNIT_BODY_SPILL_SIZE', str(1024 * 1024)))
+RESULT_MEMORY_LIMIT = int(os.getenv('RUNIT_RESULT_MEMORY_LIMIT', str(8 * 1024 * 1024)))
+RESULT_MAX_SIZE = int(os.getenv('RUNIT_RESULT_MAX_SIZE', str(256 * 1024 * 1024)))
+RELEASES_KEEP = int(os.getenv('RUNIT_RELEASES_KEEP', '5'))
+PUBLISH_MAX_UPLOAD = int(os.getenv('RUNIT_PUBLISH_MAX_UPLOAD', str(512 * 1024 * 1024)))
+PUBLISH_MAX_EXTRACTED = int(os.getenv('RUNIT_PUBLISH_MAX_EXTRACTED', str(2 * 1024 * 1024 * 1024)))
+PUBLISH_MAX_ENTRIES = int(os.getenv('RUNIT_PUBLISH_MAX_ENTRIES', '50000'))
+BLOB_GRACE_PERIOD = int(os.getenv('RUNIT_BLOB_GRACE_PERIOD', str(24 * 60 * 60)))
+LAYER_GRACE_PERIOD = int(os.getenv('RUNIT_LAYER_GRACE_PERIOD', str(7 * 24 * 60 * 60)))
+LAYER_BUILD_TIMEOUT = float(os.getenv('RUNIT_LAYER_BUILD_TIMEOUT', '1800'))
+
 PROJECTS_DIR = os.path.join(RUNIT_WORKDIR, 'projects')
+RELEASES_DIR = os.path.join(RUNIT_WORKDIR, 'releases')
+BLOBS_DIR = os.path.join(RUNIT_WORKDIR, 'blobs')
+LAYERS_DIR = os.path.join(RUNIT_WORKDIR, 'layers')
 TEMPLATES_PATH = os.path.join(RUNIT_HOMEDIR, 'templates')
 DOCKER_TEMPLATES = os.path.join(TEMPLATES_PATH, 'docker')
 
@@ -2,4 +2,32 @@ class UnauthorizedException(Exception):
     pass
 
 class UnauthorizedAdminException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class ProjectBusyException(Exception):
+    def __init__(self, retry_after: int = 1):
+        super().__init__(f'Project is busy, retry after {retry_after}s')
+        self.retry_after = retry_after
+
+class InvocationTimeoutException(Exception):
+    def __init__(self, timeout: float = 0):
+        super().__init__(f'Function did not finish within {timeout:g}s')
+        self.timeout = timeout
+
+class PayloadTooLargeException(Exception):
+    def __init__(self, limit: int = 0):
+        super().__init__(f'Request body is larger than {limit} bytes')
+        self.limit = limit
+
+class InvalidArchiveException(Exception):
+    pass
+
+class ResultTooLargeException(Exception):
+    def __init__(self, limit: int = 0):
+        super().__init__(f'Function result is larger than {limit} bytes')
+        self.limit = limit
+
+class DependencyInstallException(Exception):
+    def __init__(self, message: str, log: str = ''):
+        super().__init__(message)
+        self.log = log
@@ -9,5 +9,9 @@ from .permission import Permission
 from .secret import Secret
 from .schedule import Schedule
 from .schedule_log import ScheduleLog
+from .invocation import Invocation
+from .build import Build
+from .invocation_log import InvocationLog
+from .invocation_rollup import InvocationRollup
 
 from .data import ProjectData
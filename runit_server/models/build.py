@@ -0,0 +1,151 @@
+from datetime import datetime
+from typing import ClassVar, Optional
+from odbms import DBMS, Model
+
+
+class Build(Model):
+    TABLE_NAME = 'builds'
+
+    QUEUED: ClassVar[str] = 'queued'
+    RUNNING: ClassVar[str] = 'running'
+    SUCCEEDED: ClassVar[str] = 'succeeded'
+    FAILED: ClassVar[str] = 'failed'
+    FINISHED: ClassVar[tuple] = ('succeeded', 'failed')
+
+    token: Optional[str] = None
+    project_id: Optional[str] = None
+    user_id: Optional[str] = None
+    reason: Optional[str] = None
+    path: Optional[str] = None
+    version: Optional[str] = None
+    status: Optional[str] = 'queued'
+    layer: Optional[str] = None
+    cached: Optional[bool] = None
+    log: Optional[str] = None
+    error_message: Optional[str] = None
+    duration_ms: Optional[int] = None
+
+    def __init__(self, token: str, project_id: str, user_id: str, reason: str, path: str,
+                 version: str = None, status: str = 'queued', layer: str = None,
+                 cached: bool = None, log: str = None, error_message: str = None,
+                 duration_ms: int = None, created_at=None, updated_at=None, id=None):
+
+        if isinstance(created_at, str):
+            try:
+                created_at = datetime.fromisoformat(created_at)
+            except ValueError:
+                created_at = datetime.strptime(created_at, "%a %b %d %Y %H:%M:%S")
+        if isinstance(updated_at, str):
+            try:
+                updated_at = datetime.fromisoformat(updated_at)
+            except ValueError:
+                updated_at = datetime.strptime(updated_at, "%a %b %d %Y %H:%M:%S")
+
+        if duration_ms is not None:
+            duration_ms = int(duration_ms)
+        if isinstance(cached, str):
+            cached = cached.lower() in ('1', 'true')
+        elif cached is not None:
+            cached = bool(cached)
+
+        init_kwargs = {
+            "token": token,
+            "project_id": project_id,
+            "user_id": user_id,
+            "reason": reason,
+            "path": path,
+            "version": version,
+            "status": status,
+            "layer": layer,
+            "cached": cached,
+            "log": log,
+            "error_message": error_message,
+            "duration_ms": duration_ms,
+        }
+        if created_at is not None:
+            init_kwargs["created_at"] = created_at
+        if updated_at is not None:
+            init_kwargs["updated_at"] = updated_at
+        if id is not None:
+            init_kwargs["id"] = id
+
+        super().__init__(**init_kwargs)
+        self.token = token
+        self.project_id = project_id
+        self.user_id = user_id
+        self.reason = reason
+        self.path = path
+        self.version = version
+        self.status = status
+        self.layer = layer
+        self.cached = cached
+        self.log = log
+        self.error_message = error_message
+        self.duration_ms = duration_ms
+
+    async def save(self):
+        data = {
+            'token': self.token,
+            'project_id': self.project_id,
+            'user_id': self.user_id,
+            'reason': self.reason,
+            'path': self.path,
+            'version': self.version,
+            'status': self.status,
+            'layer': self.layer,
+            'cached': self.cached,
+            'log': self.log,
+            'error_message': self.error_message,
+            'duration_ms': self.duration_ms,
+            'created_at': datetime.now()
+        }
+
+        if self.id is None:
+            result = await DBMS.Database.insert_one(self.TABLE_NAME, self.normalise(data, 'params'))
+            if result:
+                self.id = result
+            return result
+
+        if 'id' in data:
+            del data['id']
+        return await DBMS.Database.update_one(self.TABLE_NAME, self.normalise({'id': self.id}, 'params'), self.normalise(data, 'params'))
+
+    def json(self) -> dict:
+        data = super().json()
+        data['id'] = self.token
+        data['project_id'] = str(self.project_id)
+        data['user_id'] = str(self.user_id)
+        del data['token']
+        del data['path']
+        return data
+
+    @classmethod
+    async def get_by_token(cls, token: str):
+        build = await DBMS.Database.find_one(cls.TABLE_NAME, cls.normalise({'token': token}, 'params'))
+        return cls(**cls.normalise(build)) if build else None
+
+    @classmethod
+    async def get_by_version(cls, project_id: str, version: str):
+        build = await DBMS.Database.find_one(
+            cls.TABLE_NAME, cls.normalise({'project_id': str(project_id), 'version': version}, 'params')
+        )
+        return cls(**cls.normalise(build)) if build else None
+
+    @classmethod
+    async def get_pending(cls):
+        builds = []
+        for status in (cls.QUEUED, cls.RUNNING):
+            found = await DBMS.Database.find(cls.TABLE_NAME, cls.normalise({'status': status}, 'params'))
+            builds.extend(cls(**cls.normalise(elem)) for elem in found)
+        # Oldest first, so recovered builds run in the order they were queued
+        return sorted(builds, key=lambda build: str(build.created_at))
+
+    @classmethod
+    async def get_by_project(cls, project_id: str, limit: int = 20):
+        builds = await DBMS.Database.find(
+            cls.TABLE_NAME,
+            cls.normalise({'project_id': project_id}, 'params'),
+            limit=limit,
+            sort=[('created_at', -1)]
+        )
+        return [cls(**cls.normalise(elem)) for elem in builds]
@@ -0,0 +1,146 @@
+import json
+from datetime import datetime
+from typing import ClassVar, Optional
+from odbms import DBMS, Model
+
+
+class Invocation(Model):
+    TABLE_NAME = 'invocations'
+
+    QUEUED: ClassVar[str] = 'queued'
+    RUNNING: ClassVar[str] = 'running'
+    SUCCEEDED: ClassVar[str] = 'succeeded'
+    FAILED: ClassVar[str] = 'failed'
+    FINISHED: ClassVar[tuple] = ('succeeded', 'failed')
+
+    token: Optional[str] = None
+    project_id: Optional[str] = None
+    user_id: Optional[str] = None
+    function: Optional[str] = None
+    params: Optional[str] = None
+    files: Optional[str] = None
+    status: Optional[str] = 'queued'
+    result: Optional[str] = None
+    error_message: Optional[str] = None
+    duration_ms: Optional[int] = None
+    cpu_ms: Optional[int] = None
+    peak_rss_mb: Optional[float] = None
+
+    def __init__(self, token: str, project_id: str, user_id: str, function: str,
+                 params: str = '{}', files: str = '[]', status: str = 'queued', result: str = None,
+                 error_message: str = None, duration_ms: int = None,
+                 cpu_ms: int = None, peak_rss_mb: float = None, created_at=None, updated_at=None, id=None):
+
+        if isinstance(created_at, str):
+            try:
+                created_at = datetime.fromisoformat(created_at)
+            except ValueError:
+                created_at = datetime.strptime(created_at, "%a %b %d %Y %H:%M:%S")
+        if isinstance(updated_at, str):
+            try:
+                updated_at = datetime.fromisoformat(updated_at)
+            except ValueError:
+                updated_at = datetime.strptime(updated_at, "%a %b %d %Y %H:%M:%S")
+
+        if duration_ms is not None:
+            duration_ms = int(duration_ms)
+        if cpu_ms is not None:
+            cpu_ms = int(cpu_ms)
+        if peak_rss_mb is not None:
+            peak_rss_mb = float(peak_rss_mb)
+
+        init_kwargs = {
+            "token": token,
+            "project_id": project_id,
+            "user_id": user_id,
+            "function": function,
+            "params": params,
+            "files": files,
+            "status": status,
+            "result": result,
+            "error_message": error_message,
+            "duration_ms": duration_ms,
+            "cpu_ms": cpu_ms,
+            "peak_rss_mb": peak_rss_mb,
+        }
+        if created_at is not None:
+            init_kwargs["created_at"] = created_at
+        if updated_at is not None:
+            init_kwargs["updated_at"] = updated_at
+        if id is not None:
+            init_kwargs["id"] = id
+
+        super().__init__(**init_kwargs)
+        self.token = token
+        self.project_id = project_id
+        self.user_id = user_id
+        self.function = function
+        self.params = params
+        self.files = files
+        self.status = status
+        self.result = result
+        self.error_message = error_message
+        self.duration_ms = duration_ms
+        self.cpu_ms = cpu_ms
+        self.peak_rss_mb = peak_rss_mb
+
+    async def save(self):
+        data = {
+            'token': self.token,
+            'project_id': self.project_id,
+            'user_id': self.user_id,
+            'function': self.function,
+            'params': self.params,
+            'files': self.files,
+            'status': self.status,
+            'result': self.result,
+            'error_message': self.error_message,
+            'duration_ms': self.duration_ms,
+            'cpu_ms': self.cpu_ms,
+            'peak_rss_mb': self.peak_rss_mb,
+            'created_at': datetime.now()
+        }
+
+        if self.id is None:
+            result = await DBMS.Database.insert_one(self.TABLE_NAME, self.normalise(data, 'params'))
+            if result:
+                self.id = result
+            return result
+
+        if 'id' in data:
+            del data['id']
+        return await DBMS.Database.update_one(self.TABLE_NAME, self.normalise({'id': self.id}, 'params'), self.normalise(data, 'params'))
+
+    def json(self) -> dict:
+        data = super().json()
+        data['id'] = self.token
+        data['project_id'] = str(self.project_id)
+        data['user_id'] = str(self.user_id)
+        data['params'] = json.loads(self.params) if self.params else {}
+        data['result'] = json.loads(self.result) if self.result else None
+        del data['token']
+        data.pop('files', None)
+        return data
+
+    @classmethod
+    async def get_by_token(cls, token: str):
+        invocation = await DBMS.Database.find_one(cls.TABLE_NAME, cls.normalise({'token': token}, 'params'))
+        return cls(**cls.normalise(invocation)) if invocation else None
+
+    @classmethod
+    async def get_pending(cls):
+        invocations = []
+        for status in (cls.QUEUED, cls.RUNNING):
+            found = await DBMS.Database.find(cls.TABLE_NAME, cls.normalise({'status': status}, 'params'))
+            invocations.extend(cls(**cls.normalise(elem)) for elem in found)
+        return invocations
+
+    @classmethod
+    async def get_by_project(cls, project_id: str, limit: int = 50):
+        invocations = await DBMS.Database.find(
+            cls.TABLE_NAME,
+            cls.normalise({'project_id': project_id}, 'params'),
+            limit=limit,
+            sort=[('created_at', -1)]
+        )
+        return [cls(**cls.normalise(elem)) for elem in invocations]
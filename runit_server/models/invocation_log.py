@@ -0,0 +1,98 @@
+import inspect
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from odbms import DBMS, Model
+
+
+class InvocationLog(Model):
+    TABLE_NAME = 'invocation_logs'
+
+    project_id: Optional[str] = None
+    function: Optional[str] = None
+    status: Optional[int] = None
+    duration_ms: Optional[int] = None
+    bytes_out: Optional[int] = None
+    client_ip: Optional[str] = None
+    day: Optional[str] = None
+    cpu_ms: Optional[int] = None
+    peak_rss_mb: Optional[float] = None
+
+    def __init__(self, project_id: str, function: str, status: int = None,
+                 duration_ms: int = None, bytes_out: int = None, client_ip: str = None,
+                 day: str = None, cpu_ms: int = None, peak_rss_mb: float = None,
+                 created_at=None, updated_at=None, id=None):
+
+        if isinstance(created_at, str):
+            try:
+                created_at = datetime.fromisoformat(created_at)
+            except ValueError:
+                created_at = datetime.strptime(created_at, "%a %b %d %Y %H:%M:%S")
+        if isinstance(updated_at, str):
+            try:
+                updated_at = datetime.fromisoformat(updated_at)
+            except ValueError:
+                updated_at = datetime.strptime(updated_at, "%a %b %d %Y %H:%M:%S")
+
+        status = int(status) if status is not None else None
+        duration_ms = int(duration_ms) if duration_ms is not None else None
+        bytes_out = int(bytes_out) if bytes_out is not None else None
+        cpu_ms = int(cpu_ms) if cpu_ms is not None else None
+        peak_rss_mb = float(peak_rss_mb) if peak_rss_mb is not None else None
+
+        init_kwargs = {
+            "project_id": project_id,
+            "function": function,
+            "status": status,
+            "duration_ms": duration_ms,
+            "bytes_out": bytes_out,
+            "client_ip": client_ip,
+            "day": day,
+            "cpu_ms": cpu_ms,
+            "peak_rss_mb": peak_rss_mb,
+        }
+        if created_at is not None:
+            init_kwargs["created_at"] = created_at
+        if updated_at is not None:
+            init_kwargs["updated_at"] = updated_at
+        if id is not None:
+            init_kwargs["id"] = id
+
+        super().__init__(**init_kwargs)
+        self.project_id = project_id
+        self.function = function
+        self.status = status
+        self.duration_ms = duration_ms
+        self.bytes_out = bytes_out
+        self.client_ip = client_ip
+        self.day = day
+        self.cpu_ms = cpu_ms
+        self.peak_rss_mb = peak_rss_mb
+
+    def json(self) -> dict:
+        data = super().json()
+        data['id'] = str(self.id)
+        data['project_id'] = str(self.project_id)
+        return data
+
+    @classmethod
+    async def insert_entries(cls, entries: List[Dict[str, Any]]):
+        """Write a batch of entries with a single insert_many."""
+        result = DBMS.Database.insert_many(cls.TABLE_NAME, [cls.normalise(entry, 'params') for entry in entries])
+        # Not every backend's insert_many is a coroutine
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    @classmethod
+    async def get_by_project(cls, project_id: str, limit: int = 50):
+        logs = await DBMS.Database.find(
+            cls.TABLE_NAME,
+            cls.normalise({'project_id': project_id}, 'params'),
+            limit=limit,
+            sort=[('created_at', -1)]
+        )
+        return [cls(**cls.normalise(elem)) for elem in logs]
+
+    @classmethod
+    async def delete_by_day(cls, day: str):
+        return await DBMS.Database.delete_many(cls.TABLE_NAME, cls.normalise({'day': day}, 'params'))
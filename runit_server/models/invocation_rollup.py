@@ -0,0 +1,95 @@
+from datetime import datetime
+from typing import Optional
+from odbms import DBMS, Model
+
+
+class InvocationRollup(Model):
+    TABLE_NAME = 'invocation_rollups'
+
+    project_id: Optional[str] = None
+    function: Optional[str] = None
+    day: Optional[str] = None
+    invocations: Optional[int] = 0
+    errors: Optional[int] = 0
+    duration_ms: Optional[int] = 0
+    bytes_out: Optional[int] = 0
+
+    def __init__(self, project_id: str, function: str, day: str, invocations: int = 0,
+                 errors: int = 0, duration_ms: int = 0, bytes_out: int = 0,
+                 created_at=None, updated_at=None, id=None):
+
+        if isinstance(created_at, str):
+            try:
+                created_at = datetime.fromisoformat(created_at)
+            except ValueError:
+                created_at = datetime.strptime(created_at, "%a %b %d %Y %H:%M:%S")
+        if isinstance(updated_at, str):
+            try:
+                updated_at = datetime.fromisoformat(updated_at)
+            except ValueError:
+                updated_at = datetime.strptime(updated_at, "%a %b %d %Y %H:%M:%S")
+
+        init_kwargs = {
+            "project_id": project_id,
+            "function": function,
+            "day": day,
+            "invocations": int(invocations or 0),
+            "errors": int(errors or 0),
+            "duration_ms": int(duration_ms or 0),
+            "bytes_out": int(bytes_out or 0),
+        }
+        if created_at is not None:
+            init_kwargs["created_at"] = created_at
+        if updated_at is not None:
+            init_kwargs["updated_at"] = updated_at
+        if id is not None:
+            init_kwargs["id"] = id
+
+        super().__init__(**init_kwargs)
+        self.project_id = project_id
+        self.function = function
+        self.day = day
+        self.invocations = init_kwargs['invocations']
+        self.errors = init_kwargs['errors']
+        self.duration_ms = init_kwargs['duration_ms']
+        self.bytes_out = init_kwargs['bytes_out']
+
+    def json(self) -> dict:
+        data = super().json()
+        data['id'] = str(self.id)
+        data['project_id'] = str(self.project_id)
+        return data
+
+    @classmethod
+    async def add(cls, project_id: str, function: str, day: str, invocations: int,
+                  errors: int, duration_ms: int, bytes_out: int):
+        """Add to the totals of a project function for a day, creating the row if needed."""
+        conditions = {'project_id': project_id, 'function': function, 'day': day}
+        rollup = await DBMS.Database.find_one(cls.TABLE_NAME, cls.normalise(conditions, 'params'))
+        if rollup is None:
+            return await DBMS.Database.insert_one(cls.TABLE_NAME, cls.normalise({
+                **conditions,
+                'invocations': invocations,
+                'errors': errors,
+                'duration_ms': duration_ms,
+                'bytes_out': bytes_out,
+                'created_at': datetime.now()
+            }, 'params'))
+
+        rollup = cls(**cls.normalise(rollup))
+        return await cls.update_one(conditions, {
+            'invocations': rollup.invocations + invocations,
+            'errors': rollup.errors + errors,
+            'duration_ms': rollup.duration_ms + duration_ms,
+            'bytes_out': rollup.bytes_out + bytes_out
+        })
+
+    @classmethod
+    async def get_by_project(cls, project_id: str, limit: int = 30):
+        rollups = await DBMS.Database.find(
+            cls.TABLE_NAME,
+            cls.normalise({'project_id': project_id}, 'params'),
+            limit=limit,
+            sort=[('day', -1)]
+        )
+        return [cls(**cls.normalise(elem)) for elem in rollups]
@@ -1,6 +1,9 @@
 import os
 import sys
+import json
 import shelve
+import hashlib
+from zipfile import ZipFile
 from getpass import getpass
 
 import requests
@@ -16,6 +19,13 @@ PROJECTS_API = BASE_API+'projects/'
 CURRENT_PATH = os.path.dirname(os.path.realpath(__file__))
 BASE_HEADERS = {}
 
+# Blobs sent per request during a delta publish
+BLOB_BATCH_FILES = 200
+BLOB_BATCH_BYTES = 16 * 1024 * 1024
+
+# Seconds the server may hold each build status request
+BUILD_POLL_WAIT = 30
+
 def load_token(access_token = None):
     curdir = os.curdir
     os.chdir(RUNIT_HOMEDIR)
@@ -196,10 +206,87 @@ class Account():
         except Exception as e:
             print(str(e))
     
+    @staticmethod
+    def _upload_blobs(blobs: dict):
+        req = requests.post(PROJECTS_API + 'blobs', files=blobs, headers=BASE_HEADERS)
+        req.raise_for_status()
+
+    @staticmethod
+    def _publish_delta(files: dict, data: dict):
+        '''
+        Publish only the files the server does not have yet
+
+        Sends a manifest of the SHA-256 of every file in the project archive,
+        uploads the contents the server reports missing and publishes the
+        manifest. Returns None if the server does not support delta publishing.
+        '''
+        archive = next(iter(files.values()), None)
+        if isinstance(archive, tuple):
+            archive = archive[1]
+        if archive is None:
+            return None
+
+        try:
+            with ZipFile(archive, 'r') as zipfile:
+                manifest = {
+                    info.filename: hashlib.sha256(zipfile.read(info)).hexdigest()
+                    for info in zipfile.infolist() if not info.is_dir()
+                }
+
+                req = requests.post(PROJECTS_API + 'publish/manifest', json={'files': manifest}, headers=BASE_HEADERS)
+                if req.status_code in (404, 405):
+                    return None
+                req.raise_for_status()
+                missing = set(req.json().get('missing', []))
+
+                # One copy of each missing content, sent in batches
+                blobs, size = {}, 0
+                for name, digest in manifest.items():
+                    if digest not in missing or digest in blobs:
+                        continue
+                    content = zipfile.read(name)
+                    blobs[digest] = (digest, content)
+                    size += len(content)
+                    if len(blobs) >= BLOB_BATCH_FILES or size >= BLOB_BATCH_BYTES:
+                        Account._upload_blobs(blobs)
+                        missing -= set(blobs)
+                        blobs, size = {}, 0
+                if blobs:
+                    Account._upload_blobs(blobs)
+        finally:
+            if hasattr(archive, 'seek'):
+                archive.seek(0)
+
+        req = requests.post(PROJECTS_API + 'publish', data={**data, 'manifest': json.dumps(manifest)},
+                            headers=BASE_HEADERS)
+        return req.json()
+
+    @staticmethod
+    def _wait_for_build(result: dict):
+        '''
+        Wait for the dependency build of a publish the server is still installing
+
+        @param result Response of the publish request
+        @return The publish result once its build has finished
+        '''
+        build = result.get('build') or {}
+        while result.get('status') == 'building' and build.get('url'):
+            req = requests.get(build['url'], params={'wait': BUILD_POLL_WAIT}, headers=BASE_HEADERS)
+            req.raise_for_status()
+            build = req.json()['build']
+            if build['status'] == 'succeeded':
+                result['status'] = 'success'
+            elif build['status'] == 'failed':
+                raise Exception(f"[Error] Installing dependencies failed: {build.get('error_message')}\n{build.get('log') or ''}")
+        return result
+
     @staticmethod
     def publish_project(files: dict, data: dict):
         '''
-        Retrieve account details
+        Publish a project
+
+        Only files that changed since an earlier publish are uploaded when
+        the server supports it, else the whole archive is.
         
         @param files Zipfile of project
         @param data Project Config
@@ -212,13 +299,15 @@ class Account():
 
             BASE_HEADERS['Authorization'] = f"Bearer {token}"
 
-            req = requests.post(PROJECTS_API, data=data, 
-                        files=files, headers=BASE_HEADERS)
-            result = req.json()
+            result = Account._publish_delta(files, data)
+            if result is None:
+                req = requests.post(PROJECTS_API, data=data, 
+                            files=files, headers=BASE_HEADERS)
+                result = req.json()
 
             if 'msg' in result.keys() and len(result['msg']):
                 raise Exception(f"[Error] {result['msg']}")
-            return result
+            return Account._wait_for_build(result)
 
         except Exception as e:
             print(str(e))
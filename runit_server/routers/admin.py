@@ -1,6 +1,6 @@
+import asyncio
 import logging
 import os
-import shutil
 import time
 from pathlib import Path
 from typing import Annotated, Optional, Dict
@@ -26,6 +26,11 @@ from ..models import Database
 from ..models import Collection
 from ..models import Schedule
 from ..models import ScheduleLog
+from ..services.invoker import invalidate_project
+from ..services.usage import usage_stats
+from ..services.build import load_import_profile
+from ..services.releases import remove_project
+from ..services.layers import layer_store
 
 from ..constants import (
     PROJECTS_DIR,
@@ -40,6 +45,7 @@ ADMIN_PROJECTS_INDEX = 'admin_list_projects'
 ADMIN_ADMINISTRATORS_INDEX = 'admin_list_administrators'
 
 from runit import RunIt
+from ..common.runtime import ServerRunIt
 
 admin = APIRouter(
     prefix="/admin",
@@ -50,9 +56,14 @@ admin = APIRouter(
 @admin.get('/')
 async def admin_dashboard(request: Request):
     admin = await Admin.get(request.session['admin_id'])
+    # Counting layer references walks every release, so it runs in a thread
+    loop = asyncio.get_event_loop()
+    layer_stats = await loop.run_in_executor(None, layer_store.get_stats)
+    layers = await loop.run_in_executor(None, layer_store.list_layers)
     return templates.TemplateResponse('admin/index.html', context={
         'request': request, 'page': 'home', 'admin': admin,
-        'admin_name': admin.name if admin else ''})
+        'admin_name': admin.name if admin else '',
+        'layer_stats': layer_stats, 'layers': layers})
 
 @admin.get('/users/')
 async def admin_list_users(request: Request, view: Optional[str] = None):
@@ -201,10 +212,9 @@ async def admin_delete_user(request: Request, user_id: str, background_task: Bac
         projects = await Project.get_by_user(str(user.id))
 
         for project in projects:
-            project_path = Path(PROJECTS_DIR, str(project.id))
-            if project_path.exists():
-                background_task.add_task(shutil.rmtree, project_path)
+            background_task.add_task(remove_project, str(project.id))
             await Project.delete_many({'id': str(project.id), 'user_id': str(user.id)})
+            invalidate_project(str(project.id))
 
         await Database.delete_many({'user_id': str(user.id)})
         await Admin.delete_many({'email': user.email})
@@ -430,7 +440,7 @@ async def admin_get_project(request: Request, project_id):
 
     environs = dotenv_values('.env')
 
-    runit = RunIt(**RunIt.load_config())
+    runit = ServerRunIt(**ServerRunIt.load_config())
 
     funcs = []
     for func in runit.get_functions():
@@ -442,7 +452,9 @@ async def admin_get_project(request: Request, project_id):
         project_data = project.json()
         return templates.TemplateResponse('admin/projects/details.html', context={
             'request': request, 'page': 'projects', 'project': project_data,
-            'environs': environs, 'funcs': funcs, 'icons': LANGUAGE_TO_ICONS})
+            'environs': environs, 'funcs': funcs, 'icons': LANGUAGE_TO_ICONS,
+            'usage': usage_stats.project_stats(str(project.id)),
+            'import_profile': load_import_profile(str(Path(PROJECTS_DIR, str(project.id))))})
     else:
         flash(request, 'Project does not exist', 'danger')
         return RedirectResponse(request.url_for('admin_list_projects'))
@@ -515,7 +527,8 @@ async def admin_delete_project(request: Request, project_id, background_task: Ba
         
         if project:
             await Project.delete_many({'id': project_id, 'user_id': user_id})
-            background_task.add_task(shutil.rmtree, Path(PROJECTS_DIR, str(project.id)))
+            invalidate_project(str(project.id))
+            background_task.add_task(remove_project, str(project.id))
             flash(request, 'Project deleted successfully', category='success')
         else:
             flash(request, 'Project was not found. Operation not successful.', category='danger')
@@ -1,10 +1,11 @@
 
+import json
 import logging
+import asyncio
 import os
-import shutil
 from pathlib import Path
 from datetime import datetime
-from typing import Annotated, Optional
+from typing import Annotated, Dict, Optional
 import aiofiles
 
 from fastapi.responses import JSONResponse, StreamingResponse
@@ -21,14 +22,43 @@ from ...models import Project
 from ...models import User
 from ...models import ProjectData
 from ...models import Collection
+from ...models import Build
 
 from ...core import flash
+from ...services.invoker import invalidate_project, prewarm_project
+from ...services.build import precompile_project, record_import_profile, extract_archive
+from ...services.build_queue import build_queue
+from ...services.blobs import (
+    parse_manifest,
+    manifest_digest,
+    missing_blobs,
+    store_blob,
+    assemble_release,
+    prune_blobs
+)
+from ...services.releases import (
+    project_releases_dir,
+    new_release,
+    activate_release,
+    discard_release,
+    prune_releases,
+    list_releases,
+    previous_release,
+    has_release,
+    remove_project
+)
 
 from runit import RunIt
+from ...common.runtime import ServerRunIt
+from ...common.bodies import check_content_length, save_upload, discard_file
+from ...common.responses import APIResponse
+from ...exceptions import PayloadTooLargeException, InvalidArchiveException
 from ...constants import (
     DOCKER_TEMPLATES,
     PROJECTS_DIR,
-    LANGUAGE_TO_RUNTIME
+    LANGUAGE_TO_RUNTIME,
+    PUBLISH_MAX_UPLOAD,
+    BUILD_MAX_WAIT
 )
 
 PROJECT_404_ERROR = 'Project does not exist'
@@ -152,12 +182,27 @@ async def api_publish_user_project(
     '''
 
     try:
+        check_content_length(request, PUBLISH_MAX_UPLOAD)
         form_data = await request.form()
         data = dict(form_data)
         file = data.pop('file', None)
-        if file is None:
+        manifest = data.pop('manifest', None)
+        if file is None and manifest is None:
             return JSONResponse({'status': 'error', 'message': 'No project file provided.'}, status_code=400)
 
+        if manifest is not None:
+            # Delta publish: the files were uploaded to the blob store beforehand
+            try:
+                manifest = parse_manifest(json.loads(manifest))                      # type: ignore
+            except ValueError:
+                raise InvalidArchiveException('Manifest is not valid JSON')
+            missing = missing_blobs(manifest.values(), user.id)
+            if missing:
+                return JSONResponse(
+                    {'status': 'error', 'message': 'Upload missing blobs first.', 'missing': missing},
+                    status_code=status.HTTP_409_CONFLICT
+                )
+
         result = {'status': 'success'}
         raw_project_id = str(data.get('_id', '')).strip().lower()
 
@@ -183,53 +228,144 @@ async def api_publish_user_project(
                 del data['_id']
                 await Project.update_one({'id': project_id}, data)
 
-        PROJECT_PATH = Path(PROJECTS_DIR, project_id).resolve()
-        if not PROJECT_PATH.exists():
-            os.mkdir(PROJECT_PATH)
-            
-        filepath = Path(PROJECT_PATH, file.filename)                                 # type: ignore
-        contents = await file.read()                                                 # type: ignore
-        async with aiofiles.open(filepath, 'wb') as f:
-            await f.write(contents)
-        await file.close()                                                           # type: ignore
-
-        RunIt.extract_project(filepath)
-        os.chdir(PROJECT_PATH)
-
-        runit = RunIt(**RunIt.load_config())
-        
-        if RunIt.DOCKER:
-            docker_file = f"{runit.runtime}.dockerfile"
-            full_docker_filepath = f"{os.path.join(DOCKER_TEMPLATES, docker_file)}"
-            print(f'[~] {full_docker_filepath}')
-            project_docker_file = os.path.join(PROJECT_PATH, 'Dockerfile')
-            
-            if not os.path.exists(project_docker_file):
-                with open(full_docker_filepath, 'rt') as nf:
-                    with open(project_docker_file, 'wt') as pf:
-                        content = nf.read()
-                        pf.write(content)
-
-            background_task.add_task(RunIt.dockerize, str(PROJECT_PATH))   # type: ignore
+        archive = None
+        if manifest is not None:
+            digest = manifest_digest(manifest)
         else:
-            runit.install_dependency_packages()
-        
-        runit._id = project_id
-        runit.update_config()
-        
+            # Written to disk as it is read, never held in memory as a whole
+            archive, _, digest = await save_upload(
+                file, project_releases_dir(project_id), PUBLISH_MAX_UPLOAD, prefix='.upload-', digest=True  # type: ignore
+            )
+
+        # Each publish is built in a release of its own and only goes live once complete
+        PROJECT_PATH = Path(PROJECTS_DIR, project_id)
+        release_path = None
+        build = None
+        try:
+            release_path = new_release(project_id, digest)                           # type: ignore
+            loop = asyncio.get_event_loop()
+            if archive is None:
+                await loop.run_in_executor(None, assemble_release, manifest, str(release_path))
+            else:
+                await loop.run_in_executor(None, extract_archive, archive, str(release_path))
+                discard_file(archive)
+            os.chdir(release_path)
+
+            runit = ServerRunIt(**ServerRunIt.load_config())
+
+            if RunIt.DOCKER:
+                docker_file = f"{runit.runtime}.dockerfile"
+                full_docker_filepath = f"{os.path.join(DOCKER_TEMPLATES, docker_file)}"
+                print(f'[~] {full_docker_filepath}')
+                project_docker_file = os.path.join(release_path, 'Dockerfile')
+
+                if not os.path.exists(project_docker_file):
+                    with open(full_docker_filepath, 'rt') as nf:
+                        with open(project_docker_file, 'wt') as pf:
+                            content = nf.read()
+                            pf.write(content)
+
+                # Built once the release is live; the image is tagged with the project id
+                background_task.add_task(RunIt.dockerize, str(PROJECT_PATH))   # type: ignore
+
+            runit._id = project_id
+            runit.update_config()
+            await asyncio.get_event_loop().run_in_executor(None, precompile_project, str(release_path))
+            if RunIt.DOCKER:
+                activate_release(project_id, release_path.name, carry=False)
+            else:
+                # The build queue installs the dependencies, then puts the release live
+                build = await build_queue.submit(project_id, user.id, str(release_path), 'publish', release_path.name)
+        except BaseException:
+            if archive is not None:
+                discard_file(archive)
+            if release_path is not None and build is None:
+                discard_release(project_id, release_path.name)
+            raise
+
+        result['version'] = release_path.name
         funcs = []
         for func in runit.get_functions():
             funcs.append(f"{request.base_url}{project_id}/{func}")
         
         result['functions'] = funcs                                                         # type: ignore
         result['homepage'] = funcs[0] if len(funcs) else ''
+        background_task.add_task(prune_blobs)
+
+        if build is None:
+            # Idle workers are retired now and busy ones once their call returns
+            invalidate_project(project_id)
+            background_task.add_task(prewarm_project, project_id)
+            background_task.add_task(record_import_profile, str(PROJECT_PATH))
+            background_task.add_task(prune_releases, project_id)
+            return result
+
+        build = await build_queue.wait(build.token, BUILD_MAX_WAIT) or build
+        url = str(request.url_for('api_get_build', build_id=build.token))
+        result['build'] = {'id': build.token, 'status': build.status, 'url': url}
+        if build.status == Build.FAILED:
+            return JSONResponse(
+                {'status': 'error', 'message': 'Error installing dependencies.', 'build': result['build']},
+                status_code=status.HTTP_400_BAD_REQUEST
+            )
+        if build.status != Build.SUCCEEDED:
+            # Still installing; the release goes live once the build is done
+            result['status'] = 'building'
+            return JSONResponse(result, status.HTTP_202_ACCEPTED, headers={'Location': url})
         return result
     
+    except PayloadTooLargeException as e:
+        return APIResponse.payload_too_large(e.limit)
+    except InvalidArchiveException as e:
+        return JSONResponse({'status': 'error', 'message': str(e)}, status_code=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         logging.exception(e)
         return JSONResponse({'status': 'error', 'message': "Error publishing project."})
     
 
+class ManifestData(BaseModel):
+    files: Dict[str, str]
+
+@projects_api.post('/publish/manifest')
+async def api_publish_manifest(
+    user: Annotated[User, Depends(get_current_user)],
+    manifest: ManifestData
+):
+    '''
+    First step of a delta publish
+
+    @param files Relative path of every project file mapped to its SHA-256
+    @return Digests of the files to upload before publishing
+    '''
+    try:
+        files = parse_manifest(manifest.files)
+    except InvalidArchiveException as e:
+        return JSONResponse({'status': 'error', 'message': str(e)}, status_code=status.HTTP_400_BAD_REQUEST)
+
+    return JSONResponse({'status': 'success', 'missing': missing_blobs(files.values(), user.id)})
+
+@projects_api.post('/blobs')
+async def api_upload_blobs(
+    request: Request,
+    user: Annotated[User, Depends(get_current_user)]
+):
+    '''
+    Upload file contents for a delta publish, each part named by its SHA-256
+    '''
+    try:
+        check_content_length(request, PUBLISH_MAX_UPLOAD)
+        form_data = await request.form()
+        stored = 0
+        for digest, upload in form_data.multi_items():
+            if not isinstance(upload, str):
+                await store_blob(upload, digest, user.id)
+                stored += 1
+        return JSONResponse({'status': 'success', 'stored': stored})
+    except PayloadTooLargeException as e:
+        return APIResponse.payload_too_large(e.limit)
+    except InvalidArchiveException as e:
+        return JSONResponse({'status': 'error', 'message': str(e)}, status_code=status.HTTP_400_BAD_REQUEST)
+
 @projects_api.get('/clone/{project_name}')
 async def api_clone_user_project(
     request: Request,
@@ -253,12 +389,12 @@ async def api_clone_user_project(
                 raise FileNotFoundError('Project not found!')
                 
             os.chdir(project_path)
-            config = RunIt.load_config()
+            config = ServerRunIt.load_config()
             
             if not config:
                 raise FileNotFoundError('Project not found!')
             
-            runit_project = RunIt(**config)
+            runit_project = ServerRunIt(**config)
             filename = runit_project.compress()
             # os.chdir(WORKDIR)
             file_path = Path(project_path, filename)
@@ -302,7 +438,7 @@ async def api_get_project_details(
 
     environs = dotenv_values('.env')
     
-    runit = RunIt(**RunIt.load_config())
+    runit = ServerRunIt(**ServerRunIt.load_config())
 
     funcs = []
     for func in runit.get_functions():
@@ -325,6 +461,79 @@ async def api_get_project_details(
         
     return JSONResponse(response)
 
+@projects_api.get('/{project_id}/releases')
+async def api_list_project_releases(
+    user: Annotated[User, Depends(get_current_user)],
+    project_id: str
+):
+    project = await Project.find_one({'id': project_id, 'user_id': user.id})
+    if not project:
+        return JSONResponse({'status': 'error', 'message': PROJECT_404_ERROR}, status_code=status.HTTP_404_NOT_FOUND)
+
+    return JSONResponse({'status': 'success', 'releases': list_releases(project_id)})
+
+@projects_api.get('/builds/{build_id}')
+async def api_get_build(
+    user: Annotated[User, Depends(get_current_user)],
+    build_id: str,
+    wait: int = 0
+):
+    '''
+    Status, log and duration of a dependency build
+
+    @param build_id Build id
+    @param wait Seconds to wait for the build to finish
+    '''
+    build = await build_queue.wait(build_id, min(max(wait, 0), BUILD_MAX_WAIT))
+    if not build or build.user_id != str(user.id):
+        return JSONResponse({'status': 'error', 'message': 'Build does not exist'}, status_code=status.HTTP_404_NOT_FOUND)
+    return JSONResponse({'status': 'success', 'build': build.json()})
+
+@projects_api.get('/{project_id}/builds')
+async def api_list_project_builds(
+    user: Annotated[User, Depends(get_current_user)],
+    project_id: str
+):
+    project = await Project.find_one({'id': project_id, 'user_id': user.id})
+    if not project:
+        return JSONResponse({'status': 'error', 'message': PROJECT_404_ERROR}, status_code=status.HTTP_404_NOT_FOUND)
+
+    builds = [build.json() for build in await Build.get_by_project(project_id)]
+    return JSONResponse({'status': 'success', 'builds': builds})
+
+@projects_api.post('/{project_id}/rollback')
+async def api_rollback_project(
+    user: Annotated[User, Depends(get_current_user)],
+    project_id: str,
+    background_task: BackgroundTasks,
+    version: Optional[str] = None
+):
+    '''
+    Serve an earlier release of a project again
+
+    @param project_id Project _id
+    @param version Release to serve, the one before the current release by default
+    '''
+    project = await Project.find_one({'id': project_id, 'user_id': user.id})
+    if not project:
+        return JSONResponse({'status': 'error', 'message': PROJECT_404_ERROR}, status_code=status.HTTP_404_NOT_FOUND)
+
+    version = version or previous_release(project_id)
+    if not version or not has_release(project_id, version):
+        return JSONResponse({'status': 'error', 'message': 'No such release to roll back to.'},
+                            status_code=status.HTTP_404_NOT_FOUND)
+
+    # Releases still being built, or whose build failed, never go live
+    build = await Build.get_by_version(project_id, version)
+    if build is not None and build.status != Build.SUCCEEDED:
+        return JSONResponse({'status': 'error', 'message': f'Release {version} is not built ({build.status}).'},
+                            status_code=status.HTTP_409_CONFLICT)
+
+    activate_release(project_id, version)
+    invalidate_project(project_id)
+    background_task.add_task(prewarm_project, project_id)
+    return JSONResponse({'status': 'success', 'version': version})
+
 @projects_api.delete('/{project_ids}')
 @projects_api.delete('/{project_ids}/')
 async def api_delete_user_project(
@@ -348,7 +557,8 @@ async def api_delete_user_project(
             
             if project:
                 await project.delete()
-                background_task.add_task(shutil.rmtree, Path(PROJECTS_DIR, str(project.id)).resolve())
+                invalidate_project(str(project.id))
+                background_task.add_task(remove_project, str(project.id))
 
     except Exception:
         response['status'] = 'error'
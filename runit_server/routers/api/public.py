@@ -1,29 +1,38 @@
-import os
-from pathlib import Path
+import json
 import time
+import asyncio
 import logging
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
 from fastapi import FastAPI, HTTPException, Request, status, APIRouter
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel, EmailStr
-from typing import Optional
 from datetime import timedelta
 
 from runit import RunIt
 
-from ...models.project import Project
-from ...models.secret import Secret
-from ...core import jsonify
+from ...exceptions import (
+    ProjectBusyException,
+    InvocationTimeoutException,
+    PayloadTooLargeException,
+    ResultTooLargeException
+)
+from ...common.responses import APIResponse
+from ...common.bodies import discard_after
+from ...services.invoker import run_project_async, get_invocation_metadata, pool_capacity
+from ...services.limiter import ConcurrencyLimiter, concurrency_limiter
+from ...services.invocation_log import note_usage
+from ...services.jobs import job_queue
+from ..public import wants_async, invocation_params, stream_format, stream_project, result_response
 from ...common.security import authenticate, create_access_token, Token
 from ...models import User
 from ...models import Admin
 from ...common import Utils
 from ...constants import (
-    RUNIT_HOMEDIR,
-    PROJECTS_DIR,
-    API_VERSION
+    API_VERSION,
+    JOB_MAX_WAIT,
+    BATCH_MAX_CALLS
 )
 
 from dotenv import load_dotenv
@@ -48,6 +57,15 @@ class UserData(BaseModel):
     password: str
     cpassword: str
 
+class BatchCall(BaseModel):
+    project_id: str
+    function: str = 'index'
+    params: Dict[str, Any] = {}
+
+class BatchData(BaseModel):
+    calls: List[BatchCall]
+    stream: bool = False
+
 
 
 # Login endpoint
@@ -95,6 +113,129 @@ async def api_register(
 
     return JSONResponse({"access_token": access_token, "token_type": "bearer"})
 
+async def run_batch_call(call: BatchCall, projects: dict) -> bytes:
+    """Run one call of a batch and return its outcome as a JSON object."""
+    metadata = projects.get(call.project_id)
+    if not metadata or not metadata.published:
+        outcome = {'status': 'error', 'message': 'Project not found'}
+        return json.dumps(outcome).encode()
+    try:
+        # Batches describe reads fanned out by aggregators, so they share cached results
+        result = await run_project_async(
+            call.project_id,
+            call.function,
+            call.params,
+            metadata.env_vars,
+            metadata.project.user_id,
+            idempotent=True
+        )
+        # Results are spliced in as the worker encoded them
+        return b'{"status": "success", "data": ' + result.json() + b'}'
+    except ProjectBusyException as e:
+        outcome = {'status': 'error', 'message': 'Too many requests', 'retry_after': e.retry_after}
+    except InvocationTimeoutException as e:
+        outcome = {'status': 'error', 'message': str(e), 'error_code': 'TIMEOUT'}
+    except ResultTooLargeException as e:
+        outcome = {'status': 'error', 'message': str(e), 'error_code': 'RESULT_TOO_LARGE'}
+    except Exception as e:
+        logging.exception(e)
+        outcome = {'status': 'error', 'message': str(e)}
+    return json.dumps(outcome).encode()
+
+@public_api.post('/batch')
+async def run_batch_api(data: BatchData):
+    if len(data.calls) > BATCH_MAX_CALLS:
+        return APIResponse.error(f'A batch can hold at most {BATCH_MAX_CALLS} calls', 'BATCH_TOO_LARGE', 413)
+
+    # Look each project up once, however many calls target it
+    project_ids = list(dict.fromkeys(call.project_id for call in data.calls))
+    projects = {project_id: await get_invocation_metadata(project_id) for project_id in project_ids}
+    # The batch's calls to a project, and to all projects of one owner, take no
+    # more slots at a time than the shared gates hand out. The rest wait in a
+    # queue of the batch's own that holds all of it, instead of filling the
+    # shared queues and turning the batch's later calls away with 429
+    pacing = ConcurrencyLimiter(concurrency_limiter.project_limit, concurrency_limiter.user_limit, len(data.calls))
+
+    async def indexed(index: int, call: BatchCall):
+        metadata = projects.get(call.project_id)
+        if not metadata or not metadata.published:
+            return index, await run_batch_call(call, projects)
+        async with pacing.slot(call.project_id, metadata.project.user_id, pool_capacity(call.project_id)):
+            return index, await run_batch_call(call, projects)
+
+    tasks = [asyncio.ensure_future(indexed(i, call)) for i, call in enumerate(data.calls)]
+
+    if not data.stream:
+        results = await asyncio.gather(*tasks)
+        body = b'{"status": "success", "data": [' + b', '.join(result for _, result in results) + b']}'
+        return Response(body, media_type='application/json')
+
+    async def stream_results():
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                index, result = await next_done
+                yield b'{"index": %d, ' % index + result[1:] + b'\n'
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type='application/x-ndjson')
+
+@public_api.get('/invocations/{invocation_id}')
+async def get_invocation_api(request: Request, invocation_id: str, wait: int = 0):
+    invocation = await job_queue.wait(invocation_id, min(max(wait, 0), JOB_MAX_WAIT))
+    if not invocation:
+        return APIResponse.not_found('Invocation')
+    return JSONResponse(invocation.json())
+
+@public_api.post('/{project_id}')
+@public_api.post('/{project_id}/{function}')
+@public_api.put('/{project_id}')
+@public_api.put('/{project_id}/{function}')
+async def invoke_project_api(request: Request, project_id: str, function: Optional[str] = None):
+    params: dict = {}
+    files: list = []
+    try:
+        metadata = await get_invocation_metadata(project_id)
+        if not metadata:
+            logging.warning('Project not found')
+            return JSONResponse(RunIt.notfound(), status.HTTP_404_NOT_FOUND)
+
+        project = metadata.project
+        params, files = await invocation_params(request)
+        function = function if function else 'index'
+
+        if wants_async(request):
+            # The job removes the body files once it has run
+            invocation = await job_queue.submit(project_id, project.user_id, function, params, files)
+            url = str(request.url_for('get_invocation_api', invocation_id=invocation.token))
+            return JSONResponse(
+                {'status': invocation.status, 'id': invocation.token, 'url': url},
+                status.HTTP_202_ACCEPTED,
+                headers={'Location': url}
+            )
+
+        env_vars = metadata.env_vars
+        fmt = stream_format(request)
+        if fmt:
+            response = await stream_project(fmt, project_id, function, params, env_vars, project.user_id)
+        else:
+            result = await run_project_async(project_id, function, params, env_vars, project.user_id)
+            note_usage(request, result)
+            response = result_response(result)
+    except PayloadTooLargeException as e:
+        return APIResponse.payload_too_large(e.limit)
+    except ProjectBusyException as e:
+        response = APIResponse.rate_limited(e.retry_after)
+    except InvocationTimeoutException as e:
+        response = APIResponse.gateway_timeout(e.timeout)
+    except ResultTooLargeException as e:
+        response = APIResponse.result_too_large(e.limit)
+    except Exception as e:
+        logging.exception(e)
+        response = JSONResponse(RunIt.notfound(), status.HTTP_404_NOT_FOUND)
+    return discard_after(response, files)
+
 @public_api.get('/{project_id}')
 @public_api.get('/{project_id}/{function}')
 async def run_project_api(request: Request, project_id: str, function: Optional[str] = None):
@@ -103,30 +244,42 @@ async def run_project_api(request: Request, project_id: str, function: Optional[
         excluded = ['favicon.ico']
         if project_id in excluded:
             return None
-        project = await Project.get(project_id)
-        if not project:
+        metadata = await get_invocation_metadata(project_id)
+        if not metadata:
             logging.warning('Project not found')
             return JSONResponse(RunIt.notfound(), status.HTTP_404_NOT_FOUND)
         # elif project.private and request.session.get('user_id') != project.user_id:
         #     logging.warning('Project is private')
         #     return JSONResponse(RunIt.notfound(), status.HTTP_404_NOT_FOUND)
         
-        secret = await Secret.find_one({'project_id': project_id})
-        if secret and secret.variables:
-            environs = secret.variables
-            for key, value in environs.items():
-                os.environ[key] = value
-        
-        current_project_dir = Path(PROJECTS_DIR, str(project_id)).resolve()
+        project = metadata.project
+        env_vars = metadata.env_vars
         function = function if function else 'index'
-        if current_project_dir.is_dir():
-            result = RunIt.start(project_id, function, PROJECTS_DIR, request.query_params._dict)
-            os.chdir(RUNIT_HOMEDIR)
-            response = await jsonify(result)
+        if metadata.published:
+            fmt = stream_format(request)
+            if fmt:
+                return await stream_project(
+                    fmt, project_id, function, dict(request.query_params), env_vars, project.user_id
+                )
+            result = await run_project_async(
+                project_id,
+                function,
+                dict(request.query_params),
+                env_vars,
+                project.user_id,
+                idempotent=True
+            )
             t1 = time.perf_counter() # Record the stop time
             elapsed_time = t1 - t0 # Calculate elapsed time
             print(f'Time taken: {elapsed_time:.8f} seconds')
-            return JSONResponse(response) if type(response) is dict else response
+            note_usage(request, result)
+            return result_response(result)
+    except ProjectBusyException as e:
+        return APIResponse.rate_limited(e.retry_after)
+    except InvocationTimeoutException as e:
+        return APIResponse.gateway_timeout(e.timeout)
+    except ResultTooLargeException as e:
+        return APIResponse.result_too_large(e.limit)
     except Exception as e:
         logging.exception(e)
         return JSONResponse(RunIt.notfound(), status.HTTP_404_NOT_FOUND)
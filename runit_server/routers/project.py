@@ -2,7 +2,6 @@
 import json
 import logging
 import os
-import shutil
 from time import sleep
 from pathlib import Path
 from datetime import datetime
@@ -23,8 +22,13 @@ from ..models import Project
 from ..models import Secret
 from ..models import User
 from ..models import ProjectData
+from ..services.invoker import invalidate_project, invalidate_metadata
+from ..services.build import load_import_profile
+from ..services.releases import remove_project
+from ..services.build_queue import build_queue
 
 from runit import RunIt
+from ..common.runtime import ServerRunIt
 from ..constants import (
     RUNIT_HOMEDIR,
     PROJECTS_DIR,
@@ -157,8 +161,7 @@ async def create_user_project(
                         await file.write(file_content.decoded_content)
             
             
-            runit = RunIt(**RunIt.load_config())
-            background_task.add_task(runit.install_dependency_packages)
+            await build_queue.submit(project_id, user_id, str(Path(PROJECTS_DIR, project_id).resolve()), 'import')
         else:
             config['name'] = project_id
             background_task.add_task(create_runit_project, config, project.name)
@@ -203,7 +206,7 @@ async def user_project_details(request: Request, project_id: str):
 
     environs = {}
     
-    runit = RunIt(**RunIt.load_config())
+    runit = ServerRunIt(**ServerRunIt.load_config())
 
     funcs = []
     for func in runit.get_functions():
@@ -211,6 +214,7 @@ async def user_project_details(request: Request, project_id: str):
     
     os.chdir(old_curdir)
 
+    import_profile = load_import_profile(str(Path(PROJECTS_DIR, str(project.id)).resolve()))
     project = project.json()        # type: ignore
     del project['author']
     project['functions'] = len(funcs)
@@ -221,7 +225,8 @@ async def user_project_details(request: Request, project_id: str):
         
         return templates.TemplateResponse('projects/details.html', context={
             'request': request, 'page': 'projects','project': project, 
-            'environs': environs, 'funcs': funcs, 'user': user, 'icons': LANGUAGE_TO_ICONS})
+            'environs': environs, 'funcs': funcs, 'user': user, 'icons': LANGUAGE_TO_ICONS,
+            'import_profile': import_profile})
     else:
         flash(request, PROJECT_404_ERROR, 'danger')
         return RedirectResponse(request.url_for(PROJECT_INDEX_URL_NAME))
@@ -230,8 +235,6 @@ async def user_project_details(request: Request, project_id: str):
 @project.get('/reinstall/{project_id}/')
 async def reinstall_project_dependencies(request: Request, project_id: str, background_task: BackgroundTasks):
     try:
-        old_curdir = os.curdir
-        
         project = await Project.get(project_id)
         if not project:
             flash(request, PROJECT_404_ERROR, 'danger')
@@ -241,12 +244,11 @@ async def reinstall_project_dependencies(request: Request, project_id: str, back
             flash(request, PROJECT_404_ERROR, 'danger')
             return RedirectResponse(request.url_for(PROJECT_INDEX_URL_NAME))
 
-        os.chdir(Path(PROJECTS_DIR, str(project.id)).resolve())
-        runit = RunIt(**RunIt.load_config())
-        background_task.add_task(runit.install_dependency_packages)
-        
-        os.chdir(old_curdir)
-        flash(request, "Dependencies installation has started", "success")
+        # Workers are refreshed once the build is done
+        await build_queue.submit(
+            str(project.id), project.user_id, str(Path(PROJECTS_DIR, str(project.id)).resolve()), 'reinstall'
+        )
+        flash(request, "Dependencies installation has been queued", "success")
     except Exception as e:
         logging.error(str(e))
         flash(request, "Error installing dependencies", "danger")
@@ -262,9 +264,8 @@ async def delete_user_project(request: Request, project_id, background_task: Bac
         
         if project:
             await Project.delete_many({'id': project_id, 'user_id': user_id})
-            project_folder = Path(PROJECTS_DIR, str(project.id)).resolve()
-            if project_folder.exists() and project_folder.is_dir():
-                background_task.add_task(shutil.rmtree, project_folder)
+            invalidate_project(str(project.id))
+            background_task.add_task(remove_project, str(project.id))
             flash(request, 'Project deleted successfully', category='success')
         else:
             flash(request, 'Project was not found. Operation not successful.', category='danger')
@@ -291,6 +292,7 @@ async def user_project_environ(request: Request, project_id):
     
     secret.variables = data
     await secret.save()
+    invalidate_metadata(project_id)
 
     # project = Project.get(project_id)
     flash(request, 'Environment variables updated successfully', category='success')
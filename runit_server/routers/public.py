@@ -1,24 +1,31 @@
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
 import os
 import json
 import logging
-from pathlib import Path
 import time
-from typing import Annotated, Optional, Dict, Any
+from typing import Annotated, List, Optional, Tuple
 from urllib.parse import urlencode, urlparse, parse_qsl, urlunparse
 
-from fastapi.responses import RedirectResponse, JSONResponse
+from fastapi.responses import RedirectResponse, JSONResponse, StreamingResponse, Response, FileResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi import APIRouter, Form, Request, WebSocket, WebSocketDisconnect, Depends, status, HTTPException
 
-from ..core import WSConnectionManager, flash, templates, jsonify
+from ..core import WSConnectionManager, flash, templates
+from ..exceptions import (
+    ProjectBusyException,
+    InvocationTimeoutException,
+    PayloadTooLargeException,
+    ResultTooLargeException
+)
+from ..common.responses import APIResponse
+from ..common.results import EncodedResult
+from ..common.bodies import body_params, discard_after
 from ..common.security import authenticate, create_access_token, get_session_user
 from ..models import User
 from ..models import Admin
-from ..models import Project
-from ..models import Secret
-from ..common.utils import Utils, rate_limiter, csrf
+from ..common.utils import Utils, rate_limiter, csrf, get_client_ip
+from ..services.invoker import run_project_async, stream_project_async, get_invocation_metadata
+from ..services.jobs import job_queue
+from ..services.invocation_log import note_usage
 
 from runit import RunIt
 
@@ -27,7 +34,7 @@ from dotenv import find_dotenv, dotenv_values
 from ..constants import (
     DOTENV_FILE,
     RUNIT_HOMEDIR,
-    PROJECTS_DIR
+    JOB_MAX_WAIT
 )
 
 REGISTER_HTML_TEMPLATE = 'register.html'
@@ -155,14 +162,6 @@ async def registration_page(request: Request):
     next_path = request.query_params.get("next")
     return templates.TemplateResponse(REGISTER_HTML_TEMPLATE, context=_register_template_context(request, next_path))
 
-def get_client_ip(request: Request) -> str:
-    """Extract client IP address from request."""
-    forwarded = request.headers.get("X-Forwarded-For")
-    if forwarded:
-        return forwarded.split(",")[0].strip()
-    return request.client.host if request.client else "unknown"
-
-
 @public.post('/register')
 async def register(
     request: Request,
@@ -312,22 +311,133 @@ async def admin_login(request: Request, form_data: OAuth2PasswordRequestForm = D
     flash(request, 'Invalid Login Credentials', 'danger')
     return RedirectResponse(request.url_for('admin_login_page'), status_code=status.HTTP_303_SEE_OTHER)
 
-_project_executor = ThreadPoolExecutor(max_workers=10, thread_name_prefix="project_runner")
-
+def wants_async(request: Request) -> bool:
+    """Check whether the caller asked for the invocation to run in the background."""
+    prefer = request.headers.get('Prefer', '')
+    flag = request.query_params.get('async', '')
+    return 'respond-async' in prefer.lower() or flag.lower() in ('1', 'true', 'yes')
+
+async def invocation_params(request: Request) -> Tuple[dict, List[str]]:
+    """Collect function parameters from the query string and the request body, with the body's temporary files."""
+    params = dict(request.query_params)
+    params.pop('async', None)
+    body, files = await body_params(request)
+    params.update(body)
+    return params, files
+
+def stream_format(request: Request) -> Optional[str]:
+    """Pick the streaming format the caller accepts, if any."""
+    accept = request.headers.get('Accept', '')
+    if 'text/event-stream' in accept:
+        return 'sse'
+    if 'application/x-ndjson' in accept:
+        return 'ndjson'
+    return None
+
+class ResultFileResponse(FileResponse):
+    """Sends a result spooled to disk; keeps it alive, and so its file, until sent."""
+
+    def __init__(self, result: EncodedResult):
+        super().__init__(result.path, media_type=result.content_type)
+        self.result = result
+
+def result_response(result: EncodedResult) -> Response:
+    """Send a result as the worker encoded it."""
+    if result.path:
+        return ResultFileResponse(result)
+    return Response(result.body, media_type=result.content_type)
+
+async def stream_project(fmt: str, project_id: str, function: str, params: dict,
+                         env_vars: dict, user_id: Optional[str]) -> StreamingResponse:
+    """
+    Forward a function's output to the client as Server-Sent Events or NDJSON.
+
+    The first chunk is awaited before the response starts, so a project
+    that is busy still gets a proper 429.
+    """
+    chunks = stream_project_async(project_id, function, params, env_vars, user_id)
+    try:
+        first = [await chunks.__anext__()]
+    except StopAsyncIteration:
+        first = []
+
+    def encode(chunk, event: Optional[str] = None) -> bytes:
+        data = chunk.json() if isinstance(chunk, EncodedResult) else json.dumps(chunk).encode()
+        if fmt == 'ndjson':
+            return data + b'\n'
+        return (f'event: {event}\n' if event else '').encode() + b'data: ' + data + b'\n\n'
+
+    async def events():
+        try:
+            for chunk in first:
+                yield encode(chunk)
+            async for chunk in chunks:
+                yield encode(chunk)
+            if fmt == 'sse':
+                yield encode(None, 'end')
+        except Exception as e:
+            logging.exception(e)
+            yield encode({'status': 'error', 'message': str(e)}, 'error')
+        finally:
+            await chunks.aclose()
+
+    media_type = 'text/event-stream' if fmt == 'sse' else 'application/x-ndjson'
+    return StreamingResponse(events(), media_type=media_type, headers={'Cache-Control': 'no-cache'})
+
+@public.get('/invocations/{invocation_id}')
+async def get_invocation(request: Request, invocation_id: str, wait: int = 0):
+    invocation = await job_queue.wait(invocation_id, min(max(wait, 0), JOB_MAX_WAIT))
+    if not invocation:
+        return JSONResponse({'status': 'error', 'message': 'Invocation not found'}, status.HTTP_404_NOT_FOUND)
+    return JSONResponse(invocation.json())
+
+@public.post('/{project_id}')
+@public.post('/{project_id}/{function}')
+@public.put('/{project_id}')
+@public.put('/{project_id}/{function}')
+async def invoke_project(request: Request, project_id: str, function: Optional[str] = None):
+    params: dict = {}
+    files: list = []
+    try:
+        metadata = await get_invocation_metadata(project_id)
+        if not metadata:
+            logging.warning('Project not found')
+            return JSONResponse(RunIt.notfound(), status.HTTP_404_NOT_FOUND)
 
-async def run_project_async(
-    project_id: str, 
-    function: str, 
-    projects_dir: str, 
-    params: Dict[str, Any]
-) -> Any:
-    """Run project in thread pool to avoid blocking event loop."""
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(
-        _project_executor,
-        lambda: asyncio.run(RunIt.start(project_id, function, projects_dir, params))
-    )
+        project = metadata.project
+        params, files = await invocation_params(request)
+        function = function if function else 'index'
 
+        if wants_async(request):
+            # The job removes the body files once it has run
+            invocation = await job_queue.submit(project_id, project.user_id, function, params, files)
+            url = str(request.url_for('get_invocation', invocation_id=invocation.token))
+            return JSONResponse(
+                {'status': invocation.status, 'id': invocation.token, 'url': url},
+                status.HTTP_202_ACCEPTED,
+                headers={'Location': url}
+            )
+
+        env_vars = metadata.env_vars
+        fmt = stream_format(request)
+        if fmt:
+            response = await stream_project(fmt, project_id, function, params, env_vars, project.user_id)
+        else:
+            result = await run_project_async(project_id, function, params, env_vars, project.user_id)
+            note_usage(request, result)
+            response = result_response(result)
+    except PayloadTooLargeException as e:
+        return APIResponse.payload_too_large(e.limit)
+    except ProjectBusyException as e:
+        response = APIResponse.rate_limited(e.retry_after)
+    except InvocationTimeoutException as e:
+        response = APIResponse.gateway_timeout(e.timeout)
+    except ResultTooLargeException as e:
+        response = APIResponse.result_too_large(e.limit)
+    except Exception as e:
+        logging.exception(e)
+        response = JSONResponse(RunIt.notfound(), status.HTTP_404_NOT_FOUND)
+    return discard_after(response, files)
 
 @public.get('/{project_id}')
 @public.get('/{project_id}/{function}')
@@ -337,47 +447,41 @@ async def run_project(request: Request, project_id: str, function: Optional[str]
         excluded = ['favicon.ico']
         if project_id in excluded:
             return None
-        project = await Project.get(project_id)
+        metadata = await get_invocation_metadata(project_id)
 
-        if not project:
+        if not metadata:
             logging.warning('Project not found')
             return JSONResponse(RunIt.notfound(), status.HTTP_404_NOT_FOUND)
         
-        secret = await Secret.find_one({'project_id': project_id})
-        env_vars = {}
-        if secret and secret.variables:
-            env_vars = secret.variables.copy()
-        
-        current_project_dir = Path(PROJECTS_DIR, str(project_id)).resolve()
+        project = metadata.project
+        env_vars = metadata.env_vars
         function = function if function else 'index'
-        if current_project_dir.is_dir():
-            original_env = dict(os.environ)
-            try:
-                for key, value in env_vars.items():
-                    os.environ[key] = str(value)
-                
-                result = await run_project_async(
-                    project_id, 
-                    function, 
-                    PROJECTS_DIR, 
-                    dict(request.query_params)
+        if metadata.published:
+            fmt = stream_format(request)
+            if fmt:
+                return await stream_project(
+                    fmt, project_id, function, dict(request.query_params), env_vars, project.user_id
                 )
-            finally:
-                for key in env_vars.keys():
-                    if key in original_env:
-                        os.environ[key] = original_env[key]
-                    else:
-                        os.environ.pop(key, None)
+            result = await run_project_async(
+                project_id, 
+                function, 
+                dict(request.query_params),
+                env_vars,
+                project.user_id,
+                idempotent=True
+            )
             
-            response = await jsonify(result)
             t1 = time.perf_counter()
             elapsed_time = t1 - t0
             logging.info(f'Project {project_id} executed in {elapsed_time:.4f}s')
-            if isinstance(response, dict):
-                return JSONResponse(response)
-            if response is None:
-                return JSONResponse(None)
-            return JSONResponse(response)
+            note_usage(request, result)
+            return result_response(result)
+    except ProjectBusyException as e:
+        return APIResponse.rate_limited(e.retry_after)
+    except InvocationTimeoutException as e:
+        return APIResponse.gateway_timeout(e.timeout)
+    except ResultTooLargeException as e:
+        return APIResponse.result_too_large(e.limit)
     except Exception as e:
         logging.exception(e)
         return JSONResponse(RunIt.notfound(), status.HTTP_404_NOT_FOUND)
\ No newline at end of file
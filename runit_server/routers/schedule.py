@@ -11,7 +11,7 @@ from ..core import flash, templates
 from ..common import get_session
 from ..models import User, Project, Schedule, ScheduleLog
 
-from runit import RunIt
+from ..common.runtime import ServerRunIt
 from ..constants import (
     PROJECTS_DIR,
     LANGUAGE_TO_ICONS
@@ -98,7 +98,7 @@ async def list_project_schedules(request: Request, project_id: str):
     
     functions = []
     try:
-        runit = RunIt(**RunIt.load_config())
+        runit = ServerRunIt(**ServerRunIt.load_config())
         for func in runit.get_functions():
             functions.append({'name': func})
     except Exception:
@@ -299,7 +299,7 @@ async def get_project_functions(request: Request, project_id: str):
     
     functions = []
     try:
-        runit = RunIt(**RunIt.load_config())
+        runit = ServerRunIt(**ServerRunIt.load_config())
         for func in runit.get_functions():
             functions.append(func)
     except Exception as e:
@@ -0,0 +1,100 @@
+/**
+ * Long-lived Node.js host for a runit project.
+ *
+ * Reads one JSON request per line on stdin:
+ *     {"function": "name", "args": "a, b", "env": {...}}
+ * and answers each with one JSON line on stdout:
+ *     {"ok": true, "result": ...} | {"ok": false, "error": "..."}
+ *
+ * The project module is required once and reused for every call.
+ * console output and direct writes to process.stdout by project code go
+ * to stderr so they cannot corrupt the protocol.
+ */
+const readline = require('readline');
+
+const filename = process.argv[2];
+const write = process.stdout.write.bind(process.stdout);
+const log = (...args) => process.stderr.write(args.map(String).join(' ') + '\n');
+
+console.log = log;
+console.info = log;
+console.debug = log;
+process.stdout.write = (chunk, ...rest) => process.stderr.write(chunk, ...rest);
+
+const baseEnv = { ...process.env };
+let methods = null;
+let loadError = null;
+
+try {
+    methods = require(filename);
+} catch (error) {
+    loadError = error.toString().split('\n')[0];
+}
+
+function reply(message) {
+    write(JSON.stringify(message) + '\n');
+}
+
+function restoreEnv() {
+    for (const key of Object.keys(process.env)) {
+        if (!(key in baseEnv)) delete process.env[key];
+    }
+    Object.assign(process.env, baseEnv);
+}
+
+async function invoke(request) {
+    if (loadError !== null) {
+        return { ok: false, error: loadError };
+    }
+
+    const method = methods[request.function];
+    if (typeof method !== 'function') {
+        return { ok: true, notfound: true };
+    }
+    if (method.length && !request.args) {
+        return { ok: true, result: '[!] No arguments provided' };
+    }
+
+    for (const [key, value] of Object.entries(request.env || {})) {
+        process.env[key] = String(value);
+    }
+    try {
+        const result = request.args ? await method(request.args) : await method();
+        return { ok: true, result: result === undefined ? null : result };
+    } catch (error) {
+        return { ok: false, error: String(error) };
+    } finally {
+        restoreEnv();
+    }
+}
+
+const lines = readline.createInterface({ input: process.stdin });
+const queue = [];
+let busy = false;
+
+async function drain() {
+    if (busy) return;
+    busy = true;
+    while (queue.length) {
+        let response;
+        try {
+            response = await invoke(JSON.parse(queue.shift()));
+        } catch (error) {
+            response = { ok: false, error: String(error) };
+        }
+        try {
+            reply(response);
+        } catch (error) {
+            reply({ ok: true, result: String(response.result) });
+        }
+    }
+    busy = false;
+}
+
+lines.on('line', (line) => {
+    queue.push(line);
+    drain();
+});
+lines.on('close', () => process.exit(0));
+
+reply({ ready: true });
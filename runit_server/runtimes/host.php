@@ -0,0 +1,90 @@
+<?php
+/**
+ * Long-lived PHP host for a runit project.
+ *
+ * Reads one JSON request per line on STDIN:
+ *     {"function": "name", "args": "a, b", "env": {...}}
+ * and answers each with one JSON line on STDOUT:
+ *     {"ok": true, "result": ...} | {"ok": false, "error": "..."}
+ *
+ * The project file is included once and reused for every call. Output
+ * echoed by a function becomes its result when it returns nothing.
+ */
+
+$filename = $argv[1];
+$manager = $argv[2] ?? '';
+
+function reply($message)
+{
+    $line = json_encode($message, JSON_INVALID_UTF8_SUBSTITUTE | JSON_PARTIAL_OUTPUT_ON_ERROR);
+    fwrite(STDOUT, $line . "\n");
+    fflush(STDOUT);
+}
+
+$loadError = null;
+try {
+    if ($manager && is_file($manager)) {
+        require_once $manager;
+        (new Runit\Controller\DotEnvEnvironment)->load(dirname($filename));
+    }
+    ob_start();
+    include_once $filename;
+    ob_end_clean();
+} catch (Throwable $th) {
+    $loadError = $th->getMessage();
+}
+
+$baseEnv = getenv();
+
+function invoke($request)
+{
+    global $loadError, $baseEnv;
+
+    if ($loadError !== null) {
+        return ['ok' => false, 'error' => $loadError];
+    }
+
+    $function = $request['function'] ?? '';
+    if (!is_string($function) || !function_exists($function)) {
+        return ['ok' => true, 'notfound' => true];
+    }
+
+    $args = $request['args'] ?? '';
+    $reflection = new ReflectionFunction($function);
+    if ($reflection->getNumberOfParameters() && $args === '') {
+        return ['ok' => true, 'result' => '[!] No arguments provided'];
+    }
+
+    $env = $request['env'] ?? [];
+    foreach ($env as $key => $value) {
+        putenv(sprintf('%s=%s', $key, $value));
+        $_ENV[$key] = $value;
+    }
+
+    ob_start();
+    try {
+        $result = $args === '' ? $function() : $function($args);
+        $output = ob_get_clean();
+        return ['ok' => true, 'result' => $result ?? $output];
+    } catch (Throwable $th) {
+        ob_end_clean();
+        return ['ok' => false, 'error' => $th->getMessage()];
+    } finally {
+        foreach ($env as $key => $value) {
+            if (array_key_exists($key, $baseEnv)) {
+                putenv(sprintf('%s=%s', $key, $baseEnv[$key]));
+                $_ENV[$key] = $baseEnv[$key];
+            } else {
+                putenv($key);
+                unset($_ENV[$key]);
+            }
+        }
+    }
+}
+
+reply(['ready' => true]);
+
+while (($line = fgets(STDIN)) !== false) {
+    $request = json_decode($line, true);
+    reply(is_array($request) ? invoke($request) : ['ok' => false, 'error' => 'Invalid request']);
+}
@@ -0,0 +1,203 @@
+"""
+Content-addressed store of published project files.
+
+Clients publish a manifest mapping each file of a project to the SHA-256
+of its content and upload only the blobs the server does not have yet.
+Blobs live under BLOBS_DIR/<first two hex digits>/<digest>, read-only,
+so a file that did not change between publishes takes no upload.
+Releases get writable copies of them, cloned copy-on-write where the
+file system supports it, since project code may write to its own files.
+
+Blobs not used for a grace period are removed by prune_blobs(); blobs
+still hardlinked into releases assembled by earlier versions are kept.
+
+The store is shared by all users, but each user only sees the blobs they
+uploaded themselves: an index of digests per user, under OWNERS_DIR,
+decides which blobs count as present for a user and which a manifest of
+theirs may reference. Otherwise anyone could learn whether someone else
+has a file, such as a guessed .env, or pull it into a release of theirs.
+"""
+import os
+import re
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+from starlette.datastructures import UploadFile
+
+from ..common.bodies import save_upload, discard_file
+from ..exceptions import InvalidArchiveException
+from ..constants import (
+    BLOBS_DIR,
+    BLOB_GRACE_PERIOD,
+    PUBLISH_MAX_UPLOAD,
+    PUBLISH_MAX_EXTRACTED,
+    PUBLISH_MAX_ENTRIES
+)
+
+logger = logging.getLogger(__name__)
+
+DIGEST = re.compile(r'^[0-9a-f]{64}$')
+UPLOAD_DIR = Path(BLOBS_DIR, 'tmp')
+OWNERS_DIR = Path(BLOBS_DIR, 'owners')
+
+# ioctl that makes a file share the extents of another (Btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+
+def is_digest(value: str) -> bool:
+    return bool(DIGEST.match(value))
+
+
+def blob_path(digest: str) -> Path:
+    return Path(BLOBS_DIR, digest[:2], digest)
+
+
+def owner_path(user_id: str, digest: str) -> Path:
+    """Entry recording that `user_id` uploaded the blob `digest`."""
+    user = hashlib.sha256(str(user_id).encode()).hexdigest()[:32]
+    return Path(OWNERS_DIR, user, digest[:2], digest)
+
+
+def parse_manifest(files: Dict[str, str], max_entries: int = PUBLISH_MAX_ENTRIES) -> Dict[str, str]:
+    """
+    Validate a manifest of relative file paths to digests.
+
+    Returns it with normalised paths; raises InvalidArchiveException for
+    paths outside the project, malformed digests or too many entries.
+    """
+    if not isinstance(files, dict) or not files:
+        raise InvalidArchiveException('Manifest lists no files')
+    if max_entries and len(files) > max_entries:
+        raise InvalidArchiveException(f'Manifest has more than {max_entries} entries')
+
+    manifest = {}
+    for name, digest in files.items():
+        path = os.path.normpath(str(name).replace('\\', '/'))
+        if os.path.isabs(path) or path == '.' or path.split(os.sep)[0] == '..':
+            raise InvalidArchiveException(f'Invalid path in manifest: {name}')
+        if not isinstance(digest, str) or not is_digest(digest):
+            raise InvalidArchiveException(f'Invalid digest for {name}')
+        manifest[path] = digest
+    return manifest
+
+
+def manifest_digest(files: Dict[str, str]) -> str:
+    """Hash identifying the content of a whole manifest."""
+    return hashlib.sha256(json.dumps(files, sort_keys=True).encode()).hexdigest()
+
+
+def missing_blobs(digests: Iterable[str], user_id: str) -> List[str]:
+    """
+    Digests `user_id` has to upload: those the store does not have and
+    those that only other users uploaded.
+
+    Blobs that are present have their grace period restarted, so they are
+    not pruned before the publish that is about to use them.
+    """
+    missing = set()
+    now = time.time()
+    for digest in set(digests):
+        if not owner_path(user_id, digest).is_file():
+            missing.add(digest)
+            continue
+        try:
+            os.utime(blob_path(digest), (now, now))
+        except FileNotFoundError:
+            missing.add(digest)
+    return sorted(missing)
+
+
+async def store_blob(upload: UploadFile, digest: str, user_id: str, limit: int = PUBLISH_MAX_UPLOAD):
+    """Add an uploaded file to the store for `user_id`, checking that its content matches `digest`."""
+    if not is_digest(digest):
+        raise InvalidArchiveException(f'Invalid digest: {digest}')
+
+    path, _, actual = await save_upload(upload, UPLOAD_DIR, limit, prefix='.blob-', digest=True)
+    if actual != digest:
+        discard_file(path)
+        raise InvalidArchiveException(f'Content of blob {digest} does not match its digest')
+
+    target = blob_path(digest)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    if target.is_file():
+        # Same content; the blob releases already link to stays in place
+        discard_file(path)
+        os.utime(target)
+    else:
+        os.chmod(path, 0o444)
+        os.replace(path, target)
+
+    owner = owner_path(user_id, digest)
+    owner.parent.mkdir(parents=True, exist_ok=True)
+    owner.touch()
+
+
+def clone_file(source: Path, target: Path):
+    """Copy `source` to a new writable file `target`, sharing its blocks where possible."""
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+        except OSError:
+            pass
+        shutil.copyfileobj(src, dst)
+
+
+def assemble_release(files: Dict[str, str], destination: str, max_size: int = PUBLISH_MAX_EXTRACTED):
+    """
+    Lay out the files of a manifest in `destination`.
+
+    Every file is a copy of its blob, so writes by the project stay in its
+    release, as they do for projects published as an archive. Blocks; run
+    it off the event loop.
+    """
+    sizes = {digest: blob_path(digest).stat().st_size for digest in set(files.values())}
+    if max_size and sum(sizes[digest] for digest in files.values()) > max_size:
+        raise InvalidArchiveException(f'Project is larger than {max_size} bytes')
+
+    for name, digest in files.items():
+        target = Path(destination, name)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if target.is_symlink() or target.exists():
+            target.unlink()
+        clone_file(blob_path(digest), target)
+
+
+def prune_blobs(grace_period: int = BLOB_GRACE_PERIOD) -> int:
+    """Remove blobs no release links to that were last used more than `grace_period` seconds ago."""
+    cutoff = time.time() - grace_period
+    removed = 0
+    store = Path(BLOBS_DIR)
+    if not store.is_dir():
+        return 0
+
+    for directory in store.iterdir():
+        if len(directory.name) != 2 or not directory.is_dir():
+            continue
+        for blob in directory.iterdir():
+            try:
+                stat = blob.stat()
+                if stat.st_nlink == 1 and stat.st_mtime < cutoff:
+                    blob.unlink()
+                    removed += 1
+            except OSError:
+                pass
+
+    # Index entries of removed blobs would otherwise let their digests be referenced
+    if OWNERS_DIR.is_dir():
+        for entry in OWNERS_DIR.glob('*/*/*'):
+            if not blob_path(entry.name).exists():
+                try:
+                    entry.unlink()
+                except OSError:
+                    pass
+
+    if removed:
+        logger.info(f"Pruned {removed} unused blobs")
+    return removed
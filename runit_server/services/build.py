@@ -0,0 +1,159 @@
+import os
+import re
+import sys
+import json
+import logging
+import compileall
+import subprocess
+from pathlib import Path
+from zipfile import ZipFile, BadZipFile
+from typing import Any, Dict, List, Optional
+
+from ..common.runtime import project_config
+from ..exceptions import InvalidArchiveException
+from ..constants import EXT_TO_LANG, IMPORT_PROFILE_TIMEOUT, PUBLISH_MAX_EXTRACTED, PUBLISH_MAX_ENTRIES
+
+logger = logging.getLogger(__name__)
+
+IMPORT_PROFILE_FILE = '.importtime.json'
+IMPORT_PROFILE_TOP = 20
+
+# Installed packages are byte-compiled by pip already
+SKIP_DIRS = re.compile(r'[/\\](venv|\.venv|node_modules|vendor|\.git)([/\\]|$)')
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$')
+
+# Imports the file in argv[2] under the name in argv[1] through the import
+# system, so -X importtime reports it however the file is named
+IMPORT_START_FILE = """
+import os, sys, importlib.util
+
+class StartFile:
+    @staticmethod
+    def find_spec(name, path=None, target=None):
+        if name == sys.argv[1]:
+            return importlib.util.spec_from_file_location(name, sys.argv[2])
+
+sys.meta_path.insert(0, StartFile)
+sys.path.insert(0, os.path.dirname(sys.argv[2]))
+__import__(sys.argv[1])
+"""
+
+
+def is_python_project(config: Dict[str, Any]) -> bool:
+    start_file = config.get('start_file', '')
+    return EXT_TO_LANG.get(os.path.splitext(start_file)[1].lower()) == 'python'
+
+
+def extract_archive(archive: str, destination: str, max_size: int = PUBLISH_MAX_EXTRACTED,
+                    max_entries: int = PUBLISH_MAX_ENTRIES):
+    """
+    Extract a published project archive into `destination`.
+
+    Archives with more than `max_entries` entries, or whose files add up to
+    more than `max_size` bytes once extracted, are refused before anything
+    is written (0 disables either limit). Blocks; run it off the event loop.
+    """
+    try:
+        with ZipFile(archive, 'r') as file:
+            entries = file.infolist()
+            if max_entries and len(entries) > max_entries:
+                raise InvalidArchiveException(f'Archive has more than {max_entries} entries')
+            # Extraction never writes more than the sizes recorded in the archive
+            if max_size and sum(entry.file_size for entry in entries) > max_size:
+                raise InvalidArchiveException(f'Archive extracts to more than {max_size} bytes')
+            file.extractall(destination)
+    except BadZipFile as e:
+        raise InvalidArchiveException(f'Not a valid project archive: {e}')
+
+
+def precompile_project(project_dir: str) -> bool:
+    """Byte-compile a project's Python sources so the first load skips compilation."""
+    return bool(compileall.compile_dir(project_dir, quiet=1, rx=SKIP_DIRS))
+
+
+def parse_importtime(output: str) -> List[Dict[str, Any]]:
+    """Turn `python -X importtime` output into one entry per imported module."""
+    imports = []
+    for line in output.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            imports.append({
+                'module': match.group(4),
+                'self_us': int(match.group(1)),
+                'cumulative_us': int(match.group(2)),
+                'depth': (len(match.group(3)) - 1) // 2
+            })
+    return imports
+
+
+def profile_imports(project_dir: str, start_file: str, timeout: float = IMPORT_PROFILE_TIMEOUT) -> Optional[Dict[str, Any]]:
+    """
+    Import a project's entry module under `-X importtime` in a fresh interpreter.
+
+    Uses the project's virtualenv when it has one. Returns the total import
+    time and the slowest imports by cumulative time, or None if the module
+    could not be imported in time.
+    """
+    python = Path(project_dir, 'venv', 'bin', 'python')
+    module = os.path.splitext(os.path.basename(start_file))[0]
+    # Any name without dots works; a dotted one would be taken for a package
+    name = module.replace('.', '_')
+
+    try:
+        process = subprocess.run(
+            [str(python) if python.exists() else sys.executable, '-X', 'importtime', '-c', IMPORT_START_FILE,
+             name, os.path.join(os.path.abspath(project_dir), start_file)],
+            cwd=project_dir,
+            capture_output=True,
+            text=True,
+            timeout=timeout
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"Could not profile imports of {project_dir}: {e}")
+        return None
+
+    imports = parse_importtime(process.stderr)
+    index = next((i for i in range(len(imports) - 1, -1, -1) if imports[i]['module'] == name), None)
+    entry = imports[index] if index is not None else None
+
+    # Modules are listed after their own imports; the entry module's imports are
+    # the nested lines right before it, anything earlier is interpreter start-up
+    nested = []
+    if index is not None:
+        start = index
+        while start > 0 and imports[start - 1]['depth'] > 0:
+            start -= 1
+        nested = imports[start:index]
+    slowest = sorted(nested, key=lambda item: item['cumulative_us'], reverse=True)
+
+    return {
+        'module': module,
+        'ok': process.returncode == 0,
+        'total_ms': round(entry['cumulative_us'] / 1000, 2) if entry else None,
+        'modules': len(nested) + (entry is not None),
+        'slowest': [
+            {'module': item['module'], 'self_ms': round(item['self_us'] / 1000, 2),
+             'cumulative_ms': round(item['cumulative_us'] / 1000, 2)}
+            for item in slowest[:IMPORT_PROFILE_TOP]
+        ]
+    }
+
+
+def record_import_profile(project_dir: str):
+    """Profile a Python project's imports and store the result with the project."""
+    config = project_config(os.path.basename(project_dir), os.path.dirname(project_dir))
+    if not is_python_project(config):
+        return
+
+    profile = profile_imports(project_dir, config['start_file'])
+    if profile is not None:
+        with open(Path(project_dir, IMPORT_PROFILE_FILE), 'wt') as file:
+            json.dump(profile, file)
+
+
+def load_import_profile(project_dir: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(Path(project_dir, IMPORT_PROFILE_FILE), 'rt') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
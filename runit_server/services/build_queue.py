@@ -0,0 +1,230 @@
+import time
+import asyncio
+import logging
+import secrets
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set
+
+from ..exceptions import DependencyInstallException
+from ..constants import BUILD_WORKERS, BUILD_LOG_LIMIT
+from .layers import layer_store
+from .build import record_import_profile
+from .invoker import invalidate_project, prewarm_project
+from .releases import activate_release, current_release, discard_release, prune_releases, project_link
+
+logger = logging.getLogger(__name__)
+
+
+class BuildQueue:
+    """
+    Durable queue for dependency installs.
+
+    Every build is persisted as a Build record before it is queued, so
+    builds that were queued or running when the server stopped run again
+    on the next start. A fixed number of consumers drain the queue and run
+    installs on a thread pool of the same size, so a burst of publishes
+    installs at most `workers` projects at a time and never blocks the
+    event loop. In-place installs run in a process of their own, so
+    concurrent builds never share a working directory, and builds of the
+    same directory run one after another.
+
+    A build of a release puts the release live once its dependencies are
+    installed; a failed one discards it.
+    """
+
+    def __init__(self, workers: int = BUILD_WORKERS):
+        self.workers = workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._consumers: List[asyncio.Task] = []
+        self._followups: Set[asyncio.Task] = set()
+        self._events: Dict[str, asyncio.Event] = {}
+        self._paths: Dict[str, asyncio.Lock] = {}
+        self._path_users: Dict[str, int] = {}
+        self._running = 0
+        self._submitted = 0
+        self._succeeded = 0
+        self._failed = 0
+
+    async def start(self):
+        if self._queue is not None:
+            return
+
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='build')
+        self._consumers = [asyncio.create_task(self._consume()) for _ in range(self.workers)]
+        logger.info("Build queue started")
+        await self.recover()
+
+    async def shutdown(self):
+        for consumer in self._consumers:
+            consumer.cancel()
+        self._consumers = []
+        self._queue = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        logger.info("Build queue shutdown")
+
+    async def recover(self):
+        from odbms import DBMS
+        from ..models import Build
+
+        if DBMS.Database is None:
+            logger.debug("Database not initialized, skipping build recovery")
+            return
+
+        try:
+            pending = await Build.get_pending()
+            for build in pending:
+                self._enqueue(build.token)
+            if pending:
+                logger.info(f"Recovered {len(pending)} pending builds")
+        except Exception as e:
+            logger.error(f"Error recovering builds: {e}")
+
+    def _enqueue(self, token: str):
+        self._events.setdefault(token, asyncio.Event())
+        if self._queue is not None:
+            self._queue.put_nowait(token)
+
+    async def submit(self, project_id: str, user_id: Optional[str], path: str, reason: str,
+                     version: Optional[str] = None):
+        """
+        Persist a new build of the project directory at `path` and queue it.
+
+        `version` names a release that goes live once the build succeeds.
+        """
+        from ..models import Build
+
+        build = Build(
+            token=secrets.token_urlsafe(16),
+            project_id=str(project_id),
+            user_id=str(user_id),
+            reason=reason,
+            path=str(path),
+            version=version
+        )
+        await build.save()
+        self._submitted += 1
+        self._enqueue(build.token)
+        return build
+
+    async def wait(self, token: str, timeout: float = 0):
+        """Fetch a build, waiting up to `timeout` seconds for it to finish."""
+        from ..models import Build
+
+        build = await Build.get_by_token(token)
+        if build is None or build.status in Build.FINISHED or timeout <= 0:
+            return build
+
+        event = self._events.setdefault(token, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return build
+        return await Build.get_by_token(token)
+
+    async def _consume(self):
+        while True:
+            token = await self._queue.get()
+            try:
+                await self._run(token)
+            except Exception as e:
+                logger.exception(f"Error running build {token}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, token: str):
+        from ..models import Build
+
+        build = await Build.get_by_token(token)
+        if build is None or build.status in Build.FINISHED:
+            return
+
+        await Build.update_one({'token': token}, {'status': Build.RUNNING})
+        t0 = time.perf_counter()
+        outcome, error, log = {}, None, ''
+        self._running += 1
+
+        try:
+            if not Path(build.path).is_dir():
+                raise DependencyInstallException(f'{build.path} no longer exists')
+            loop = asyncio.get_event_loop()
+            lock = self._paths.setdefault(build.path, asyncio.Lock())
+            self._path_users[build.path] = self._path_users.get(build.path, 0) + 1
+            try:
+                async with lock:
+                    outcome = await loop.run_in_executor(self._executor, layer_store.install, build.path)
+            finally:
+                self._path_users[build.path] -= 1
+                if not self._path_users[build.path]:
+                    del self._path_users[build.path], self._paths[build.path]
+            log = outcome['log']
+            # A release that finished after a newer one was published stays off
+            if build.version and build.version > (current_release(build.project_id) or ''):
+                activate_release(build.project_id, build.version, carry=False)
+            status = Build.SUCCEEDED
+            self._succeeded += 1
+        except DependencyInstallException as e:
+            error, log = str(e), e.log
+            status = Build.FAILED
+            self._failed += 1
+        except Exception as e:
+            error = str(e)
+            status = Build.FAILED
+            self._failed += 1
+        finally:
+            self._running -= 1
+
+        if status == Build.FAILED and build.version:
+            discard_release(build.project_id, build.version)
+        await Build.update_one({'token': token}, {
+            'status': status,
+            'layer': outcome.get('layer'),
+            'cached': outcome.get('hit'),
+            'log': log[-BUILD_LOG_LIMIT:] if BUILD_LOG_LIMIT else log,
+            'error_message': error,
+            'duration_ms': int((time.perf_counter() - t0) * 1000)
+        })
+
+        event = self._events.pop(token, None)
+        if event is not None:
+            event.set()
+
+        if status == Build.SUCCEEDED:
+            task = asyncio.create_task(self._deployed(build))
+            self._followups.add(task)
+            task.add_done_callback(self._followups.discard)
+        else:
+            logger.warning(f"Build {token} of {build.project_id} failed: {error}")
+
+    async def _deployed(self, build):
+        """Bring the project's workers up to date once a build is live."""
+        try:
+            # Idle workers are retired now and busy ones once their call returns
+            invalidate_project(build.project_id)
+            await prewarm_project(build.project_id)
+
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, record_import_profile, str(project_link(build.project_id)))
+            if build.version:
+                await loop.run_in_executor(None, prune_releases, build.project_id)
+            await loop.run_in_executor(None, layer_store.prune)
+        except Exception as e:
+            logger.exception(f"Error deploying build {build.token}: {e}")
+
+    def get_stats(self) -> dict:
+        """Get build queue statistics."""
+        return {
+            "workers": len(self._consumers),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": self._running,
+            "submitted": self._submitted,
+            "succeeded": self._succeeded,
+            "failed": self._failed
+        }
+
+
+build_queue = BuildQueue()
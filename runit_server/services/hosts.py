@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import select
+import shutil
+import subprocess
+from threading import Thread
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import runit
+from runit import RunIt
+
+from .usage import process_cpu_seconds, reset_peak_rss
+from ..common.results import EncodedResult, encode_result
+from ..exceptions import InvocationTimeoutException
+from ..constants import EXT_TO_LANG, LANGUAGE_TO_RUNTIME
+
+HOSTS_DIR = Path(__file__).resolve().parent.parent / 'runtimes'
+HOST_SCRIPTS = {
+    'javascript': HOSTS_DIR / 'host.js',
+    'php': HOSTS_DIR / 'host.php'
+}
+PHP_MANAGER = Path(runit.__file__).resolve().parent / 'tools' / 'php' / 'manager.php'
+READ_SIZE = 65536
+
+
+def host_command(config: Dict[str, Any], project_dir: str) -> Optional[List[str]]:
+    """
+    Command line of the runtime host for a project, if its language has one.
+
+    Returns None for Python and multi-language projects, or when the
+    project's interpreter is not installed, so they keep using Python workers.
+    """
+    start_file = config.get('start_file', '')
+    language = EXT_TO_LANG.get(os.path.splitext(start_file)[1].lower())
+    if config.get('runtime') == 'multi' or language not in HOST_SCRIPTS:
+        return None
+
+    runtime = config.get('runtime') or LANGUAGE_TO_RUNTIME[language]
+    if shutil.which(runtime) is None:
+        return None
+
+    command = [runtime, str(HOST_SCRIPTS[language]), os.path.realpath(os.path.join(project_dir, start_file))]
+    if language == 'php':
+        command.append(str(PHP_MANAGER))
+    return command
+
+
+class HostWorker:
+    """
+    A long-lived PHP or Node.js process that keeps one project loaded.
+
+    Speaks newline-delimited JSON over the host's stdin and stdout (see
+    runit_server/runtimes) and otherwise behaves like a ProjectWorker.
+    Arguments are passed the way the RunIt runners receive them: joined
+    into a single comma separated string.
+    """
+
+    def __init__(self, pool, projects_dir: str, command: List[str]):
+        self.pool = pool
+        self.project_id = pool.project_id
+        self.invocations = 0
+        self.last_used = time.monotonic()
+        self.start_seconds: Optional[float] = None
+        self.opened_at: Optional[float] = None
+        self.cpu_at_open: Optional[float] = None
+        self._created = time.monotonic()
+        self._ready = False
+        self._timeout: Optional[float] = None
+        self._deadline: Optional[float] = None
+        self._buffer = bytearray()
+
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=os.path.join(projects_dir, self.project_id)
+        )
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def _recv(self) -> Dict[str, Any]:
+        # Read the pipe directly, so a partial line cannot block past the deadline
+        fd = self.process.stdout.fileno()
+        while b'\n' not in self._buffer:
+            if self._deadline is not None:
+                remaining = max(0.0, self._deadline - time.monotonic())
+                ready, _, _ = select.select([fd], [], [], remaining)
+                if not ready:
+                    self.kill()
+                    raise InvocationTimeoutException(self._timeout)
+            chunk = os.read(fd, READ_SIZE)
+            if not chunk:
+                raise RuntimeError('Runtime host exited unexpectedly')
+            self._buffer += chunk
+
+        end = self._buffer.index(b'\n')
+        line = bytes(self._buffer[:end])
+        del self._buffer[:end + 1]
+        return json.loads(line)
+
+    def _wait_ready(self):
+        if not self._ready:
+            self._recv()
+            self._ready = True
+            self.start_seconds = time.monotonic() - self._created
+
+    def warm(self, timeout: Optional[float] = None):
+        """Wait until the host has loaded the project; killed after `timeout` seconds."""
+        self._timeout = timeout if timeout and timeout > 0 else None
+        self._deadline = time.monotonic() + self._timeout if self._timeout else None
+        self._wait_ready()
+        self.last_used = time.monotonic()
+
+    def open(self, function: str, params: Dict[str, Any], env: Dict[str, Any],
+             timeout: Optional[float] = None) -> Tuple[bool, Any]:
+        """
+        Run one invocation on the host, blocking until it replies.
+
+        Hosts load the project before they report ready, so a host that has
+        not loaded it yet gets the same `timeout` to do both.
+        """
+        self._timeout = timeout if timeout and timeout > 0 else None
+        self._deadline = time.monotonic() + self._timeout if self._timeout else None
+        self._wait_ready()
+        self.opened_at = time.monotonic()
+        self.cpu_at_open = process_cpu_seconds(self.pid)
+        reset_peak_rss(self.pid)
+
+        args = params.values() if isinstance(params, dict) else params or []
+        request = {
+            'function': function,
+            'args': ', '.join(str(arg) for arg in args),
+            'env': {key: str(value) for key, value in env.items()}
+        }
+        try:
+            self.process.stdin.write(json.dumps(request).encode() + b'\n')
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            raise RuntimeError('Runtime host exited unexpectedly')
+
+        reply = self._recv()
+        self.invocations += 1
+        self.last_used = time.monotonic()
+
+        if reply.get('notfound'):
+            return False, encode_result(RunIt.notfound())
+        if not reply.get('ok'):
+            # Same as the RunIt runners, which hand back the error text
+            return False, encode_result(reply.get('error', ''))
+        return False, encode_result(reply.get('result'))
+
+    def call(self, function: str, params: Dict[str, Any], env: Dict[str, Any],
+             timeout: Optional[float] = None) -> EncodedResult:
+        return self.open(function, params, env, timeout)[1]
+
+    def kill(self):
+        """Stop a host that is stuck in an invocation."""
+        self.process.kill()
+        self.process.wait(1)
+
+    def _reap(self):
+        try:
+            self.process.wait(1)
+        except subprocess.TimeoutExpired:
+            self.process.terminate()
+            try:
+                self.process.wait(1)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process.stdout.close()
+
+    def stop(self, wait: bool = False):
+        """Close the host's stdin so it exits; reaped in the background unless `wait`."""
+        try:
+            self.process.stdin.close()
+        except Exception:
+            pass
+
+        if wait:
+            self._reap()
+        else:
+            Thread(target=self._reap, name=f'reap-{self.pid}', daemon=True).start()
@@ -0,0 +1,214 @@
+import os
+import sys
+import time
+import asyncio
+import inspect
+import logging
+import threading
+import importlib.util
+from contextvars import ContextVar
+from types import ModuleType
+from typing import Any, Callable, Dict, Optional
+
+from runit import RunIt
+
+from .usage import Usage, usage_stats
+from ..common.results import EncodedResult, encode_result
+from ..common.runtime import project_config
+from ..exceptions import InvocationTimeoutException
+from ..constants import PROJECTS_DIR, INLOOP_PROJECTS, INLOOP_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+# Environment variables of the invocation being run; in-loop functions
+# share the server's os.environ, so they read their secrets from here
+# and os.getenv() in them sees the server's own environment instead
+current_env: ContextVar[Dict[str, str]] = ContextVar('current_env', default={})
+
+
+class InLoopExecutor:
+    """
+    Runs `async def` functions of trusted projects as tasks on one shared
+    event loop in a background thread.
+
+    Thousands of I/O-bound invocations can be in flight without holding a
+    thread or a worker process each. Only projects listed by the operator in
+    RUNIT_INLOOP_PROJECTS are eligible, since their code runs inside the
+    server process; their synchronous functions still go to worker processes.
+
+    Being in the server process, these functions are not isolated from it:
+    os.environ and os.getenv() return the server's environment, secrets
+    included, not the project's, which is read from `current_env`. Each
+    project's start file and the sibling modules it imports are loaded
+    under a package of its own, runit_inloop_<project_id>, so projects with
+    same-named modules do not share them. Siblings must be imported when
+    the start file loads; imports run later inside a function do not see
+    the project directory.
+    """
+
+    def __init__(self, projects=INLOOP_PROJECTS, concurrency: int = INLOOP_CONCURRENCY,
+                 projects_dir: str = PROJECTS_DIR):
+        self.projects = set(projects)
+        self.concurrency = concurrency
+        self.projects_dir = projects_dir
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._modules: Dict[str, Optional[ModuleType]] = {}
+        # sys.path and sys.modules are process-wide, so loads run one at a time
+        self._import_lock = threading.Lock()
+        self._active = 0
+        self._invocations = 0
+        self._timeouts = 0
+
+    def enabled(self, project_id: str) -> bool:
+        return project_id in self.projects
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever,
+                    name='runit-inloop',
+                    daemon=True
+                )
+                self._thread.start()
+            return self._loop
+
+    def _submit(self, coro) -> asyncio.Future:
+        return asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self._ensure_loop()))
+
+    @staticmethod
+    def _package(project_id: str) -> str:
+        return f'runit_inloop_{project_id}'
+
+    def _load(self, project_id: str) -> Optional[ModuleType]:
+        config = project_config(project_id, self.projects_dir)
+        filename = os.path.join(self.projects_dir, project_id, config.get('start_file', ''))
+        if not filename.endswith('.py') or not os.path.isfile(filename):
+            return None
+
+        project_dir = os.path.dirname(os.path.realpath(filename))
+        package_name = self._package(project_id)
+        with self._import_lock:
+            package = ModuleType(package_name)
+            package.__path__ = [project_dir]
+            sys.modules[package_name] = package
+            before = set(sys.modules)
+            # Let the start file import its sibling modules while it loads
+            sys.path.insert(0, project_dir)
+            try:
+                name = f'{package_name}.{os.path.splitext(os.path.basename(filename))[0]}'
+                spec = importlib.util.spec_from_file_location(name, filename)
+                module = importlib.util.module_from_spec(spec)
+                sys.modules[name] = module
+                spec.loader.exec_module(module)
+                return module
+            except Exception as e:
+                logger.error(f"Error loading {project_id} for in-loop execution: {e}")
+                return None
+            finally:
+                sys.path.remove(project_dir)
+                self._claim_modules(project_dir, package_name, before)
+
+    @staticmethod
+    def _claim_modules(project_dir: str, package_name: str, before: set):
+        """Move the sibling modules a project just imported under its package."""
+        prefix = project_dir + os.sep
+        for name in set(sys.modules) - before:
+            module = sys.modules[name]
+            filename = getattr(module, '__file__', None) or ''
+            if name.startswith(package_name + '.') or not os.path.realpath(filename).startswith(prefix):
+                continue
+            del sys.modules[name]
+            sys.modules[f'{package_name}.{name}'] = module
+
+    def _function(self, project_id: str, function: str) -> Optional[Callable]:
+        module = self._modules.get(project_id)
+        func = getattr(module, function, None) if module else None
+        if function.startswith('_') or not inspect.iscoroutinefunction(func):
+            return None
+        return func
+
+    async def handles(self, project_id: str, function: str) -> bool:
+        """Whether a call should run in-loop: a trusted project's `async def` function."""
+        if not self.enabled(project_id):
+            return False
+        if project_id not in self._modules:
+            # Imported on a thread, so neither the server's loop nor the shared one blocks on it
+            module = await asyncio.get_event_loop().run_in_executor(None, self._load, project_id)
+            self._modules.setdefault(project_id, module)
+        return self._function(project_id, function) is not None
+
+    async def _run(self, func: Callable, args: list, env: Dict[str, str],
+                   timeout: Optional[float]) -> EncodedResult:
+        current_env.set(env)
+        params = inspect.signature(func).parameters
+        if len(params) and not args:
+            return encode_result('[!] No arguments provided')
+
+        call = func(*args) if len(params) else func()
+        try:
+            result = await asyncio.wait_for(call, timeout) if timeout else await call
+        except asyncio.TimeoutError:
+            raise InvocationTimeoutException(timeout)
+        except Exception as e:
+            # Same as RunIt, which hands back the error text
+            result = str(e)
+        return encode_result(result)
+
+    async def invoke(self, project_id: str, function: str, params: Dict[str, Any],
+                     env: Optional[Dict[str, Any]] = None, timeout: Optional[float] = None) -> EncodedResult:
+        """Run a function found by handles() on the background loop and await its result."""
+        func = self._function(project_id, function)
+        if func is None:
+            return encode_result(RunIt.notfound())
+
+        args = list(params.values()) if isinstance(params, dict) else list(params or [])
+        env = {key: str(value) for key, value in (env or {}).items()}
+        timeout = timeout if timeout and timeout > 0 else None
+
+        self._active += 1
+        t0 = time.perf_counter()
+        try:
+            result = await self._submit(self._run(func, args, env, timeout))
+            # CPU and memory are shared with the server, so only wall time is known
+            result.usage = Usage((time.perf_counter() - t0) * 1000)
+            usage_stats.record(project_id, result.usage)
+            return result
+        except InvocationTimeoutException:
+            self._timeouts += 1
+            raise
+        finally:
+            self._active -= 1
+            self._invocations += 1
+
+    def invalidate(self, project_id: str):
+        """Forget a project's loaded modules, e.g. after it was republished."""
+        self._modules.pop(project_id, None)
+        package_name = self._package(project_id)
+        for name in list(sys.modules):
+            if name == package_name or name.startswith(package_name + '.'):
+                sys.modules.pop(name, None)
+
+    def shutdown(self):
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(1)
+
+    def get_stats(self) -> dict:
+        """Get in-loop execution statistics."""
+        return {
+            "projects": len(self.projects),
+            "concurrency": self.concurrency,
+            "active": self._active,
+            "invocations": self._invocations,
+            "timeouts": self._timeouts
+        }
+
+
+in_loop = InLoopExecutor()
@@ -0,0 +1,237 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from datetime import date, datetime, timedelta
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from starlette.requests import HTTPConnection
+
+from ..common.utils import get_client_ip
+from .usage import Usage
+from ..constants import (
+    INVOCATION_LOG_BUFFER,
+    INVOCATION_LOG_BATCH,
+    INVOCATION_LOG_INTERVAL,
+    INVOCATION_LOG_RETENTION_DAYS
+)
+
+logger = logging.getLogger(__name__)
+
+# Days past the retention window that are still checked for expired entries
+PURGE_LOOKBACK_DAYS = 30
+
+# Route handlers whose requests are function invocations
+INVOCATION_ENDPOINTS = {'run_project', 'invoke_project', 'run_project_api', 'invoke_project_api'}
+
+# Scope key under which a route leaves the resources its call used
+USAGE_SCOPE_KEY = 'runit.usage'
+
+
+class LogEntry(NamedTuple):
+    project_id: str
+    function: str
+    status: int
+    duration_ms: int
+    bytes_out: int
+    client_ip: Optional[str]
+    day: str
+    created_at: datetime
+    cpu_ms: Optional[int] = None
+    peak_rss_mb: Optional[float] = None
+
+
+class InvocationLogger:
+    """
+    Log of function invocations served over HTTP.
+
+    Entries go into an in-memory ring buffer and are written to the
+    database in batches with insert_many, every `interval` seconds or as
+    soon as `batch_size` entries are waiting, so serving a call never waits
+    for a database write. When the database cannot keep up the oldest
+    entries are dropped. Each flush also adds to the daily per-function
+    totals in InvocationRollup, which outlive the raw entries; those are
+    deleted after `retention_days` (0 keeps them forever).
+    """
+
+    def __init__(self, capacity: int = INVOCATION_LOG_BUFFER, batch_size: int = INVOCATION_LOG_BATCH,
+                 interval: float = INVOCATION_LOG_INTERVAL, retention_days: int = INVOCATION_LOG_RETENTION_DAYS):
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self.retention_days = retention_days
+        self._buffer: Deque[LogEntry] = deque(maxlen=max(1, capacity))
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._purged_on: Optional[date] = None
+        self._written = 0
+        self._dropped = 0
+        self._flushes = 0
+        self._failed_flushes = 0
+
+    def record(self, project_id: str, function: str, status: int, duration_ms: int,
+               bytes_out: int, client_ip: Optional[str] = None, usage: Optional[Usage] = None):
+        """Buffer one entry; never blocks."""
+        if len(self._buffer) == self._buffer.maxlen:
+            self._dropped += 1
+
+        now = datetime.now()
+        self._buffer.append(LogEntry(
+            project_id, function, status, duration_ms, bytes_out, client_ip, now.date().isoformat(), now,
+            int(usage.cpu_ms) if usage and usage.cpu_ms is not None else None,
+            round(usage.peak_rss_mb, 2) if usage and usage.peak_rss_mb is not None else None
+        ))
+        if len(self._buffer) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            logger.info("Invocation log started")
+
+    async def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            self._wakeup = None
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing invocation log: {e}")
+            logger.info("Invocation log shutdown")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+                await self.apply_retention()
+            except Exception as e:
+                self._failed_flushes += 1
+                logger.error(f"Error flushing invocation log: {e}")
+
+    async def flush(self) -> int:
+        """Write buffered entries in batches; returns the number written."""
+        from odbms import DBMS
+        from ..models import InvocationLog
+
+        if DBMS.Database is None:
+            return 0
+
+        written = 0
+        while self._buffer:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            try:
+                await InvocationLog.insert_entries([entry._asdict() for entry in batch])
+            except Exception:
+                # Keep the entries for the next attempt, as far as the buffer has room
+                room = self._buffer.maxlen - len(self._buffer)
+                kept = batch[len(batch) - room:] if room < len(batch) else batch
+                self._dropped += len(batch) - len(kept)
+                self._buffer.extendleft(reversed(kept))
+                raise
+            written += len(batch)
+            self._written += len(batch)
+            self._flushes += 1
+            await self._roll_up(batch)
+        return written
+
+    async def _roll_up(self, batch: List[LogEntry]):
+        from ..models import InvocationRollup
+
+        totals: Dict[Tuple[str, str, str], List[int]] = {}
+        for entry in batch:
+            total = totals.setdefault((entry.project_id, entry.function, entry.day), [0, 0, 0, 0])
+            total[0] += 1
+            total[1] += entry.status >= 400
+            total[2] += entry.duration_ms
+            total[3] += entry.bytes_out
+
+        for (project_id, function, day), total in totals.items():
+            try:
+                await InvocationRollup.add(project_id, function, day, *total)
+            except Exception as e:
+                logger.error(f"Error rolling up invocation log of {project_id}: {e}")
+
+    async def apply_retention(self):
+        """Once a day, delete raw entries older than the retention window."""
+        from ..models import InvocationLog
+
+        today = date.today()
+        if not self.retention_days or self._purged_on == today:
+            return
+
+        for age in range(self.retention_days + 1, self.retention_days + PURGE_LOOKBACK_DAYS + 1):
+            await InvocationLog.delete_by_day((today - timedelta(days=age)).isoformat())
+        self._purged_on = today
+
+    def get_stats(self) -> dict:
+        """Get invocation log statistics."""
+        return {
+            "buffered": len(self._buffer),
+            "written": self._written,
+            "dropped": self._dropped,
+            "flushes": self._flushes,
+            "failed_flushes": self._failed_flushes
+        }
+
+
+class InvocationLogMiddleware:
+    """
+    ASGI middleware that records every invocation request in the invocation log.
+
+    Status and response size are taken from the messages actually sent, so
+    streamed responses are counted in full. CPU time and peak memory come
+    from the result's usage, which the route leaves in the scope with
+    note_usage; they stay empty for streamed and failed calls.
+    """
+
+    def __init__(self, app, endpoints=INVOCATION_ENDPOINTS):
+        self.app = app
+        self.endpoints = endpoints
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        t0 = time.perf_counter()
+        response = {'status': 500, 'bytes_out': 0}
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            elif message['type'] == 'http.response.body':
+                response['bytes_out'] += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            endpoint = scope.get('endpoint')
+            path_params = scope.get('path_params', {})
+            project_id = path_params.get('project_id')
+            if getattr(endpoint, '__name__', None) in self.endpoints and project_id != 'favicon.ico':
+                invocation_log.record(
+                    project_id,
+                    path_params.get('function') or 'index',
+                    response['status'],
+                    int((time.perf_counter() - t0) * 1000),
+                    response['bytes_out'],
+                    # Behind the proxy the socket peer is nginx, not the caller
+                    get_client_ip(HTTPConnection(scope)),
+                    scope.get(USAGE_SCOPE_KEY)
+                )
+
+
+def note_usage(request: HTTPConnection, result) -> None:
+    """Keep the resources a call used for its invocation log entry."""
+    request.scope[USAGE_SCOPE_KEY] = getattr(result, 'usage', None)
+
+
+invocation_log = InvocationLogger()
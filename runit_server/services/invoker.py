@@ -0,0 +1,258 @@
+import json
+import asyncio
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, NamedTuple, Optional
+
+from .inloop import in_loop
+from .limiter import concurrency_limiter
+from .worker_pool import worker_pool
+from ..common.cache import cache, response_cache
+from ..common.results import EncodedResult
+from ..constants import (
+    STREAM_BUFFER_SIZE,
+    METADATA_CACHE_TTL,
+    PROJECTS_DIR,
+    PROJECT_CONCURRENCY,
+    WORKER_MAX_PROJECTS
+)
+
+# Each call admitted by a project's gate holds a thread while its worker
+# runs, so there is one for every slot the gates of all pooled projects
+# can hand out; a slow project can then not keep the others from starting
+_project_executor = ThreadPoolExecutor(
+    max_workers=WORKER_MAX_PROJECTS * PROJECT_CONCURRENCY,
+    thread_name_prefix="project_runner"
+)
+
+
+class SingleFlight:
+    """
+    Collapses identical concurrent calls onto one execution.
+
+    Callers that arrive while a call with the same key is in flight wait
+    for its result instead of starting their own. The execution runs as a
+    separate task, so a caller that goes away does not cancel it for the rest.
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self._executions = 0
+        self._coalesced = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            self._executions += 1
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self._coalesced += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()
+
+    def get_stats(self) -> dict:
+        """Get request coalescing statistics."""
+        return {
+            "in_flight": len(self._calls),
+            "executions": self._executions,
+            "coalesced": self._coalesced
+        }
+
+
+single_flight = SingleFlight()
+
+
+class InvocationMetadata(NamedTuple):
+    """What the invocation path needs to know about a project."""
+    project: Any
+    env_vars: Dict[str, Any]
+    published: bool
+
+
+def _metadata_key(project_id: str) -> str:
+    return f'invocation_metadata:{project_id}'
+
+
+async def get_invocation_metadata(project_id: str) -> Optional[InvocationMetadata]:
+    """
+    Get a project's record, environment variables and publish state.
+
+    Served from memory for METADATA_CACHE_TTL seconds, so hot projects skip
+    the Project and Secret lookups; invalidate_project() drops the entry
+    when the project, its environment or its files change.
+    """
+    from ..models import Project, Secret
+
+    key = _metadata_key(project_id)
+    metadata = cache.get(key)
+    if metadata is not None:
+        return metadata
+
+    project = await Project.get(project_id)
+    if not project:
+        return None
+
+    secret = await Secret.find_one({'project_id': project_id})
+    metadata = InvocationMetadata(
+        project=project,
+        env_vars=secret.variables.copy() if secret and secret.variables else {},
+        published=Path(PROJECTS_DIR, str(project_id)).resolve().is_dir()
+    )
+    cache.set(key, metadata, METADATA_CACHE_TTL)
+    return metadata
+
+
+def pool_capacity(project_id: str) -> Callable[[], Awaitable[int]]:
+    """
+    Size of a project's worker pool, for the limiter to cap its gate at.
+
+    Loading a pool's settings takes the pool lock and reads runit.json,
+    so that happens in a thread; pools already loaded answer right away.
+    """
+    async def capacity() -> int:
+        size = worker_pool.loaded_capacity(project_id)
+        if size is None:
+            size = await asyncio.get_event_loop().run_in_executor(None, worker_pool.capacity, project_id)
+        return size
+    return capacity
+
+
+async def run_project_async(
+    project_id: str,
+    function: str,
+    params: Dict[str, Any],
+    env: Optional[Dict[str, Any]] = None,
+    user_id: Optional[str] = None,
+    idempotent: bool = False
+) -> EncodedResult:
+    """
+    Run a project function in its worker process without blocking the event loop.
+
+    Environment variables are handed to the worker with the invocation and
+    never touch the server's os.environ, so calls from different projects
+    can run in parallel. Only `idempotent` calls, those of GET requests,
+    are served from the response cache of functions declared cacheable in
+    runit.json and share a single execution with identical concurrent
+    calls; calls carrying a request body always run on their own.
+
+    Executions are subject to the per-project and per-user concurrency caps;
+    raises ProjectBusyException when the wait queue is full. `async def`
+    functions of trusted projects run on the in-loop executor instead,
+    under their own, much higher, per-project cap.
+    """
+    cache_entry = response_cache.key_for(project_id, function, params) if idempotent else None
+    if cache_entry is not None:
+        hit, result = response_cache.lookup(cache_entry[0])
+        if hit:
+            return result
+
+    async def execute():
+        if await in_loop.handles(project_id, function):
+            timeout = worker_pool.timeout_for(project_id, function)
+            async with concurrency_limiter.slot(f'{project_id}:inloop', user_id, limit=in_loop.concurrency):
+                result = await in_loop.invoke(project_id, function, params, env, timeout)
+            if cache_entry is not None:
+                response_cache.set(cache_entry[0], result, cache_entry[1])
+            return result
+
+        loop = asyncio.get_event_loop()
+        async with concurrency_limiter.slot(project_id, user_id, pool_capacity(project_id)):
+            result = await loop.run_in_executor(
+                _project_executor,
+                worker_pool.invoke,
+                project_id,
+                function,
+                params,
+                env
+            )
+        if cache_entry is not None:
+            response_cache.set(cache_entry[0], result, cache_entry[1])
+        return result
+
+    if not idempotent:
+        return await execute()
+    key = (project_id, function, json.dumps(params, sort_keys=True, default=str))
+    return await single_flight.do(key, execute)
+
+
+async def stream_project_async(
+    project_id: str,
+    function: str,
+    params: Dict[str, Any],
+    env: Optional[Dict[str, Any]] = None,
+    user_id: Optional[str] = None,
+    buffer: int = STREAM_BUFFER_SIZE
+) -> AsyncIterator[EncodedResult]:
+    """
+    Run a project function and yield its output chunk by chunk.
+
+    Items of generator functions are forwarded as the worker produces them;
+    any other result is yielded once. At most `buffer` chunks are held in
+    memory, after which the worker is held back until the client catches up.
+    Streams skip the response cache and request coalescing.
+    """
+    loop = asyncio.get_event_loop()
+    queue: asyncio.Queue = asyncio.Queue(max(1, buffer))
+    stop = threading.Event()
+
+    def put(item):
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def produce():
+        chunks = worker_pool.stream(project_id, function, params, env)
+        end = (False, None)
+        try:
+            for chunk in chunks:
+                put((True, chunk))
+                if stop.is_set():
+                    return
+        except Exception as e:
+            end = (False, e)
+        finally:
+            chunks.close()
+        if not stop.is_set():
+            put(end)
+
+    async with concurrency_limiter.slot(project_id, user_id, pool_capacity(project_id)):
+        loop.run_in_executor(_project_executor, produce)
+        try:
+            while True:
+                is_chunk, item = await queue.get()
+                if not is_chunk:
+                    if item is not None:
+                        raise item
+                    break
+                yield item
+        finally:
+            stop.set()
+            # Free the producer if it is blocked on a full buffer; it closes
+            # the worker's stream once it sees the stop flag
+            while not queue.empty():
+                queue.get_nowait()
+
+
+def invalidate_metadata(project_id: str):
+    """Forget a project's cached record and environment, e.g. after its variables changed."""
+    cache.delete(_metadata_key(project_id))
+    response_cache.invalidate(project_id)
+
+
+async def prewarm_project(project_id: str):
+    """Load a project into a warm worker, e.g. right after it was deployed."""
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(_project_executor, worker_pool.prewarm, project_id)
+
+
+def invalidate_project(project_id: str):
+    """Forget everything kept in memory for a project after it changed or was deleted."""
+    invalidate_metadata(project_id)
+    worker_pool.invalidate(project_id)
+    in_loop.invalidate(project_id)
@@ -0,0 +1,176 @@
+import json
+import time
+import asyncio
+import logging
+import secrets
+from typing import Any, Dict, List, Optional
+
+from ..exceptions import ProjectBusyException
+from ..common.bodies import discard_body_files
+from ..constants import JOB_WORKERS
+from .invoker import run_project_async, get_invocation_metadata
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """
+    Durable queue for asynchronous invocations.
+
+    Every job is persisted as an Invocation record before it is queued, so
+    jobs that were queued or running when the server stopped are picked up
+    again on the next start. A fixed number of consumers drain the queue.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.workers = workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._consumers: List[asyncio.Task] = []
+        self._events: Dict[str, asyncio.Event] = {}
+        self._submitted = 0
+        self._succeeded = 0
+        self._failed = 0
+
+    async def start(self):
+        if self._queue is not None:
+            return
+
+        self._queue = asyncio.Queue()
+        self._consumers = [asyncio.create_task(self._consume()) for _ in range(self.workers)]
+        logger.info("Job queue started")
+        await self.recover()
+
+    async def shutdown(self):
+        for consumer in self._consumers:
+            consumer.cancel()
+        self._consumers = []
+        self._queue = None
+        logger.info("Job queue shutdown")
+
+    async def recover(self):
+        from odbms import DBMS
+        from ..models import Invocation
+
+        if DBMS.Database is None:
+            logger.debug("Database not initialized, skipping job recovery")
+            return
+
+        try:
+            pending = await Invocation.get_pending()
+            for invocation in pending:
+                self._enqueue(invocation.token)
+            if pending:
+                logger.info(f"Recovered {len(pending)} pending jobs")
+        except Exception as e:
+            logger.error(f"Error recovering jobs: {e}")
+
+    def _enqueue(self, token: str):
+        self._events.setdefault(token, asyncio.Event())
+        if self._queue is not None:
+            self._queue.put_nowait(token)
+
+    async def submit(self, project_id: str, user_id: Optional[str], function: str,
+                     params: Dict[str, Any], files: Optional[List[str]] = None):
+        """Persist a new invocation and queue it for execution; `files` are removed once it has run."""
+        from ..models import Invocation
+
+        invocation = Invocation(
+            token=secrets.token_urlsafe(16),
+            project_id=str(project_id),
+            user_id=str(user_id),
+            function=function,
+            params=json.dumps(params),
+            files=json.dumps(files or [])
+        )
+        await invocation.save()
+        self._submitted += 1
+        self._enqueue(invocation.token)
+        return invocation
+
+    async def wait(self, token: str, timeout: float = 0):
+        """Fetch an invocation, waiting up to `timeout` seconds for it to finish."""
+        from ..models import Invocation
+
+        invocation = await Invocation.get_by_token(token)
+        if invocation is None or invocation.status in Invocation.FINISHED or timeout <= 0:
+            return invocation
+
+        event = self._events.setdefault(token, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return invocation
+        return await Invocation.get_by_token(token)
+
+    async def _consume(self):
+        while True:
+            token = await self._queue.get()
+            try:
+                await self._run(token)
+            except Exception as e:
+                logger.exception(f"Error running job {token}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, token: str):
+        from ..models import Invocation
+
+        invocation = await Invocation.get_by_token(token)
+        if invocation is None or invocation.status in Invocation.FINISHED:
+            return
+
+        await Invocation.update_one({'token': token}, {'status': Invocation.RUNNING})
+        t0 = time.perf_counter()
+        result, error, usage = None, None, None
+
+        try:
+            metadata = await get_invocation_metadata(invocation.project_id)
+            env_vars = metadata.env_vars if metadata else {}
+            params = json.loads(invocation.params) if invocation.params else {}
+
+            output = await run_project_async(
+                invocation.project_id,
+                invocation.function,
+                params,
+                env_vars,
+                invocation.user_id
+            )
+            result = output.json().decode()
+            usage = output.usage
+            status = Invocation.SUCCEEDED
+            self._succeeded += 1
+        except ProjectBusyException as e:
+            await Invocation.update_one({'token': token}, {'status': Invocation.QUEUED})
+            asyncio.get_event_loop().call_later(e.retry_after, self._enqueue, token)
+            return
+        except Exception as e:
+            error = str(e)
+            status = Invocation.FAILED
+            self._failed += 1
+
+        discard_body_files(json.loads(invocation.files) if invocation.files else [])
+        await Invocation.update_one({'token': token}, {
+            'status': status,
+            'result': result,
+            'error_message': error,
+            'duration_ms': int((time.perf_counter() - t0) * 1000),
+            'cpu_ms': int(usage.cpu_ms) if usage and usage.cpu_ms is not None else None,
+            'peak_rss_mb': round(usage.peak_rss_mb, 2) if usage and usage.peak_rss_mb is not None else None
+        })
+
+        event = self._events.pop(token, None)
+        if event is not None:
+            event.set()
+
+    def get_stats(self) -> dict:
+        """Get job queue statistics."""
+        return {
+            "workers": len(self._consumers),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "submitted": self._submitted,
+            "succeeded": self._succeeded,
+            "failed": self._failed
+        }
+
+
+job_queue = JobQueue()
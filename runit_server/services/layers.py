@@ -0,0 +1,524 @@
+"""
+Dependency layers shared between projects.
+
+The packages a project installs are decided by its language, its runtime
+and its dependency manifest and lockfile, so those are hashed into a
+layer key. Each key is installed once, in LAYERS_DIR/<key>, and every
+project with the same key links its venv, node_modules or vendor
+directory to that layer instead of installing a copy of its own. Layers
+are made read-only once built; the build is the only thing writing to them.
+
+Projects whose install depends on their own files (local path
+requirements, npm install scripts, composer autoload sections) and
+multi-language projects still install in place with RunIt.
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import fcntl
+import shutil
+import hashlib
+import logging
+import platform
+import subprocess
+from functools import lru_cache
+from threading import Lock
+from pathlib import Path
+from datetime import datetime
+from contextlib import contextmanager
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from ..common.runtime import project_config
+from ..exceptions import DependencyInstallException
+from ..constants import (
+    LAYERS_DIR,
+    RELEASES_DIR,
+    PROJECTS_DIR,
+    LAYER_GRACE_PERIOD,
+    LAYER_BUILD_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+LAYER_FILE = '.layer.json'
+LOCK_DIR = Path(LAYERS_DIR, '.locks')
+
+# Directory each language links to its layer
+LINKS = {'python': 'venv', 'javascript': 'node_modules', 'php': 'vendor'}
+
+PACKAGE_SECTIONS = ('dependencies', 'devDependencies', 'optionalDependencies',
+                    'peerDependencies', 'overrides', 'resolutions')
+PACKAGE_LOCKS = ('package-lock.json', 'npm-shrinkwrap.json')
+OTHER_LOCKS = ('bun.lock', 'bun.lockb', 'yarn.lock')
+INSTALL_SCRIPTS = ('preinstall', 'install', 'postinstall', 'prepare')
+COMPOSER_SECTIONS = ('require', 'require-dev', 'repositories', 'minimum-stability',
+                     'prefer-stable', 'config', 'conflict', 'replace', 'provide')
+
+# Requirements and package specs that point at files of the project itself
+LOCAL_REQUIREMENT = re.compile(r'^(-r|-c|-e|--requirement|--constraint|--editable|\.|/|file:)')
+LOCAL_PACKAGE = re.compile(r'^(file|link|workspace|portal):|^\.{0,2}/')
+
+
+class LayerSpec(NamedTuple):
+    """What to install for a layer: files written to it, then commands run in it."""
+    language: str
+    key: str
+    files: Dict[str, bytes]
+    commands: List[List[str]]
+
+
+def _read(path: Path) -> Optional[bytes]:
+    try:
+        with open(path, 'rb') as file:
+            return file.read()
+    except OSError:
+        return None
+
+
+def _read_json(path: Path) -> Any:
+    data = _read(path)
+    if data is None:
+        return None
+    try:
+        return json.loads(data)
+    except ValueError:
+        return None
+
+
+def _listdir(path) -> List[str]:
+    try:
+        return [name for name in os.listdir(path) if not name.startswith('.')]
+    except OSError:
+        return []
+
+
+@lru_cache(maxsize=None)
+def _runtime_version(runtime: str) -> str:
+    """Version reported by a runtime's executable, part of the key of its layers."""
+    try:
+        process = subprocess.run([runtime, '--version'], capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return ''
+    return (process.stdout or process.stderr).strip().split('\n')[0]
+
+
+def _layer_key(language: str, runtime: str, inputs: Any) -> str:
+    document = json.dumps({
+        'language': language,
+        'runtime': runtime,
+        'version': _runtime_version(runtime) if language != 'python' else platform.python_version(),
+        'platform': f'{sys.platform}-{platform.machine()}',
+        'inputs': inputs
+    }, sort_keys=True)
+    return f"{language}-{hashlib.sha256(document.encode()).hexdigest()[:32]}"
+
+
+def python_spec(project_dir: str, config: Dict[str, Any]) -> Optional[LayerSpec]:
+    requirements = _read(Path(project_dir, 'requirements.txt')) or b''
+    lines = set()
+    for line in requirements.decode('utf-8', 'replace').splitlines():
+        line = re.sub(r'(^|\s)#.*$', '', line).strip()
+        if not line:
+            continue
+        if LOCAL_REQUIREMENT.match(line):
+            return None
+        lines.add(line)
+
+    # Virtualenvs record the interpreter they were made with
+    python = sys.executable
+    key = _layer_key('python', python, sorted(lines))
+    return LayerSpec('python', key, {'requirements.txt': requirements}, [
+        [python, '-m', 'venv', 'venv'],
+        [os.path.join('venv', 'bin', 'pip'), 'install', 'python-dotenv', '-r', 'requirements.txt']
+    ])
+
+
+def javascript_spec(project_dir: str, config: Dict[str, Any]) -> Optional[LayerSpec]:
+    package = _read_json(Path(project_dir, 'package.json'))
+    if not isinstance(package, dict):
+        return None
+    scripts = package.get('scripts') or {}
+    if package.get('workspaces') or any(name in scripts for name in INSTALL_SCRIPTS):
+        return None
+
+    manifest = {section: package[section] for section in PACKAGE_SECTIONS if package.get(section)}
+    for section in manifest.values():
+        if isinstance(section, dict) and any(isinstance(value, str) and LOCAL_PACKAGE.match(value)
+                                             for value in section.values()):
+            return None
+    if not manifest:
+        return LayerSpec('javascript', '', {}, [])
+
+    files = {}
+    inputs: Dict[str, Any] = {'package.json': manifest}
+    for name in PACKAGE_LOCKS:
+        lock = _read_json(Path(project_dir, name))
+        if isinstance(lock, dict):
+            # The root entry names the project; only the installed packages matter
+            packages = dict(lock.get('packages') or {})
+            packages.pop('', None)
+            inputs[name] = packages or lock.get('dependencies')
+            files[name] = _read(Path(project_dir, name))
+    for name in OTHER_LOCKS:
+        data = _read(Path(project_dir, name))
+        if data is not None:
+            inputs[name] = hashlib.sha256(data).hexdigest()
+            files[name] = data
+
+    runtime = config.get('runtime') or 'node'
+    manifest.update({'name': 'runit-layer', 'private': True})
+    files['package.json'] = json.dumps(manifest, indent=4).encode()
+    manager = 'bun' if runtime == 'bun' else 'npm'
+    return LayerSpec('javascript', _layer_key('javascript', runtime, inputs), files, [[manager, 'install']])
+
+
+def php_spec(project_dir: str, config: Dict[str, Any]) -> Optional[LayerSpec]:
+    composer = _read_json(Path(project_dir, 'composer.json'))
+    if not isinstance(composer, dict):
+        return None
+    # Autoloaders generated in a layer would point at the layer, not the project
+    if composer.get('autoload') or composer.get('autoload-dev') or composer.get('scripts'):
+        return None
+    repositories = composer.get('repositories') or []
+    if any(isinstance(repository, dict) and repository.get('type') == 'path'
+           for repository in (repositories.values() if isinstance(repositories, dict) else repositories)):
+        return None
+
+    manifest = {section: composer[section] for section in COMPOSER_SECTIONS if section in composer}
+    if not manifest.get('require') and not manifest.get('require-dev'):
+        return LayerSpec('php', '', {}, [])
+
+    files = {'composer.json': json.dumps(manifest, indent=4).encode()}
+    inputs: Dict[str, Any] = {'composer.json': manifest}
+    lock = _read_json(Path(project_dir, 'composer.lock'))
+    if isinstance(lock, dict):
+        # The content hash covers the project's name; the packages are what is installed
+        inputs['composer.lock'] = [lock.get('packages'), lock.get('packages-dev'), lock.get('platform')]
+        files['composer.lock'] = _read(Path(project_dir, 'composer.lock'))
+
+    runtime = config.get('runtime') or 'php'
+    return LayerSpec('php', _layer_key('php', runtime, inputs), files, [['composer', 'install', '--no-interaction']])
+
+
+SPECS = {'python': python_spec, 'javascript': javascript_spec, 'php': php_spec}
+
+
+def layer_spec(project_dir: str) -> Optional[LayerSpec]:
+    """The layer a project's dependencies come from, or None if they must be installed in place."""
+    project_dir = os.path.normpath(project_dir)
+    config = project_config(os.path.basename(project_dir), os.path.dirname(project_dir))
+    spec = SPECS.get(config.get('language', ''))
+    return spec(project_dir, config) if spec else None
+
+
+def disk_usage(path: Path) -> int:
+    """Bytes allocated to the files under `path`, each hardlinked file counted once."""
+    seen = set()
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                stat = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            if (stat.st_dev, stat.st_ino) not in seen:
+                seen.add((stat.st_dev, stat.st_ino))
+                total += stat.st_blocks * 512
+    return total
+
+
+def _set_writable(path: Path, writable: bool):
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            target = os.path.join(root, name)
+            if os.path.islink(target):
+                continue
+            mode = os.stat(target).st_mode
+            os.chmod(target, (mode | 0o200) if writable else (mode & ~0o222))
+
+
+def _remove_tree(path: Path):
+    if path.exists():
+        _set_writable(path, True)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+@contextmanager
+def _file_lock(key: str, blocking: bool = True):
+    """Lock a layer against other server processes; yields False if it is held and not `blocking`."""
+    LOCK_DIR.mkdir(parents=True, exist_ok=True)
+    with open(Path(LOCK_DIR, f'{key}.lock'), 'w') as file:
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def link_layer(project_dir: str, layer: Path, name: str):
+    """Point `name` in a project at the same directory of a layer, replacing what was there."""
+    target = Path(project_dir, name)
+    if not target.is_symlink() and target.is_dir():
+        shutil.rmtree(target)
+    staged = Path(project_dir, f'.{name}.{uuid.uuid4().hex}.link')
+    os.symlink(os.path.relpath(Path(layer, name), project_dir), staged)
+    os.replace(staged, target)
+
+
+def unlink_layers(project_dir: str):
+    """Drop a project's links to layers, so nothing writes through them."""
+    for name in LINKS.values():
+        target = Path(project_dir, name)
+        if target.is_symlink():
+            target.unlink()
+
+
+# RunIt installs into the current directory, so it runs in a process of its own
+IN_PLACE_INSTALL = (
+    'from runit_server.common.runtime import ServerRunIt; '
+    'ServerRunIt(**ServerRunIt.load_config()).install_dependency_packages()'
+)
+PACKAGE_ROOT = str(Path(__file__).resolve().parents[2])
+
+
+def install_in_place(project_dir: str) -> str:
+    """Install a project's dependencies into its own directory with RunIt; returns the output."""
+    unlink_layers(project_dir)
+    env = dict(os.environ, RUNIT_RUNTIME='server')
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [PACKAGE_ROOT, env.get('PYTHONPATH')]))
+    try:
+        process = subprocess.run(
+            [sys.executable, '-c', IN_PLACE_INSTALL],
+            cwd=project_dir,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            timeout=LAYER_BUILD_TIMEOUT
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise DependencyInstallException(f'Could not install dependencies in place: {e}', '')
+    if process.returncode != 0:
+        raise DependencyInstallException(
+            f'In-place install exited with status {process.returncode}', process.stdout
+        )
+    return process.stdout
+
+
+class LayerStore:
+    """
+    Builds, shares and prunes dependency layers.
+
+    A layer is complete once its LAYER_FILE exists; directories without
+    one are left over from an interrupted build and are built again.
+    Builds of the same key are serialised, within the process by a lock
+    and across processes by a file lock, so concurrent publishes of
+    projects with the same dependencies install them once.
+    """
+
+    def __init__(self, root: str = LAYERS_DIR):
+        self.root = Path(root)
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.in_place = 0
+        self._locks: Dict[str, Lock] = {}
+        self._lock = Lock()
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _key_lock(self, key: str) -> Lock:
+        with self._lock:
+            return self._locks.setdefault(key, Lock())
+
+    def install(self, project_dir: str) -> Dict[str, Any]:
+        """
+        Install a project's dependencies, from a shared layer where possible.
+
+        Returns the layer used, whether it was already built and the
+        output of the build. Raises DependencyInstallException when the
+        build fails. Blocks; run it off the event loop.
+        """
+        spec = layer_spec(project_dir)
+        if spec is None:
+            self._count('in_place')
+            log = install_in_place(project_dir)
+            return {'layer': None, 'hit': False, 'log': log}
+        if not spec.commands:
+            unlink_layers(project_dir)
+            return {'layer': None, 'hit': False, 'log': ''}
+
+        path, hit, log = self.ensure(spec)
+        link_layer(project_dir, path, LINKS[spec.language])
+        return {'layer': spec.key, 'hit': hit, 'log': log}
+
+    def ensure(self, spec: LayerSpec) -> Tuple[Path, bool, str]:
+        """Build the layer of `spec` unless it exists; returns its path, whether it did and the build output."""
+        path = Path(self.root, spec.key)
+        marker = Path(path, LAYER_FILE)
+        with self._key_lock(spec.key), _file_lock(spec.key):
+            if marker.is_file():
+                os.utime(marker)
+                self._count('hits')
+                return path, True, ''
+
+            self._count('misses')
+            try:
+                log = self._build(spec, path)
+            except BaseException:
+                self._count('failures')
+                _remove_tree(path)
+                raise
+            return path, False, log
+
+    def _build(self, spec: LayerSpec, path: Path) -> str:
+        _remove_tree(path)
+        path.mkdir(parents=True)
+        for name, data in spec.files.items():
+            Path(path, name).write_bytes(data)
+
+        started = time.monotonic()
+        log = []
+        for command in spec.commands:
+            executable = str(Path(path, command[0])) if os.sep in command[0] else command[0]
+            log.append(f"$ {' '.join(command)}\n")
+            try:
+                process = subprocess.run(
+                    [executable, *command[1:]],
+                    cwd=path,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    text=True,
+                    timeout=LAYER_BUILD_TIMEOUT
+                )
+            except (OSError, subprocess.TimeoutExpired) as e:
+                raise DependencyInstallException(f'Could not run {command[0]}: {e}', ''.join(log))
+            log.append(process.stdout)
+            if process.returncode != 0:
+                raise DependencyInstallException(
+                    f'{command[0]} exited with status {process.returncode}', ''.join(log)
+                )
+
+        size = disk_usage(path)
+        _set_writable(path, False)
+        os.chmod(path, 0o755)
+        with open(Path(path, LAYER_FILE), 'wt') as file:
+            json.dump({
+                'key': spec.key,
+                'language': spec.language,
+                'created_at': datetime.now().isoformat(),
+                'build_seconds': round(time.monotonic() - started, 2),
+                'size_bytes': size
+            }, file)
+        logger.info(f"Built dependency layer {spec.key} ({size} bytes)")
+        return ''.join(log)
+
+    def _references(self) -> Dict[str, int]:
+        """Number of project releases linking to each layer."""
+        root = os.path.realpath(self.root)
+        references: Dict[str, int] = {}
+        directories = [Path(RELEASES_DIR, project, release)
+                       for project in _listdir(RELEASES_DIR)
+                       for release in _listdir(Path(RELEASES_DIR, project))]
+        directories += [Path(PROJECTS_DIR, project) for project in _listdir(PROJECTS_DIR)
+                        if not Path(PROJECTS_DIR, project).is_symlink()]
+        for directory in directories:
+            for name in LINKS.values():
+                link = Path(directory, name)
+                if not link.is_symlink():
+                    continue
+                layer = os.path.dirname(os.path.realpath(link))
+                if os.path.dirname(layer) == root:
+                    key = os.path.basename(layer)
+                    references[key] = references.get(key, 0) + 1
+        return references
+
+    def _complete_layers(self) -> Dict[str, Dict[str, Any]]:
+        """Details of every complete layer by key, as recorded in its LAYER_FILE."""
+        layers = {}
+        for name in _listdir(self.root):
+            marker = Path(self.root, name, LAYER_FILE)
+            details = _read_json(marker)
+            if not isinstance(details, dict):
+                continue
+            try:
+                details['last_used'] = datetime.fromtimestamp(marker.stat().st_mtime).isoformat()
+            except OSError:
+                continue
+            layers[name] = details
+        return layers
+
+    def list_layers(self) -> List[Dict[str, Any]]:
+        """
+        Complete layers with their size and the number of releases using them, largest first.
+
+        Walks every release to count the links; blocks, so run it off the event loop.
+        """
+        references = self._references()
+        layers = []
+        for name, details in self._complete_layers().items():
+            details['references'] = references.get(name, 0)
+            layers.append(details)
+        return sorted(layers, key=lambda layer: layer.get('size_bytes', 0), reverse=True)
+
+    def prune(self, grace_period: int = LAYER_GRACE_PERIOD) -> int:
+        """Remove layers no release links to that were last used more than `grace_period` seconds ago."""
+        cutoff = time.time() - grace_period
+        references = self._references()
+        removed = 0
+        for name in _listdir(self.root):
+            path = Path(self.root, name)
+            marker = Path(path, LAYER_FILE)
+            if name in references:
+                continue
+            try:
+                # Unfinished layers count from when their build last wrote to them
+                if (marker if marker.exists() else path).stat().st_mtime >= cutoff:
+                    continue
+            except OSError:
+                continue
+
+            # Layers being built or looked up right now are left alone
+            lock = self._key_lock(name)
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                with _file_lock(name, blocking=False) as locked:
+                    if locked:
+                        _remove_tree(path)
+                        removed += 1
+            finally:
+                lock.release()
+        if removed:
+            logger.info(f"Pruned {removed} unused dependency layers")
+        return removed
+
+    def get_stats(self) -> dict:
+        """
+        Get layer cache hits and misses since start-up and the disk space layers take.
+
+        Reads only the layer directory, not the releases; still, run it off the event loop.
+        """
+        layers = self._complete_layers().values()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'failures': self.failures,
+            'in_place': self.in_place,
+            'layers': len(layers),
+            'disk_usage_bytes': sum(layer.get('size_bytes', 0) for layer in layers)
+        }
+
+
+layer_store = LayerStore()
@@ -0,0 +1,163 @@
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+from ..exceptions import ProjectBusyException
+from ..constants import (
+    PROJECT_CONCURRENCY,
+    USER_CONCURRENCY,
+    INVOCATION_QUEUE_SIZE
+)
+
+
+class _Gate:
+    """Counting semaphore with a bounded FIFO wait queue."""
+
+    def __init__(self, limit: int, queue_size: int):
+        self.limit = max(1, limit)
+        self.queue_size = queue_size
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def idle(self) -> bool:
+        return not self.active and not self.waiters
+
+    def full(self) -> bool:
+        """Whether a new call would have to wait and finds the queue full."""
+        waits = self.active >= self.limit or bool(self.waiters)
+        return waits and len(self.waiters) >= self.queue_size
+
+    async def acquire(self):
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return
+
+        waiter = asyncio.get_event_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                self.waiters.remove(waiter)
+            raise
+
+    def release(self):
+        # Hand the slot straight to the next waiter so nobody can jump the queue
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class ConcurrencyLimiter:
+    """
+    Per-project and per-user caps on concurrent invocations.
+
+    Calls over the cap wait in a bounded queue; once a project's or user's
+    queue is full, new calls are rejected with ProjectBusyException so the
+    caller can answer 429 instead of piling up awaiting coroutines.
+    """
+
+    def __init__(self, project_limit: int = PROJECT_CONCURRENCY, user_limit: int = USER_CONCURRENCY,
+                 queue_size: int = INVOCATION_QUEUE_SIZE):
+        self.project_limit = project_limit
+        self.user_limit = user_limit
+        self.queue_size = queue_size
+        self._projects: Dict[str, _Gate] = {}
+        self._users: Dict[str, _Gate] = {}
+        self._admitted = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._avg_hold = 1.0
+
+    def _gate(self, gates: Dict[str, _Gate], key: str, limit: int) -> _Gate:
+        gate = gates.get(key)
+        if gate is None:
+            gate = gates[key] = _Gate(limit, self.queue_size)
+        return gate
+
+    def _drop_idle(self, gates: Dict[str, _Gate], key: str):
+        gate = gates.get(key)
+        if gate is not None and gate.idle:
+            del gates[key]
+
+    def _retry_after(self, gate: _Gate) -> int:
+        return max(1, math.ceil(self._avg_hold * (len(gate.waiters) + 1) / gate.limit))
+
+    @asynccontextmanager
+    async def slot(self, project_id: str, user_id: Optional[str] = None,
+                   capacity: Optional[Callable[[], Awaitable[int]]] = None, limit: Optional[int] = None):
+        """
+        Hold a concurrency slot for the duration of the block.
+
+        `capacity` may cap the project limit further, e.g. to the size of
+        its worker pool, so excess calls queue here rather than in a thread;
+        it is awaited only when the project has no gate yet.
+        `limit` replaces the project limit for gates that need a different one.
+        """
+        limit = self.project_limit if limit is None else limit
+        if project_id not in self._projects and capacity is not None:
+            limit = min(limit, await capacity())
+
+        gates = [self._gate(self._projects, project_id, limit)]
+        if user_id:
+            gates.insert(0, self._gate(self._users, str(user_id), self.user_limit))
+
+        for gate in gates:
+            if gate.full():
+                self._rejected += 1
+                retry_after = self._retry_after(gate)
+                self._drop_idle(self._projects, project_id)
+                if user_id:
+                    self._drop_idle(self._users, str(user_id))
+                raise ProjectBusyException(retry_after)
+
+        t0 = time.perf_counter()
+        acquired = []
+        try:
+            for gate in gates:
+                await gate.acquire()
+                acquired.append(gate)
+
+            waited = time.perf_counter() - t0
+            self._admitted += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+
+            t1 = time.perf_counter()
+            yield
+            self._avg_hold = 0.8 * self._avg_hold + 0.2 * (time.perf_counter() - t1)
+        finally:
+            for gate in reversed(acquired):
+                gate.release()
+            self._drop_idle(self._projects, project_id)
+            if user_id:
+                self._drop_idle(self._users, str(user_id))
+
+    def get_stats(self) -> dict:
+        """Get concurrency and queueing statistics."""
+        return {
+            "project_limit": self.project_limit,
+            "user_limit": self.user_limit,
+            "queue_size": self.queue_size,
+            "active": sum(gate.active for gate in self._projects.values()),
+            "queued": sum(len(gate.waiters) for gate in self._projects.values())
+                      + sum(len(gate.waiters) for gate in self._users.values()),
+            "queued_by_project": {key: len(gate.waiters) for key, gate in self._projects.items() if gate.waiters},
+            "admitted": self._admitted,
+            "rejected": self._rejected,
+            "avg_wait_ms": round(self._total_wait / self._admitted * 1000, 2) if self._admitted else 0,
+            "max_wait_ms": round(self._max_wait * 1000, 2)
+        }
+
+
+concurrency_limiter = ConcurrencyLimiter()
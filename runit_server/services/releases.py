@@ -0,0 +1,193 @@
+"""
+Immutable, versioned release directories of published projects.
+
+Every publish is built in a release directory of its own under
+RELEASES_DIR/<project_id>/<version>. The project's directory in
+PROJECTS_DIR is a symlink to the live release, and going live is a single
+rename of a new symlink over it, so an invocation sees either the old or
+the new tree, never a partly extracted one. Rolling back points the link
+at an earlier release again, with the live release's .env carried over so
+the project's current settings stay in effect.
+"""
+import os
+import uuid
+import shutil
+import logging
+from pathlib import Path
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from ..constants import PROJECTS_DIR, RELEASES_DIR, RELEASES_KEEP
+
+logger = logging.getLogger(__name__)
+
+VERSION_FORMAT = '%Y%m%d%H%M%S'
+DIGEST_LENGTH = 12
+
+# Files that belong to the project rather than to one release
+CARRIED_FILES = ['.env']
+
+
+def project_link(project_id: str) -> Path:
+    return Path(PROJECTS_DIR, project_id)
+
+
+def project_releases_dir(project_id: str) -> Path:
+    return Path(RELEASES_DIR, project_id)
+
+
+def current_release(project_id: str) -> Optional[str]:
+    """Version the project's directory points at, or None if it is not a release."""
+    link = project_link(project_id)
+    if not link.is_symlink():
+        return None
+    return Path(os.readlink(link)).name
+
+
+def list_releases(project_id: str) -> List[Dict[str, Any]]:
+    """Releases of a project, newest first."""
+    directory = project_releases_dir(project_id)
+    if not directory.is_dir():
+        return []
+
+    current = current_release(project_id)
+    releases = []
+    for path in sorted(directory.iterdir(), key=lambda item: item.name, reverse=True):
+        if not path.is_dir() or path.name.startswith('.'):
+            continue
+        stamp, _, digest = path.name.partition('-')
+        try:
+            created_at = datetime.strptime(stamp, VERSION_FORMAT).isoformat()
+        except ValueError:
+            created_at = None
+        releases.append({
+            'version': path.name,
+            'digest': digest,
+            'created_at': created_at,
+            'current': path.name == current
+        })
+    return releases
+
+
+def previous_release(project_id: str) -> Optional[str]:
+    """The release that was live before the current one."""
+    versions = [release['version'] for release in list_releases(project_id)]
+    current = current_release(project_id)
+    if current not in versions:
+        return None
+    index = versions.index(current)
+    return versions[index + 1] if index + 1 < len(versions) else None
+
+
+def has_release(project_id: str, version: str) -> bool:
+    return any(release['version'] == version for release in list_releases(project_id))
+
+
+def _version_stamp(project_id: str) -> str:
+    """Creation time of a new release, kept later than that of every existing one."""
+    now = datetime.now().replace(microsecond=0)
+    for release in list_releases(project_id):
+        if release['created_at']:
+            now = max(now, datetime.fromisoformat(release['created_at']) + timedelta(seconds=1))
+    return now.strftime(VERSION_FORMAT)
+
+
+def new_release(project_id: str, digest: str) -> Path:
+    """
+    Create the directory a new release is built in.
+
+    The version is the creation time followed by the start of `digest`,
+    the hash of what was published, so versions sort in publish order.
+    Files that belong to the project, such as its .env, are carried over
+    from the live release.
+    """
+    _adopt_directory(project_id)
+    directory = project_releases_dir(project_id)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    path = Path(directory, f"{_version_stamp(project_id)}-{digest[:DIGEST_LENGTH]}")
+    path.mkdir()
+
+    _carry_files(project_id, path)
+    return path
+
+
+def _carry_files(project_id: str, path: Path):
+    """Copy the CARRIED_FILES of the live release into the release at `path`."""
+    live = project_link(project_id)
+    if live.is_symlink() and os.path.realpath(live) == os.path.realpath(path):
+        return
+    for name in CARRIED_FILES:
+        source = Path(live, name)
+        if not source.is_file():
+            continue
+        # Replaced in one step, so workers of the release never read half a file
+        staged = Path(path, f'.{name}.{uuid.uuid4().hex}.carry')
+        shutil.copy2(source, staged)
+        os.replace(staged, Path(path, name))
+
+
+def discard_release(project_id: str, version: str):
+    """Delete a release that was never activated, e.g. after a failed build."""
+    if version and version != current_release(project_id):
+        shutil.rmtree(Path(project_releases_dir(project_id), version), ignore_errors=True)
+
+
+def _adopt_directory(project_id: str):
+    """Turn a project directory from before releases into a release of its own."""
+    link = project_link(project_id)
+    if link.is_symlink() or not link.is_dir():
+        return
+
+    stamp = datetime.fromtimestamp(link.stat().st_mtime).strftime(VERSION_FORMAT)
+    directory = project_releases_dir(project_id)
+    directory.mkdir(parents=True, exist_ok=True)
+    version = f'{stamp}-initial'
+    link.rename(Path(directory, version))
+    activate_release(project_id, version, carry=False)
+    logger.info(f"Moved {link} into the releases of {project_id}")
+
+
+def activate_release(project_id: str, version: str, carry: bool = True):
+    """
+    Point the project's directory at `version` with an atomic symlink swap.
+
+    The live release's CARRIED_FILES are copied into `version` first, so an
+    earlier release comes back with the project's current .env. Releases
+    that were just built from the live one pass `carry=False` to keep the
+    files they were published with.
+    """
+    path = Path(project_releases_dir(project_id), version)
+    if not path.is_dir():
+        raise FileNotFoundError(f'Release {version} of {project_id} does not exist')
+
+    _adopt_directory(project_id)
+    if carry:
+        _carry_files(project_id, path)
+    link = project_link(project_id)
+    target = os.path.relpath(Path(project_releases_dir(project_id), version), PROJECTS_DIR)
+    Path(PROJECTS_DIR).mkdir(parents=True, exist_ok=True)
+    # Named uniquely, so activations running at the same time each stage their own link
+    staged = Path(PROJECTS_DIR, f'.{project_id}.{uuid.uuid4().hex}.link')
+    os.symlink(target, staged)
+    os.replace(staged, link)
+    logger.info(f"Project {project_id} now serves release {version}")
+
+
+def prune_releases(project_id: str, keep: int = RELEASES_KEEP):
+    """Delete all but the newest `keep` releases, never the live one."""
+    if keep <= 0:
+        return
+    for release in list_releases(project_id)[keep:]:
+        if not release['current']:
+            shutil.rmtree(Path(project_releases_dir(project_id), release['version']), ignore_errors=True)
+
+
+def remove_project(project_id: str):
+    """Delete a project's directory and all of its releases."""
+    link = project_link(project_id)
+    if link.is_symlink():
+        link.unlink()
+    elif link.is_dir():
+        shutil.rmtree(link, ignore_errors=True)
+    shutil.rmtree(project_releases_dir(project_id), ignore_errors=True)
@@ -146,10 +146,10 @@ class ScheduleService:
         if not project_path.exists():
             raise Exception(f"Project path not found: {project_path}")
         
-        from runit import RunIt
+        from ..common.runtime import ServerRunIt
         
         try:
-            result = await RunIt.start(str(project.id), function_name, PROJECTS_DIR)
+            result = await ServerRunIt.start(str(project.id), function_name, PROJECTS_DIR)
             return {
                 'function': function_name,
                 'project_id': str(project.id),
@@ -0,0 +1,119 @@
+import os
+import math
+from collections import deque
+from threading import Lock
+from typing import Deque, Dict, List, NamedTuple, Optional
+
+from ..constants import USAGE_SAMPLES
+
+PERCENTILES = (50, 95, 99)
+
+
+class Usage(NamedTuple):
+    """Resources used by one invocation; None where they could not be measured."""
+    wall_ms: float
+    cpu_ms: Optional[float] = None
+    peak_rss_mb: Optional[float] = None
+
+
+def process_cpu_seconds(pid: int) -> Optional[float]:
+    """
+    CPU time (user + system) used so far by a process and its reaped children.
+
+    Children count because some runtimes run a function in a subprocess.
+    Returns None where /proc is unavailable.
+    """
+    try:
+        with open(f'/proc/{pid}/stat', 'rt') as file:
+            # Fields after the command name, which may itself contain spaces
+            fields = file.read().rsplit(')', 1)[1].split()
+        ticks = sum(int(value) for value in fields[11:15])
+    except (OSError, ValueError, IndexError):
+        return None
+    return ticks / os.sysconf('SC_CLK_TCK')
+
+
+def reset_peak_rss(pid: int):
+    """Restart peak RSS tracking of a process, so the next reading covers one invocation."""
+    try:
+        with open(f'/proc/{pid}/clear_refs', 'wt') as file:
+            file.write('5')
+    except OSError:
+        pass
+
+
+def process_peak_rss_mb(pid: int) -> Optional[float]:
+    """Peak resident memory of a process in MiB, or None where /proc is unavailable."""
+    try:
+        with open(f'/proc/{pid}/status', 'rt') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    values = sorted(values)
+    summary = {
+        f'p{p}': round(values[max(0, math.ceil(p / 100 * len(values)) - 1)], 2)
+        for p in PERCENTILES
+    }
+    summary['max'] = round(values[-1], 2)
+    return summary
+
+
+class UsageStats:
+    """
+    Per-project resource usage of recent invocations.
+
+    Keeps the last `samples` measurements of every project for percentiles,
+    plus running totals of wall and CPU time for capacity planning and billing.
+    """
+
+    def __init__(self, samples: int = USAGE_SAMPLES):
+        self.samples = samples
+        self._recent: Dict[str, Deque[Usage]] = {}
+        self._totals: Dict[str, Dict[str, float]] = {}
+        self._lock = Lock()
+
+    def record(self, project_id: str, usage: Usage):
+        with self._lock:
+            recent = self._recent.get(project_id)
+            if recent is None:
+                recent = self._recent[project_id] = deque(maxlen=self.samples)
+                self._totals[project_id] = {'invocations': 0, 'wall_ms': 0.0, 'cpu_ms': 0.0}
+            recent.append(usage)
+            totals = self._totals[project_id]
+            totals['invocations'] += 1
+            totals['wall_ms'] += usage.wall_ms
+            totals['cpu_ms'] += usage.cpu_ms or 0
+
+    def project_stats(self, project_id: str) -> Dict[str, dict]:
+        """Totals and wall/CPU/memory percentiles of a project's recent invocations."""
+        with self._lock:
+            recent = list(self._recent.get(project_id, ()))
+            totals = dict(self._totals.get(project_id, {}))
+        if not recent:
+            return {}
+
+        return {
+            'invocations': totals['invocations'],
+            'total_wall_ms': round(totals['wall_ms'], 2),
+            'total_cpu_ms': round(totals['cpu_ms'], 2),
+            'wall_ms': _percentiles([usage.wall_ms for usage in recent]),
+            'cpu_ms': _percentiles([usage.cpu_ms for usage in recent if usage.cpu_ms is not None]),
+            'peak_rss_mb': _percentiles([usage.peak_rss_mb for usage in recent if usage.peak_rss_mb is not None])
+        }
+
+    def get_stats(self) -> dict:
+        """Get resource usage per project."""
+        with self._lock:
+            project_ids = list(self._recent.keys())
+        return {project_id: self.project_stats(project_id) for project_id in project_ids}
+
+
+usage_stats = UsageStats()
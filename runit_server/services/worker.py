@@ -0,0 +1,111 @@
+"""
+Entry point of warm worker processes.
+
+Kept apart from the pool and the app, so that starting a worker, or the
+forkserver zygote, only imports RunIt and what running a function needs.
+"""
+import os
+import signal
+import asyncio
+import inspect
+from typing import Any, Tuple
+
+from runit import RunIt
+
+from ..common.runtime import ServerRunIt
+from ..common.results import encode_result
+from ..exceptions import ResultTooLargeException
+
+# Message asking a worker to load its project without running a function
+WARM = 'warm'
+
+
+def _send(conn, reply: Tuple[str, Any]):
+    try:
+        conn.send(reply)
+    except BrokenPipeError:
+        raise
+    except Exception:
+        conn.send((reply[0], str(reply[1])))
+
+
+def _send_chunks(conn, result):
+    """Forward the items of a generator result to the parent as they are produced."""
+    _send(conn, ('stream', None))
+
+    if inspect.isasyncgen(result):
+        async def drain():
+            async for item in result:
+                _send(conn, ('chunk', encode_result(item, spool=False)))
+        asyncio.run(drain())
+    else:
+        for item in result:
+            _send(conn, ('chunk', encode_result(item, spool=False)))
+
+
+def worker_main(conn, project_id: str, projects_dir: str, docker: bool):
+    """
+    Entry point of a warm worker process.
+
+    Serves invocations of a single project until it receives None
+    or the parent closes the pipe. The project module stays imported
+    between calls, so only the first invocation pays the load cost.
+
+    Results are serialised here with encode_result(), so the server can
+    send them on without decoding; large results are spooled to disk and
+    only their path goes through the pipe. Functions that return a
+    generator have their items sent one by one, framed by a 'stream' reply
+    and a final 'end' or 'error' reply.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    RunIt.RUNTIME_ENV = 'server'
+    RunIt.DOCKER = docker
+    base_env = dict(os.environ)
+    conn.send(('ready', None))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+
+        if message is None:
+            break
+
+        if message == WARM:
+            try:
+                # No function has an empty name, so this only loads the project
+                asyncio.run(ServerRunIt.start(project_id, '', projects_dir, {}))
+            except Exception:
+                pass
+            try:
+                _send(conn, ('ok', None))
+            except BrokenPipeError:
+                break
+            continue
+
+        function, params, env = message
+        os.environ.update({key: str(value) for key, value in env.items()})
+        try:
+            result = asyncio.run(ServerRunIt.start(project_id, function, projects_dir, params))
+            if inspect.isgenerator(result) or inspect.isasyncgen(result):
+                _send_chunks(conn, result)
+                reply = ('end', None)
+            else:
+                reply = ('ok', encode_result(result))
+        except BrokenPipeError:
+            # The parent stopped reading mid-stream and dropped this worker
+            break
+        except ResultTooLargeException as e:
+            reply = ('too_large', e.limit)
+        except Exception as e:
+            reply = ('error', str(e))
+        finally:
+            os.environ.clear()
+            os.environ.update(base_env)
+
+        try:
+            _send(conn, reply)
+        except BrokenPipeError:
+            break
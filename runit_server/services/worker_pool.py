@@ -0,0 +1,642 @@
+import os
+import time
+import asyncio
+import logging
+import multiprocessing
+import multiprocessing.forkserver
+from collections import OrderedDict
+from threading import Condition
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from runit import RunIt
+
+from .hosts import HostWorker, host_command
+from .worker import WARM, worker_main
+from .usage import Usage, usage_stats, process_cpu_seconds, process_peak_rss_mb, reset_peak_rss
+from ..common.runtime import project_config
+from ..common.results import EncodedResult, JSON, spool_result
+from ..exceptions import InvocationTimeoutException, ResultTooLargeException
+from ..constants import (
+    PROJECTS_DIR,
+    WORKER_POOL_SIZE,
+    WORKER_IDLE_TTL,
+    WORKER_MAX_PROJECTS,
+    EXECUTION_MODE,
+    INVOCATION_TIMEOUT,
+    WORKER_START_METHOD,
+    ZYGOTE_PRELOAD,
+    WORKER_MAX_REQUESTS,
+    WORKER_MAX_MEMORY_MB
+)
+
+logger = logging.getLogger(__name__)
+
+REAPER_INTERVAL = 30
+
+# Imported once by the zygote so that forked workers inherit them
+PRELOAD_MODULES = ['runit', 'runit_server.services.worker']
+
+
+def _rss_mb(pid: int) -> float:
+    """Resident memory of a process in MiB, or 0 where /proc is unavailable."""
+    try:
+        with open(f'/proc/{pid}/statm', 'rt') as file:
+            pages = int(file.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return 0
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def _worker_context(method: str = WORKER_START_METHOD):
+    """
+    Multiprocessing context used to start workers.
+
+    With "forkserver" a zygote process imports PRELOAD_MODULES and any
+    RUNIT_ZYGOTE_PRELOAD modules once, and every worker is forked from it,
+    so workers skip interpreter start-up and those imports. Falls back to
+    "spawn" where forking is not available.
+    """
+    if method not in multiprocessing.get_all_start_methods():
+        method = 'spawn'
+    context = multiprocessing.get_context(method)
+    if method == 'forkserver':
+        context.set_forkserver_preload(PRELOAD_MODULES + ZYGOTE_PRELOAD)
+    return context
+
+
+class ProjectWorker:
+    """A long-lived process that keeps one project loaded."""
+
+    def __init__(self, pool: 'ProjectPool', projects_dir: str, context):
+        self.pool = pool
+        self.project_id = pool.project_id
+        self.invocations = 0
+        self.last_used = time.monotonic()
+        # Start-up and current invocation timings, collected by the pool
+        self.start_seconds: Optional[float] = None
+        self.opened_at: Optional[float] = None
+        self.cpu_at_open: Optional[float] = None
+        self._created = time.monotonic()
+        self._ready = False
+        self._timeout: Optional[float] = None
+        self._deadline: Optional[float] = None
+
+        self._conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=worker_main,
+            args=(child_conn, self.project_id, projects_dir, RunIt.DOCKER),
+            name=f'runit-worker-{self.project_id}',
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def _wait_ready(self):
+        if not self._ready:
+            # Start-up does not count against the timeout
+            self._conn.recv()
+            self._ready = True
+            self.start_seconds = time.monotonic() - self._created
+
+    def warm(self, timeout: Optional[float] = None):
+        """Load the project ahead of the first invocation; killed after `timeout` seconds."""
+        self._wait_ready()
+        self._timeout = timeout if timeout and timeout > 0 else None
+        self._deadline = time.monotonic() + self._timeout if self._timeout else None
+        self._conn.send(WARM)
+        self._recv()
+        self.last_used = time.monotonic()
+
+    def _recv(self) -> Tuple[str, Any]:
+        if self._deadline is not None:
+            if not self._conn.poll(max(0.0, self._deadline - time.monotonic())):
+                self.kill()
+                raise InvocationTimeoutException(self._timeout)
+        return self._conn.recv()
+
+    def open(self, function: str, params: Dict[str, Any], env: Dict[str, Any],
+             timeout: Optional[float] = None) -> Tuple[bool, Any]:
+        """
+        Start one invocation on this worker, blocking until it replies.
+
+        Returns (False, result) for plain results, or (True, chunks) with an
+        iterator over the items when the function returned a generator.
+        If the invocation, including all of its chunks, is not done within
+        `timeout` seconds the worker is killed and InvocationTimeoutException
+        is raised.
+        """
+        self._wait_ready()
+        self.opened_at = time.monotonic()
+        self.cpu_at_open = process_cpu_seconds(self.pid)
+        reset_peak_rss(self.pid)
+        self._timeout = timeout if timeout and timeout > 0 else None
+        self._deadline = time.monotonic() + self._timeout if self._timeout else None
+        self._conn.send((function, params, env))
+        status, payload = self._recv()
+        self.invocations += 1
+        self.last_used = time.monotonic()
+
+        if status == 'error':
+            raise RuntimeError(payload)
+        if status == 'too_large':
+            raise ResultTooLargeException(payload)
+        if status == 'stream':
+            return True, self._chunks()
+        return False, payload
+
+    def _chunks(self) -> Iterator[Any]:
+        while True:
+            status, payload = self._recv()
+            self.last_used = time.monotonic()
+            if status == 'end':
+                return
+            if status == 'error':
+                raise RuntimeError(payload)
+            yield payload
+
+    def call(self, function: str, params: Dict[str, Any], env: Dict[str, Any],
+             timeout: Optional[float] = None) -> EncodedResult:
+        """Run one invocation on this worker; generator output is collected into a JSON array."""
+        streaming, payload = self.open(function, params, env, timeout)
+        if streaming:
+            return spool_result(EncodedResult(JSON, b'[' + b','.join(chunk.json() for chunk in payload) + b']'))
+        return payload
+
+    def kill(self):
+        """Stop a worker that is stuck in an invocation."""
+        self.process.kill()
+        self.process.join(1)
+
+    def stop(self, wait: bool = False):
+        try:
+            self._conn.send(None)
+        except Exception:
+            pass
+
+        if wait:
+            self.process.join(1)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join(1)
+        self._conn.close()
+
+
+class ProjectPool:
+    """Warm workers of a single project."""
+
+    def __init__(self, project_id: str, size: int, idle_ttl: int, isolated: bool = False,
+                 timeout: float = INVOCATION_TIMEOUT, timeouts: Optional[Dict[str, float]] = None):
+        self.project_id = project_id
+        self.size = max(1, size)
+        self.idle_ttl = idle_ttl
+        self.isolated = isolated
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self.max_requests = WORKER_MAX_REQUESTS
+        self.max_memory_mb = WORKER_MAX_MEMORY_MB
+        self.host_command: Optional[List[str]] = None
+        self.min_warm = 0
+        self.idle: List[ProjectWorker] = []
+        self.busy = 0
+
+    def should_recycle(self, worker) -> bool:
+        """Whether a worker has served its quota of requests or outgrown its memory ceiling."""
+        if self.max_requests and worker.invocations >= self.max_requests:
+            return True
+        return bool(self.max_memory_mb) and _rss_mb(worker.pid) > self.max_memory_mb
+
+    def timeout_for(self, function: str) -> float:
+        return self.timeouts.get(function, self.timeout)
+
+
+class WorkerPool:
+    """
+    Per-project pools of warm worker processes.
+
+    Pools are kept in LRU order and capped at `max_projects`; idle workers
+    are retired after their project's idle TTL. The pool size and TTL can
+    be overridden per project with a `workers` section in runit.json:
+
+        "workers": {"pool_size": 2, "idle_ttl": 600, "mode": "warm",
+                    "timeout": 30, "timeouts": {"report": 300},
+                    "max_requests": 1000, "max_memory_mb": 256, "host": true,
+                    "min_warm": 1}
+
+    In "isolated" mode every invocation gets a fresh process which exits
+    afterwards, so no state or environment outlives a single call. Workers
+    are recycled after `max_requests` invocations or once their resident
+    memory exceeds `max_memory_mb` (0 disables either limit).
+
+    PHP and JavaScript projects are served by a long-lived interpreter
+    host (see services.hosts) instead of a process spawn per call, unless
+    "host" is false or the interpreter is not installed.
+
+    Invocations that outlive their timeout (per function, else per project,
+    else RUNIT_INVOCATION_TIMEOUT; 0 disables it) have their worker killed.
+
+    Projects with `min_warm` keep that many idle workers past their idle TTL
+    and are topped up again by the reaper, so they never see a cold start.
+    """
+
+    def __init__(self, projects_dir: str = PROJECTS_DIR, pool_size: int = WORKER_POOL_SIZE,
+                 idle_ttl: int = WORKER_IDLE_TTL, max_projects: int = WORKER_MAX_PROJECTS,
+                 mode: str = EXECUTION_MODE, timeout: float = INVOCATION_TIMEOUT):
+        self.projects_dir = projects_dir
+        self.pool_size = pool_size
+        self.idle_ttl = idle_ttl
+        self.max_projects = max_projects
+        self.mode = mode
+        self.timeout = timeout
+        self._pools: 'OrderedDict[str, ProjectPool]' = OrderedDict()
+        self._cond = Condition()
+        self._context = _worker_context()
+        self._reaper: Optional[asyncio.Task] = None
+        self._spawned = 0
+        self._evicted = 0
+        self._invocations = 0
+        self._timeouts = 0
+        self._started = 0
+        self._start_time = 0.0
+        self._max_start_time = 0.0
+        self._exec_time = 0.0
+        self._recycled = 0
+        self._prewarmed = 0
+        self._keep_warm: Set[str] = set()
+
+    def _load_settings(self, project_id: str) -> ProjectPool:
+        config = project_config(project_id, self.projects_dir)
+        settings = config.get('workers', {})
+        if not isinstance(settings, dict):
+            settings = {}
+        try:
+            size = int(settings.get('pool_size', self.pool_size))
+            idle_ttl = int(settings.get('idle_ttl', self.idle_ttl))
+        except (TypeError, ValueError):
+            size, idle_ttl = self.pool_size, self.idle_ttl
+        try:
+            timeout = float(settings.get('timeout', self.timeout))
+            timeouts = {key: float(value) for key, value in settings.get('timeouts', {}).items()}
+        except (TypeError, ValueError, AttributeError):
+            timeout, timeouts = self.timeout, {}
+        isolated = settings.get('mode', self.mode) == 'isolated'
+        pool = ProjectPool(project_id, size, idle_ttl, isolated, timeout, timeouts)
+
+        try:
+            pool.max_requests = int(settings.get('max_requests', pool.max_requests))
+            pool.max_memory_mb = float(settings.get('max_memory_mb', pool.max_memory_mb))
+            pool.min_warm = min(max(0, int(settings.get('min_warm', 0))), pool.size)
+        except (TypeError, ValueError):
+            pass
+        if pool.min_warm:
+            self._keep_warm.add(project_id)
+        else:
+            self._keep_warm.discard(project_id)
+        if settings.get('host', True) and not RunIt.DOCKER:
+            pool.host_command = host_command(config, os.path.join(self.projects_dir, project_id))
+        return pool
+
+    def _get_pool(self, project_id: str) -> Tuple[ProjectPool, List[ProjectWorker]]:
+        """Return the project's pool and any workers evicted to make room. Lock must be held."""
+        evicted: List[ProjectWorker] = []
+        pool = self._pools.get(project_id)
+
+        if pool is None:
+            pool = self._load_settings(project_id)
+            self._pools[project_id] = pool
+
+            for old_id in list(self._pools.keys()):
+                if len(self._pools) <= self.max_projects:
+                    break
+                old_pool = self._pools[old_id]
+                if old_pool is pool or old_pool.busy or old_pool.min_warm:
+                    continue
+                evicted.extend(old_pool.idle)
+                del self._pools[old_id]
+
+        self._pools.move_to_end(project_id)
+        return pool, evicted
+
+    def _acquire(self, project_id: str) -> ProjectWorker:
+        evicted: List[ProjectWorker] = []
+        worker = None
+
+        with self._cond:
+            while True:
+                pool, dropped = self._get_pool(project_id)
+                evicted.extend(dropped)
+
+                while pool.idle:
+                    candidate = pool.idle.pop()
+                    if candidate.is_alive():
+                        worker = candidate
+                        break
+                    evicted.append(candidate)
+
+                if worker is not None or pool.busy < pool.size:
+                    break
+                self._cond.wait()
+            pool.busy += 1
+
+        self._retire(evicted)
+        if worker is not None:
+            return worker
+
+        try:
+            worker = self._spawn(pool)
+        except Exception:
+            with self._cond:
+                pool.busy -= 1
+                self._cond.notify_all()
+            raise
+
+        with self._cond:
+            self._spawned += 1
+        return worker
+
+    def _spawn(self, pool: ProjectPool) -> ProjectWorker:
+        if pool.host_command:
+            return HostWorker(pool, self.projects_dir, pool.host_command)
+        return ProjectWorker(pool, self.projects_dir, self._context)
+
+    def _release(self, worker: ProjectWorker, healthy: bool) -> Optional[Usage]:
+        recycle = healthy and worker.pool.should_recycle(worker)
+        usage = self._measure(worker)
+
+        with self._cond:
+            pool = worker.pool
+            pool.busy -= 1
+            self._invocations += 1
+            self._recycled += recycle
+            self._record_timings(worker)
+            current = self._pools.get(worker.project_id) is pool
+            if healthy and current and not pool.isolated and not recycle and worker.is_alive():
+                pool.idle.append(worker)
+                worker = None
+            self._cond.notify_all()
+
+        if usage is not None:
+            usage_stats.record(pool.project_id, usage)
+        if worker is not None:
+            self._retire([worker])
+        return usage
+
+    def _measure(self, worker: ProjectWorker) -> Optional[Usage]:
+        """Wall time, CPU time and peak memory of the worker's current invocation."""
+        if worker.opened_at is None:
+            return None
+        cpu_ms = None
+        cpu_seconds = process_cpu_seconds(worker.pid)
+        if cpu_seconds is not None and worker.cpu_at_open is not None:
+            cpu_ms = (cpu_seconds - worker.cpu_at_open) * 1000
+        wall_ms = (time.monotonic() - worker.opened_at) * 1000
+        return Usage(wall_ms, cpu_ms, process_peak_rss_mb(worker.pid))
+
+    def _record_timings(self, worker: ProjectWorker):
+        """Account start-up cost and function cost separately. Lock must be held."""
+        if worker.start_seconds is not None:
+            self._started += 1
+            self._start_time += worker.start_seconds
+            self._max_start_time = max(self._max_start_time, worker.start_seconds)
+            worker.start_seconds = None
+        if worker.opened_at is not None:
+            self._exec_time += time.monotonic() - worker.opened_at
+            worker.opened_at = None
+
+    def _count_timeout(self, project_id: str, function: str):
+        logger.warning(f"Invocation of {project_id}/{function} timed out, worker killed")
+        with self._cond:
+            self._timeouts += 1
+
+    def _retire(self, workers: List[ProjectWorker], wait: bool = False):
+        for worker in workers:
+            worker.stop(wait)
+        if workers:
+            with self._cond:
+                self._evicted += len(workers)
+
+    def capacity(self, project_id: str) -> int:
+        """Maximum number of invocations a project's pool runs at once."""
+        with self._cond:
+            pool, evicted = self._get_pool(project_id)
+        self._retire(evicted)
+        return pool.size
+
+    def loaded_capacity(self, project_id: str) -> Optional[int]:
+        """Like capacity, but without locking; None while the project's settings are not loaded."""
+        pool = self._pools.get(project_id)
+        return pool.size if pool is not None else None
+
+    def timeout_for(self, project_id: str, function: str) -> float:
+        """Seconds a project function may run before it is killed."""
+        with self._cond:
+            pool, evicted = self._get_pool(project_id)
+        self._retire(evicted)
+        return pool.timeout_for(function)
+
+    def invoke(self, project_id: str, function: str, params: Dict[str, Any],
+               env: Optional[Dict[str, Any]] = None) -> EncodedResult:
+        """
+        Run a project function on a warm worker. Blocks the calling thread.
+
+        The resources the call used are attached to the result as `usage`.
+        """
+        worker = self._acquire(project_id)
+        healthy = False
+        result = None
+        try:
+            result = worker.call(function, params, env or {}, worker.pool.timeout_for(function))
+            healthy = True
+            return result
+        except (RuntimeError, ResultTooLargeException):
+            healthy = True
+            raise
+        except InvocationTimeoutException:
+            self._count_timeout(project_id, function)
+            raise
+        finally:
+            usage = self._release(worker, healthy)
+            if result is not None:
+                result.usage = usage
+
+    def stream(self, project_id: str, function: str, params: Dict[str, Any],
+               env: Optional[Dict[str, Any]] = None) -> Iterator[EncodedResult]:
+        """
+        Run a project function and yield its output as the worker produces it.
+
+        Plain results are yielded once. If the generator is closed before it
+        is exhausted, the worker is still mid-stream and gets retired.
+        """
+        worker = self._acquire(project_id)
+        healthy = False
+        try:
+            streaming, payload = worker.open(function, params, env or {}, worker.pool.timeout_for(function))
+            if streaming:
+                yield from payload
+            else:
+                yield payload
+            healthy = True
+        except (RuntimeError, ResultTooLargeException):
+            healthy = True
+            raise
+        except InvocationTimeoutException:
+            self._count_timeout(project_id, function)
+            raise
+        finally:
+            self._release(worker, healthy)
+
+    def prewarm(self, project_id: str, count: int = 1) -> int:
+        """
+        Start idle workers with the project loaded, ahead of its traffic.
+
+        Tops the pool up to `count` or its `min_warm`, whichever is larger,
+        within the pool size. Blocks the calling thread; returns the number
+        of workers started.
+        """
+        with self._cond:
+            pool, evicted = self._get_pool(project_id)
+            target = min(pool.size, max(pool.min_warm, count))
+            missing = max(0, target - len(pool.idle) - pool.busy)
+            pool.busy += missing
+        self._retire(evicted)
+
+        started = 0
+        for _ in range(missing):
+            worker = None
+            try:
+                worker = self._spawn(pool)
+                worker.warm(pool.timeout)
+            except Exception as e:
+                logger.warning(f"Could not pre-warm a worker for {project_id}: {e}")
+                if worker is not None:
+                    worker.kill()
+                    worker = None
+
+            with self._cond:
+                pool.busy -= 1
+                if worker is not None:
+                    self._spawned += 1
+                    self._prewarmed += 1
+                    self._record_timings(worker)
+                    if self._pools.get(project_id) is pool:
+                        pool.idle.append(worker)
+                        started += 1
+                        worker = None
+                self._cond.notify_all()
+            if worker is not None:
+                self._retire([worker])
+        return started
+
+    def keep_warm(self):
+        """Top up the idle workers of every project with a `min_warm` setting."""
+        for project_id in list(self._keep_warm):
+            try:
+                self.prewarm(project_id, 0)
+            except Exception as e:
+                logger.error(f"Error keeping {project_id} warm: {e}")
+
+    def _discover_keep_warm(self):
+        """Find the projects whose runit.json asks for warm workers and start them."""
+        try:
+            project_ids = os.listdir(self.projects_dir)
+        except OSError:
+            return
+        for project_id in project_ids:
+            settings = project_config(project_id, self.projects_dir).get('workers')
+            if isinstance(settings, dict) and settings.get('min_warm'):
+                self._keep_warm.add(project_id)
+        self.keep_warm()
+
+    def invalidate(self, project_id: str):
+        """Drop a project's workers, e.g. after it was republished or deleted."""
+        with self._cond:
+            pool = self._pools.pop(project_id, None)
+            workers = pool.idle if pool else []
+            if pool:
+                pool.idle = []
+        self._retire(workers)
+
+    def evict_idle(self):
+        """Retire workers that have been idle longer than their project's TTL."""
+        now = time.monotonic()
+        expired: List[ProjectWorker] = []
+
+        with self._cond:
+            for project_id, pool in list(self._pools.items()):
+                keep = []
+                # Most recently used first, so those are the ones kept warm
+                for worker in reversed(pool.idle):
+                    if not worker.is_alive():
+                        expired.append(worker)
+                    elif len(keep) < pool.min_warm or now - worker.last_used <= pool.idle_ttl:
+                        keep.append(worker)
+                    else:
+                        expired.append(worker)
+                pool.idle = keep[::-1]
+                if not pool.idle and not pool.busy and not pool.min_warm:
+                    del self._pools[project_id]
+
+        self._retire(expired)
+        return len(expired)
+
+    async def _reap(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(REAPER_INTERVAL)
+            try:
+                await loop.run_in_executor(None, self.evict_idle)
+                await loop.run_in_executor(None, self.keep_warm)
+            except Exception as e:
+                logger.error(f"Error evicting idle workers: {e}")
+
+    async def start(self):
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap())
+            if self._context.get_start_method() == 'forkserver':
+                # Boot the zygote in the background so the first cold start is cheap too
+                asyncio.get_event_loop().run_in_executor(None, multiprocessing.forkserver.ensure_running)
+            asyncio.get_event_loop().run_in_executor(None, self._discover_keep_warm)
+            logger.info("Worker pool started")
+
+    async def shutdown(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+
+        with self._cond:
+            workers = [worker for pool in self._pools.values() for worker in pool.idle]
+            self._pools.clear()
+
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._retire, workers, True)
+        logger.info("Worker pool shutdown")
+
+    def get_stats(self) -> dict:
+        """Get worker pool statistics."""
+        with self._cond:
+            return {
+                "projects": len(self._pools),
+                "idle_workers": sum(len(pool.idle) for pool in self._pools.values()),
+                "busy_workers": sum(pool.busy for pool in self._pools.values()),
+                "spawned": self._spawned,
+                "evicted": self._evicted,
+                "invocations": self._invocations,
+                "timeouts": self._timeouts,
+                "recycled": self._recycled,
+                "prewarmed": self._prewarmed,
+                "keep_warm": len(self._keep_warm),
+                "hosts": sum(1 for pool in self._pools.values() if pool.host_command),
+                "start_method": self._context.get_start_method(),
+                "avg_start_ms": round(self._start_time / self._started * 1000, 2) if self._started else 0,
+                "max_start_ms": round(self._max_start_time * 1000, 2),
+                "avg_exec_ms": round(self._exec_time / self._invocations * 1000, 2) if self._invocations else 0
+            }
+
+
+worker_pool = WorkerPool()
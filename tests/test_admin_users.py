@@ -0,0 +1,35 @@
+import asyncio
+import importlib
+from types import SimpleNamespace
+
+from fastapi import BackgroundTasks
+
+# The package re-exports the router under the module's name
+admin = importlib.import_module('runit_server.routers.admin')
+
+
+def test_deleting_a_user_drops_their_projects_from_memory(monkeypatch):
+    invalidated, deleted = [], []
+
+    async def get_user(user_id):
+        return SimpleNamespace(id=user_id, email='u1@example.com')
+
+    async def get_by_user(user_id):
+        return [SimpleNamespace(id='p1'), SimpleNamespace(id='p2')]
+
+    async def delete_many(query):
+        deleted.append(query)
+
+    monkeypatch.setattr(admin.User, 'get', get_user)
+    monkeypatch.setattr(admin.Project, 'get_by_user', get_by_user)
+    for model in (admin.Project, admin.Database, admin.Admin, admin.User):
+        monkeypatch.setattr(model, 'delete_many', delete_many)
+    monkeypatch.setattr(admin, 'invalidate_project', invalidated.append)
+
+    tasks = BackgroundTasks()
+    response = asyncio.run(admin.admin_delete_user(None, 'u1', tasks))
+
+    assert response.status_code == 200
+    assert invalidated == ['p1', 'p2']
+    assert [task.args for task in tasks.tasks] == [('p1',), ('p2',)]
+    assert {'id': 'p1', 'user_id': 'u1'} in deleted
@@ -0,0 +1,73 @@
+import json
+import time
+import asyncio
+import importlib
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from runit_server.common.results import encode_result
+from runit_server.services import invoker
+from runit_server.services.invoker import InvocationMetadata
+from runit_server.services.limiter import ConcurrencyLimiter
+
+# The package re-exports the router under the module's name
+api_public = importlib.import_module('runit_server.routers.api.public')
+
+
+@pytest.fixture
+def running(monkeypatch):
+    """Serve published projects of user u1 from a pool of two; returns the peak number of concurrent calls."""
+    state = {'active': 0, 'peak': 0}
+    lock = threading.Lock()
+
+    async def metadata(project_id):
+        if project_id == 'missing':
+            return None
+        return InvocationMetadata(SimpleNamespace(user_id='u1'), {}, True)
+
+    async def handles(project_id, function):
+        return False
+
+    def invoke(project_id, function, params, env=None):
+        with lock:
+            state['active'] += 1
+            state['peak'] = max(state['peak'], state['active'])
+        time.sleep(0.01)
+        with lock:
+            state['active'] -= 1
+        return encode_result({'project': project_id, 'n': params['n']})
+
+    limiter = ConcurrencyLimiter(project_limit=4, user_limit=3, queue_size=0)
+    monkeypatch.setattr(invoker, 'concurrency_limiter', limiter)
+    monkeypatch.setattr(api_public, 'concurrency_limiter', limiter)
+    monkeypatch.setattr(api_public, 'get_invocation_metadata', metadata)
+    monkeypatch.setattr(invoker.in_loop, 'handles', handles)
+    monkeypatch.setattr(invoker.worker_pool, 'invoke', invoke)
+    monkeypatch.setattr(invoker.worker_pool, 'loaded_capacity', lambda project_id: 2)
+    return state
+
+
+def batch(calls) -> list:
+    data = api_public.BatchData(calls=[api_public.BatchCall(**call) for call in calls])
+    response = asyncio.run(api_public.run_batch_api(data))
+    return json.loads(response.body)['data']
+
+
+def test_large_batch_is_paced_instead_of_rejected(running):
+    results = batch([{'project_id': 'p1', 'params': {'n': n}} for n in range(20)])
+
+    assert [result['status'] for result in results] == ['success'] * 20
+    assert [result['data']['n'] for result in results] == list(range(20))
+    # No more than the project's pool runs at once
+    assert running['peak'] <= 2
+
+
+def test_batch_calls_count_against_the_owner(running):
+    calls = [{'project_id': project_id, 'params': {'n': n}} for n in range(5) for project_id in ('p1', 'p2', 'p3')]
+
+    results = batch(calls + [{'project_id': 'missing'}])
+
+    assert [result['status'] for result in results] == ['success'] * 15 + ['error']
+    assert running['peak'] <= 3
@@ -0,0 +1,83 @@
+import io
+import os
+import asyncio
+import hashlib
+
+import pytest
+from starlette.datastructures import UploadFile
+
+from runit_server.exceptions import InvalidArchiveException
+from runit_server.services import blobs
+
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch, tmp_path):
+    root = tmp_path / 'blobs'
+    monkeypatch.setattr(blobs, 'BLOBS_DIR', str(root))
+    monkeypatch.setattr(blobs, 'UPLOAD_DIR', root / 'tmp')
+    monkeypatch.setattr(blobs, 'OWNERS_DIR', root / 'owners')
+    return root
+
+
+def upload(data: bytes, user_id: str, digest: str = None) -> str:
+    digest = digest or hashlib.sha256(data).hexdigest()
+    asyncio.run(blobs.store_blob(UploadFile(io.BytesIO(data), filename=digest), digest, user_id))
+    return digest
+
+
+def test_blobs_of_other_users_count_as_missing():
+    digest = upload(b'SECRET=hunter2\n', 'alice')
+
+    assert blobs.missing_blobs([digest], 'alice') == []
+    assert blobs.missing_blobs([digest], 'bob') == [digest]
+
+
+def test_uploading_a_blob_another_user_has_keeps_the_stored_file():
+    digest = upload(b'shared library code', 'alice')
+    inode = blobs.blob_path(digest).stat().st_ino
+
+    upload(b'shared library code', 'bob')
+
+    assert blobs.missing_blobs([digest], 'bob') == []
+    assert blobs.blob_path(digest).stat().st_ino == inode
+
+
+def test_blob_with_wrong_content_is_rejected():
+    digest = hashlib.sha256(b'expected').hexdigest()
+
+    with pytest.raises(InvalidArchiveException):
+        upload(b'something else', 'alice', digest)
+    assert not blobs.blob_path(digest).exists()
+    assert blobs.missing_blobs([digest], 'alice') == [digest]
+
+
+def test_pruned_blobs_leave_no_index_entries():
+    digest = upload(b'old file', 'alice')
+    past = 0
+    os.utime(blobs.blob_path(digest), (past, past))
+
+    assert blobs.prune_blobs(grace_period=60) == 1
+    assert not blobs.owner_path('alice', digest).exists()
+    assert blobs.missing_blobs([digest], 'alice') == [digest]
+
+
+def test_release_files_are_writable_copies(tmp_path):
+    code = upload(b"def index():\n    return 'v1'\n", 'alice')
+    data = upload(b'[]', 'alice')
+    release = tmp_path / 'release'
+
+    blobs.assemble_release({'application.py': code, 'data/store.json': data}, str(release))
+
+    # A function writing to its own files, as projects published as an archive may
+    with open(release / 'data' / 'store.json', 'w') as file:
+        file.write('[1]')
+    assert blobs.blob_path(data).read_bytes() == b'[]'
+    assert (release / 'application.py').read_bytes() == blobs.blob_path(code).read_bytes()
+    assert os.stat(release / 'application.py').st_ino != blobs.blob_path(code).stat().st_ino
+
+
+def test_release_over_the_size_limit_is_rejected(tmp_path):
+    digest = upload(b'x' * 1024, 'alice')
+
+    with pytest.raises(InvalidArchiveException):
+        blobs.assemble_release({'a.bin': digest, 'b.bin': digest}, str(tmp_path / 'release'), max_size=1500)
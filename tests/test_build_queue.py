@@ -0,0 +1,139 @@
+import time
+import asyncio
+import threading
+
+import pytest
+from odbms import DBMS
+
+from runit_server.exceptions import DependencyInstallException
+from runit_server.models import Build
+from runit_server.services import build_queue as build_queue_module
+from runit_server.services.build_queue import BuildQueue
+
+
+@pytest.fixture
+def deployed(tmp_path, monkeypatch):
+    """A fresh database and no-op deployment steps; returns the releases put live or discarded."""
+    monkeypatch.setattr(DBMS, 'Database', None)
+    asyncio.run(DBMS.initialize_async('sqlite', database=str(tmp_path / 'runit.db')))
+    Build.create_table()
+
+    events = {'activated': [], 'discarded': [], 'invalidated': [], 'live': None}
+
+    def activate(project_id, version, carry=True):
+        events['activated'].append(version)
+        events['live'] = version
+
+    async def prewarm(project_id):
+        pass
+
+    monkeypatch.setattr(build_queue_module, 'activate_release', activate)
+    monkeypatch.setattr(build_queue_module, 'current_release', lambda project_id: events['live'])
+    monkeypatch.setattr(build_queue_module, 'discard_release',
+                        lambda project_id, version: events['discarded'].append(version))
+    monkeypatch.setattr(build_queue_module, 'invalidate_project', events['invalidated'].append)
+    monkeypatch.setattr(build_queue_module, 'prewarm_project', prewarm)
+    monkeypatch.setattr(build_queue_module, 'record_import_profile', lambda path: None)
+    monkeypatch.setattr(build_queue_module, 'prune_releases', lambda project_id: None)
+    monkeypatch.setattr(build_queue_module.layer_store, 'prune', lambda: 0)
+    return events
+
+
+def install_with(monkeypatch, install):
+    monkeypatch.setattr(build_queue_module.layer_store, 'install', install)
+
+
+async def run_builds(queue: BuildQueue, builds: list) -> list:
+    """Submit `(path, version)` builds of project p1 and wait for all of them."""
+    await queue.start()
+    try:
+        submitted = [await queue.submit('p1', 'u1', path, 'publish', version) for path, version in builds]
+        finished = [await queue.wait(build.token, 10) for build in submitted]
+        # Let the follow-ups of successful builds run
+        await asyncio.sleep(0.05)
+        return finished
+    finally:
+        await queue.shutdown()
+
+
+def test_successful_build_puts_release_live(tmp_path, monkeypatch, deployed):
+    install_with(monkeypatch, lambda path: {'layer': 'python-a', 'hit': True, 'log': 'installed'})
+
+    build, = asyncio.run(run_builds(BuildQueue(workers=1), [(str(tmp_path), 'v1')]))
+
+    assert (build.status, build.layer, build.log) == (Build.SUCCEEDED, 'python-a', 'installed')
+    assert deployed['activated'] == ['v1']
+    assert deployed['invalidated'] == ['p1']
+
+
+def test_failed_build_discards_release(tmp_path, monkeypatch, deployed):
+    def install(path):
+        raise DependencyInstallException('pip exited with status 1', 'No matching distribution')
+
+    install_with(monkeypatch, install)
+
+    build, = asyncio.run(run_builds(BuildQueue(workers=1), [(str(tmp_path), 'v1')]))
+
+    assert build.status == Build.FAILED
+    assert build.log == 'No matching distribution'
+    assert (deployed['activated'], deployed['discarded']) == ([], ['v1'])
+    assert deployed['invalidated'] == []
+
+
+def test_older_release_finishing_last_stays_off(tmp_path, monkeypatch, deployed):
+    old, new = tmp_path / 'old', tmp_path / 'new'
+    old.mkdir()
+    new.mkdir()
+
+    def install(path):
+        # The older release takes longer to install
+        time.sleep(0.2 if path == str(old) else 0)
+        return {'layer': None, 'hit': False, 'log': ''}
+
+    install_with(monkeypatch, install)
+
+    builds = asyncio.run(run_builds(BuildQueue(workers=2), [(str(old), 'v1'), (str(new), 'v2')]))
+
+    assert [build.status for build in builds] == [Build.SUCCEEDED, Build.SUCCEEDED]
+    assert deployed['activated'] == ['v2']
+
+
+def test_builds_of_one_directory_run_one_at_a_time(tmp_path, monkeypatch, deployed):
+    state = {'active': 0, 'peak': 0}
+    lock = threading.Lock()
+
+    def install(path):
+        with lock:
+            state['active'] += 1
+            state['peak'] = max(state['peak'], state['active'])
+        time.sleep(0.05)
+        with lock:
+            state['active'] -= 1
+        return {'layer': None, 'hit': False, 'log': ''}
+
+    install_with(monkeypatch, install)
+
+    builds = asyncio.run(run_builds(BuildQueue(workers=3), [(str(tmp_path), None)] * 3))
+
+    assert [build.status for build in builds] == [Build.SUCCEEDED] * 3
+    assert state['peak'] == 1
+
+
+def test_pending_builds_run_again_on_start(tmp_path, monkeypatch, deployed):
+    install_with(monkeypatch, lambda path: {'layer': None, 'hit': False, 'log': ''})
+
+    async def scenario():
+        interrupted = Build(token='t1', project_id='p1', user_id='u1', reason='publish',
+                            path=str(tmp_path), version='v1', status=Build.RUNNING)
+        await interrupted.save()
+        queue = BuildQueue(workers=1)
+        await queue.start()
+        try:
+            return await queue.wait('t1', 10)
+        finally:
+            await queue.shutdown()
+
+    build = asyncio.run(scenario())
+
+    assert build.status == Build.SUCCEEDED
+    assert deployed['activated'] == ['v1']
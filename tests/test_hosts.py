@@ -0,0 +1,67 @@
+import json
+import time
+import shutil
+
+import pytest
+
+from runit_server.exceptions import InvocationTimeoutException
+from runit_server.services.hosts import HostWorker, host_command
+
+pytestmark = pytest.mark.skipif(shutil.which('node') is None, reason='Node.js is not installed')
+
+
+class Pool:
+    project_id = 'js'
+
+
+def node_host(tmp_path, source: str) -> HostWorker:
+    project = tmp_path / 'js'
+    project.mkdir()
+    (project / 'index.js').write_text(source)
+    config = {'name': 'js', 'language': 'javascript', 'runtime': 'node', 'start_file': 'index.js'}
+    (project / 'runit.json').write_text(json.dumps(config))
+    return HostWorker(Pool(), str(tmp_path), host_command(config, str(project)))
+
+
+def test_host_replies_and_is_reaped_on_stop(tmp_path):
+    host = node_host(tmp_path, "module.exports = { hello: (name) => 'hi ' + name };")
+
+    assert host.call('hello', {'name': 'ada'}, {}, timeout=10).json() == b'"hi ada"'
+    host.stop(wait=True)
+    assert host.process.returncode is not None
+
+
+def test_slow_function_is_killed_at_the_deadline(tmp_path):
+    host = node_host(tmp_path, """
+        module.exports = { spin: () => { const end = Date.now() + 5000; while (Date.now() < end) {} } };
+    """)
+    host.warm(10)
+
+    started = time.monotonic()
+    with pytest.raises(InvocationTimeoutException):
+        host.call('spin', {}, {}, timeout=0.5)
+    assert time.monotonic() - started < 2
+    assert not host.is_alive()
+
+
+def test_slow_start_file_counts_against_the_timeout(tmp_path):
+    host = node_host(tmp_path, """
+        const end = Date.now() + 8000; while (Date.now() < end) {}
+        module.exports = { index: () => 'loaded' };
+    """)
+
+    started = time.monotonic()
+    with pytest.raises(InvocationTimeoutException):
+        host.call('index', {}, {}, timeout=1)
+    assert time.monotonic() - started < 3
+    assert not host.is_alive()
+
+
+def test_project_writes_to_stdout_do_not_corrupt_replies(tmp_path):
+    host = node_host(tmp_path, """
+        process.stdout.write('loading\\n');
+        module.exports = { index: () => { process.stdout.write('noise'); console.log('more'); return 42; } };
+    """)
+
+    assert host.call('index', {}, {}, timeout=10).json() == b'42'
+    assert host.call('index', {}, {}, timeout=10).json() == b'42'
@@ -0,0 +1,29 @@
+from pathlib import Path
+
+import pytest
+
+from runit_server.services.build import profile_imports
+
+
+@pytest.mark.parametrize('start_file', ['main.py', 'my-app.py', 'main.v2.py', 'src/app.py'])
+def test_entry_module_is_profiled_whatever_its_name(tmp_path, start_file):
+    path = Path(tmp_path, start_file)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Path(path.parent, 'helpers.py').write_text('import colorsys\n')
+    path.write_text('import helpers\n\ndef index():\n    return "ok"\n')
+
+    profile = profile_imports(str(tmp_path), start_file)
+
+    assert profile['ok']
+    assert profile['module'] == path.stem
+    assert profile['total_ms'] is not None
+    assert {'helpers', 'colorsys'} <= {item['module'] for item in profile['slowest']}
+
+
+def test_failing_entry_module_is_reported(tmp_path):
+    Path(tmp_path, 'main.py').write_text('raise RuntimeError("boom")\n')
+
+    profile = profile_imports(str(tmp_path), 'main.py')
+
+    assert profile['module'] == 'main'
+    assert not profile['ok']
@@ -0,0 +1,84 @@
+import json
+import asyncio
+import importlib
+from types import SimpleNamespace
+
+from starlette.requests import Request
+
+from runit_server.common.results import encode_result
+from runit_server.services import invoker, invocation_log
+from runit_server.services.invoker import InvocationMetadata
+from runit_server.services.invocation_log import InvocationLogger, InvocationLogMiddleware
+from runit_server.services.usage import Usage
+
+# The package re-exports the router under the module's name
+public = importlib.import_module('runit_server.routers.public')
+
+
+def invoke_through_middleware(body: dict) -> list:
+    """POST `body` to project p1 through the middleware; returns the messages sent."""
+    data = json.dumps(body).encode()
+    sent, messages = False, []
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            return {'type': 'http.disconnect'}
+        sent = True
+        return {'type': 'http.request', 'body': data, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    async def app(scope, receive, send):
+        # What the router leaves in the scope before calling the endpoint
+        scope['endpoint'] = public.invoke_project
+        scope['path_params'] = {'project_id': 'p1', 'function': 'index'}
+        response = await public.invoke_project(Request(scope, receive), 'p1', 'index')
+        await response(scope, receive, send)
+
+    scope = {
+        'type': 'http', 'method': 'POST', 'path': '/p1/index', 'query_string': b'',
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(data)).encode())]
+    }
+    asyncio.run(InvocationLogMiddleware(app)(scope, receive, send))
+    return messages
+
+
+def test_entry_carries_usage_of_the_call(monkeypatch):
+    async def metadata(project_id):
+        return InvocationMetadata(SimpleNamespace(user_id='u1'), {}, True)
+
+    def invoke(project_id, function, params, env=None):
+        result = encode_result({'ok': True})
+        result.usage = Usage(15.0, 7.6, 30.123)
+        return result
+
+    log = InvocationLogger()
+    monkeypatch.setattr(invocation_log, 'invocation_log', log)
+    monkeypatch.setattr(public, 'get_invocation_metadata', metadata)
+    monkeypatch.setattr(invoker.worker_pool, 'invoke', invoke)
+    monkeypatch.setattr(invoker.worker_pool, 'capacity', lambda project_id: 1)
+
+    messages = invoke_through_middleware({'x': 1})
+
+    assert messages[0]['status'] == 200
+    entry, = log._buffer
+    assert (entry.project_id, entry.function, entry.status) == ('p1', 'index', 200)
+    assert entry.bytes_out == sum(len(m.get('body', b'')) for m in messages[1:])
+    assert (entry.cpu_ms, entry.peak_rss_mb) == (7, 30.12)
+
+
+def test_failed_call_has_no_usage(monkeypatch):
+    async def metadata(project_id):
+        return None
+
+    log = InvocationLogger()
+    monkeypatch.setattr(invocation_log, 'invocation_log', log)
+    monkeypatch.setattr(public, 'get_invocation_metadata', metadata)
+
+    messages = invoke_through_middleware({'x': 1})
+
+    assert messages[0]['status'] == 404
+    entry, = log._buffer
+    assert (entry.status, entry.cpu_ms, entry.peak_rss_mb) == (404, None, None)
@@ -0,0 +1,135 @@
+import os
+import json
+import asyncio
+import importlib
+from types import SimpleNamespace
+from urllib.parse import urlencode
+
+from starlette.requests import Request
+
+from runit_server.common.results import encode_result
+from runit_server.services import invoker
+from runit_server.services.invoker import InvocationMetadata
+
+# The package re-exports the router under the module's name
+public = importlib.import_module('runit_server.routers.public')
+
+
+def json_request(body: dict, query: dict = None) -> Request:
+    data = json.dumps(body).encode()
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            return {'type': 'http.disconnect'}
+        sent = True
+        return {'type': 'http.request', 'body': data, 'more_body': False}
+
+    scope = {
+        'type': 'http', 'method': 'POST', 'path': '/p1/index', 'query_string': urlencode(query or {}).encode(),
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(data)).encode())]
+    }
+    return Request(scope, receive)
+
+
+def serve(monkeypatch, handler):
+    """Answer invocations of any published project with `handler(params)`."""
+    async def metadata(project_id):
+        return InvocationMetadata(SimpleNamespace(user_id='u1'), {}, True)
+
+    def invoke(project_id, function, params, env=None):
+        return encode_result(handler(params))
+
+    monkeypatch.setattr(public, 'get_invocation_metadata', metadata)
+    monkeypatch.setattr(invoker.worker_pool, 'invoke', invoke)
+    monkeypatch.setattr(invoker.worker_pool, 'capacity', lambda project_id: 1)
+
+
+def test_json_body_with_list_reaches_function(monkeypatch):
+    calls = []
+
+    def handler(params):
+        calls.append(params)
+        return {'total': sum(params['items'])}
+
+    serve(monkeypatch, handler)
+
+    async def post_twice():
+        body = {'items': [1, 2, 3], 'options': {'round': True}}
+        return await asyncio.gather(*(public.invoke_project(json_request(body), 'p1', 'index') for _ in range(2)))
+
+    responses = asyncio.run(post_twice())
+
+    assert [response.status_code for response in responses] == [200, 200]
+    assert [json.loads(response.body) for response in responses] == [{'total': 6}, {'total': 6}]
+    # Calls with a body are never merged into one execution
+    assert len(calls) == 2
+
+
+def test_large_json_body_is_spilled_and_removed():
+    from runit_server.common import bodies
+
+    items = list(range(300000))
+    before = set(bodies.BODY_DIR.iterdir()) if bodies.BODY_DIR.exists() else set()
+    params, files = asyncio.run(bodies.body_params(json_request({'items': items})))
+
+    assert params['items'] == items
+    assert files == []
+    assert set(bodies.BODY_DIR.iterdir()) == before
+
+
+def test_params_that_look_like_body_files_are_not_deleted(monkeypatch, tmp_path):
+    from runit_server.common import bodies
+
+    victim = tmp_path / 'victim.txt'
+    victim.write_text('keep me')
+    bodies.BODY_DIR.mkdir(parents=True, exist_ok=True)
+    # Starts with BODY_DIR, but resolves to a file outside it
+    disguised = str(bodies.BODY_DIR) + os.sep + os.path.relpath(victim, bodies.BODY_DIR)
+    serve(monkeypatch, lambda params: 'ok')
+
+    async def invoke():
+        request = json_request({'path': disguised}, {'x': disguised})
+        response = await public.invoke_project(request, 'p1', 'index')
+        if response.background is not None:
+            await response.background()
+        return response
+
+    response = asyncio.run(invoke())
+
+    assert response.status_code == 200
+    assert victim.read_text() == 'keep me'
+
+
+def test_uploaded_body_file_is_removed_after_response(monkeypatch):
+    seen = []
+
+    def handler(params):
+        seen.append(params['body_file'])
+        return os.path.isfile(params['body_file'])
+
+    serve(monkeypatch, handler)
+    data = os.urandom(4096)
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            return {'type': 'http.disconnect'}
+        sent = True
+        return {'type': 'http.request', 'body': data, 'more_body': False}
+
+    async def invoke():
+        request = Request({
+            'type': 'http', 'method': 'POST', 'path': '/p1/index', 'query_string': b'',
+            'headers': [(b'content-type', b'application/octet-stream')]
+        }, receive)
+        response = await public.invoke_project(request, 'p1', 'index')
+        await response.background()
+        return response
+
+    response = asyncio.run(invoke())
+
+    assert json.loads(response.body) is True
+    assert not os.path.exists(seen[0])
@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from runit_server.exceptions import DependencyInstallException
+from runit_server.services import layers
+from runit_server.services.layers import LayerSpec, LayerStore, link_layer
+
+# Creates the venv directory a python project links to
+MAKE_VENV = [sys.executable, '-c', "import os; os.makedirs('venv'); open('venv/marker', 'w').write('x')"]
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(layers, 'LOCK_DIR', tmp_path / 'layers' / '.locks')
+    monkeypatch.setattr(layers, 'RELEASES_DIR', str(tmp_path / 'releases'))
+    monkeypatch.setattr(layers, 'PROJECTS_DIR', str(tmp_path / 'projects'))
+    return LayerStore(str(tmp_path / 'layers'))
+
+
+def release(tmp_path: Path, project_id: str, version: str = 'v1') -> str:
+    path = Path(tmp_path, 'releases', project_id, version)
+    path.mkdir(parents=True)
+    return str(path)
+
+
+def spec(key: str, commands=None) -> LayerSpec:
+    return LayerSpec('python', key, {'requirements.txt': b''}, [MAKE_VENV] if commands is None else commands)
+
+
+def test_layer_is_built_once_and_shared(store, tmp_path):
+    first, hit, _ = store.ensure(spec('python-a'))
+    again, hit_again, _ = store.ensure(spec('python-a'))
+
+    assert (hit, hit_again) == (False, True)
+    assert first == again
+    assert (store.hits, store.misses) == (1, 1)
+    # Built layers are read-only
+    assert not Path(first, 'venv', 'marker').stat().st_mode & 0o222
+
+
+def test_failed_build_leaves_nothing_behind(store):
+    failing = spec('python-b', [[sys.executable, '-c', 'raise SystemExit(3)']])
+
+    with pytest.raises(DependencyInstallException):
+        store.ensure(failing)
+
+    assert store.failures == 1
+    assert not Path(store.root, 'python-b').exists()
+
+
+def test_references_count_linking_releases(store, tmp_path):
+    path, _, _ = store.ensure(spec('python-a'))
+    store.ensure(spec('python-b'))
+    for project_id in ('p1', 'p2'):
+        link_layer(release(tmp_path, project_id), path, 'venv')
+
+    listed = {layer['key']: layer['references'] for layer in store.list_layers()}
+    stats = store.get_stats()
+
+    assert listed == {'python-a': 2, 'python-b': 0}
+    assert stats['layers'] == 2
+    assert stats['disk_usage_bytes'] == sum(layer['size_bytes'] for layer in store.list_layers())
+
+
+def test_stats_do_not_walk_releases(store, monkeypatch):
+    store.ensure(spec('python-a'))
+
+    def walk():
+        raise AssertionError('get_stats counted references')
+
+    monkeypatch.setattr(store, '_references', walk)
+
+    assert store.get_stats()['layers'] == 1
+
+
+def test_prune_keeps_referenced_and_recent_layers(store, tmp_path):
+    used, _, _ = store.ensure(spec('python-a'))
+    unused, _, _ = store.ensure(spec('python-b'))
+    link_layer(release(tmp_path, 'p1'), used, 'venv')
+
+    assert store.prune(grace_period=3600) == 0
+
+    old = time.time() - 7200
+    for path in (used, unused):
+        os.utime(Path(path, layers.LAYER_FILE), (old, old))
+    assert store.prune(grace_period=3600) == 1
+    assert Path(used).is_dir() and not Path(unused).exists()
+
+
+def test_concurrent_links_do_not_collide(store, tmp_path):
+    path, _, _ = store.ensure(spec('python-a'))
+    project_dir = release(tmp_path, 'p1')
+
+    with ThreadPoolExecutor(16) as pool:
+        list(pool.map(lambda _: link_layer(project_dir, path, 'venv'), range(1000)))
+
+    assert os.listdir(project_dir) == ['venv']
+    assert Path(project_dir, 'venv', 'marker').read_text() == 'x'
@@ -0,0 +1,165 @@
+import asyncio
+import threading
+
+import pytest
+
+from runit_server.exceptions import ProjectBusyException
+from runit_server.services.limiter import ConcurrencyLimiter
+
+
+async def hold(limiter: ConcurrencyLimiter, release: asyncio.Event, order: list, name: str, **kwargs):
+    async with limiter.slot('p1', **kwargs):
+        order.append(name)
+        await release.wait()
+
+
+def test_calls_over_the_limit_wait_in_order():
+    async def scenario():
+        limiter = ConcurrencyLimiter(project_limit=1, user_limit=10, queue_size=5)
+        release, order = asyncio.Event(), []
+        tasks = [asyncio.create_task(hold(limiter, release, order, name)) for name in 'abc']
+        await asyncio.sleep(0.01)
+        running = list(order)
+        stats = limiter.get_stats()
+        release.set()
+        await asyncio.gather(*tasks)
+        return running, order, stats
+
+    running, order, stats = asyncio.run(scenario())
+
+    assert running == ['a']
+    assert order == ['a', 'b', 'c']
+    assert (stats['active'], stats['queued']) == (1, 2)
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    async def scenario():
+        limiter = ConcurrencyLimiter(project_limit=1, user_limit=10, queue_size=1)
+        release, order = asyncio.Event(), []
+        tasks = [asyncio.create_task(hold(limiter, release, order, name)) for name in 'ab']
+        await asyncio.sleep(0.01)
+        with pytest.raises(ProjectBusyException) as busy:
+            async with limiter.slot('p1'):
+                pass
+        release.set()
+        await asyncio.gather(*tasks)
+        return busy.value, limiter.get_stats()
+
+    busy, stats = asyncio.run(scenario())
+
+    assert busy.retry_after >= 1
+    assert (stats['admitted'], stats['rejected']) == (2, 1)
+
+
+def test_zero_queue_admits_calls_with_a_free_slot():
+    async def scenario():
+        limiter = ConcurrencyLimiter(project_limit=2, user_limit=10, queue_size=0)
+        release, order = asyncio.Event(), []
+        first = asyncio.create_task(hold(limiter, release, order, 'a'))
+        await asyncio.sleep(0.01)
+        async with limiter.slot('p1'):
+            order.append('b')
+        second = asyncio.create_task(hold(limiter, release, order, 'c'))
+        await asyncio.sleep(0.01)
+        # Both slots are taken and there is no room to wait
+        with pytest.raises(ProjectBusyException):
+            async with limiter.slot('p1'):
+                pass
+        release.set()
+        await asyncio.gather(first, second)
+        return order
+
+    assert asyncio.run(scenario()) == ['a', 'b', 'c']
+
+
+def test_user_limit_applies_across_projects():
+    async def scenario():
+        limiter = ConcurrencyLimiter(project_limit=5, user_limit=1, queue_size=5)
+        release, order = asyncio.Event(), []
+
+        async def call(project_id):
+            async with limiter.slot(project_id, user_id='u1'):
+                order.append(project_id)
+                await release.wait()
+
+        tasks = [asyncio.create_task(call(project_id)) for project_id in ('p1', 'p2')]
+        await asyncio.sleep(0.01)
+        running = list(order)
+        release.set()
+        await asyncio.gather(*tasks)
+        return running
+
+    assert asyncio.run(scenario()) == ['p1']
+
+
+def test_capacity_caps_a_new_gate_and_is_awaited_once():
+    calls = []
+
+    async def capacity():
+        calls.append(None)
+        return 1
+
+    async def scenario():
+        limiter = ConcurrencyLimiter(project_limit=4, user_limit=10, queue_size=5)
+        release, order = asyncio.Event(), []
+        tasks = [asyncio.create_task(hold(limiter, release, order, name, capacity=capacity)) for name in 'ab']
+        await asyncio.sleep(0.01)
+        running = list(order)
+        release.set()
+        await asyncio.gather(*tasks)
+        return running, limiter.get_stats()
+
+    running, stats = asyncio.run(scenario())
+
+    assert running == ['a']
+    # The second call finds the gate the first one created
+    assert len(calls) == 1
+    assert stats['queued'] == 0
+
+
+def test_pool_capacity_loads_settings_off_the_loop(monkeypatch):
+    from runit_server.services import invoker
+
+    threads = []
+
+    def capacity(project_id):
+        threads.append(threading.current_thread())
+        return 3
+
+    monkeypatch.setattr(invoker.worker_pool, 'loaded_capacity', lambda project_id: None)
+    monkeypatch.setattr(invoker.worker_pool, 'capacity', capacity)
+
+    assert asyncio.run(invoker.pool_capacity('p1')()) == 3
+    assert threads and threads[0] is not threading.main_thread()
+
+
+def test_in_loop_calls_count_against_the_owner(monkeypatch):
+    from runit_server.services import invoker
+
+    limiter = ConcurrencyLimiter(project_limit=5, user_limit=1, queue_size=5)
+    started = []
+
+    async def handles(project_id, function):
+        return True
+
+    async def invoke(project_id, function, params, env, timeout):
+        started.append(project_id)
+        await asyncio.sleep(0.05)
+        return project_id
+
+    monkeypatch.setattr(invoker, 'concurrency_limiter', limiter)
+    monkeypatch.setattr(invoker.in_loop, 'handles', handles)
+    monkeypatch.setattr(invoker.in_loop, 'invoke', invoke)
+    monkeypatch.setattr(invoker.worker_pool, 'timeout_for', lambda project_id, function: 1.0)
+
+    async def scenario():
+        tasks = [asyncio.create_task(invoker.run_project_async(project_id, 'index', {}, user_id='u1'))
+                 for project_id in ('p1', 'p2')]
+        await asyncio.sleep(0.01)
+        running = list(started)
+        return running, await asyncio.gather(*tasks)
+
+    running, results = asyncio.run(scenario())
+
+    assert running == ['p1']
+    assert results == ['p1', 'p2']
@@ -0,0 +1,90 @@
+import os
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from runit_server.services import releases
+
+
+@pytest.fixture(autouse=True)
+def dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(releases, 'PROJECTS_DIR', str(tmp_path / 'projects'))
+    monkeypatch.setattr(releases, 'RELEASES_DIR', str(tmp_path / 'releases'))
+    Path(tmp_path, 'projects').mkdir()
+
+
+def publish(project_id: str, digest: str, files: dict) -> str:
+    path = releases.new_release(project_id, digest)
+    for name, content in files.items():
+        Path(path, name).write_text(content)
+    releases.activate_release(project_id, path.name, carry=False)
+    return path.name
+
+
+def read(project_id: str, name: str) -> str:
+    return Path(releases.project_link(project_id), name).read_text()
+
+
+def test_publish_switches_the_live_release():
+    first = publish('p1', 'a' * 64, {'main.py': 'v1'})
+    second = publish('p1', 'b' * 64, {'main.py': 'v2'})
+
+    assert first < second
+    assert read('p1', 'main.py') == 'v2'
+    assert releases.current_release('p1') == second
+    assert releases.previous_release('p1') == first
+    assert [release['current'] for release in releases.list_releases('p1')] == [True, False]
+
+
+def test_rollback_keeps_the_current_env():
+    first = publish('p1', 'a' * 64, {'main.py': 'v1', '.env': 'KEY=old'})
+    publish('p1', 'b' * 64, {'main.py': 'v2'})
+    Path(releases.project_link('p1'), '.env').write_text('KEY=new')
+
+    releases.activate_release('p1', first)
+
+    assert read('p1', 'main.py') == 'v1'
+    assert read('p1', '.env') == 'KEY=new'
+
+
+def test_concurrent_activations_do_not_collide():
+    versions = [publish('p1', digest * 64, {'main.py': digest}) for digest in 'abcd']
+
+    with ThreadPoolExecutor(16) as pool:
+        list(pool.map(lambda version: releases.activate_release('p1', version), versions * 250))
+
+    assert releases.current_release('p1') in versions
+    # No staged links are left behind
+    assert os.listdir(releases.PROJECTS_DIR) == ['p1']
+
+
+def test_activating_a_missing_release_fails():
+    publish('p1', 'a' * 64, {'main.py': 'v1'})
+
+    with pytest.raises(FileNotFoundError):
+        releases.activate_release('p1', '20000101000000-missing')
+    assert read('p1', 'main.py') == 'v1'
+
+
+def test_plain_project_directory_is_adopted():
+    plain = releases.project_link('p1')
+    plain.mkdir()
+    Path(plain, 'main.py').write_text('v0')
+
+    publish('p1', 'a' * 64, {'main.py': 'v1'})
+
+    adopted = releases.list_releases('p1')[-1]
+    assert adopted['version'].endswith('-initial')
+    assert Path(releases.project_releases_dir('p1'), adopted['version'], 'main.py').read_text() == 'v0'
+    assert read('p1', 'main.py') == 'v1'
+
+
+def test_prune_keeps_the_live_release():
+    versions = [publish('p1', digest * 64, {'main.py': digest}) for digest in 'abc']
+    releases.activate_release('p1', versions[0])
+
+    releases.prune_releases('p1', keep=1)
+
+    assert [release['version'] for release in releases.list_releases('p1')] == [versions[2], versions[0]]
+    assert read('p1', 'main.py') == 'a'
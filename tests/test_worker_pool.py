@@ -0,0 +1,73 @@
+import json
+import time
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from runit_server.exceptions import InvocationTimeoutException
+from runit_server.services.worker_pool import WorkerPool
+
+APPLICATION = '''
+import os
+import time
+
+def index():
+    return {'pid': os.getpid()}
+
+def hang():
+    time.sleep(100)
+
+def nap(seconds):
+    time.sleep(float(seconds))
+    return 'rested'
+'''
+
+
+@pytest.fixture
+def pool(tmp_path):
+    """A pool of one worker per project, serving projects created with `project`."""
+    pool = WorkerPool(projects_dir=str(tmp_path), pool_size=1, idle_ttl=60, max_projects=4, timeout=5)
+    yield pool
+    asyncio.run(pool.shutdown())
+
+
+def project(tmp_path: Path, project_id: str, workers: dict) -> str:
+    directory = Path(tmp_path, project_id)
+    directory.mkdir()
+    Path(directory, 'application.py').write_text(APPLICATION)
+    Path(directory, 'runit.json').write_text(json.dumps({
+        '_id': project_id, 'name': project_id, 'language': 'python', 'runtime': 'python',
+        'start_file': 'application.py', 'workers': workers
+    }))
+    return project_id
+
+
+def test_function_timeout_kills_the_worker(pool, tmp_path):
+    project_id = project(tmp_path, 'p1', {'timeouts': {'hang': 1}})
+    first = json.loads(pool.invoke(project_id, 'index', {}).json())['pid']
+
+    t0 = time.monotonic()
+    with pytest.raises(InvocationTimeoutException):
+        pool.invoke(project_id, 'hang', {})
+
+    assert time.monotonic() - t0 < 4
+    assert pool.get_stats()['timeouts'] == 1
+    # The next call gets a fresh worker
+    assert json.loads(pool.invoke(project_id, 'index', {}).json())['pid'] != first
+
+
+def test_project_timeout_applies_to_every_function(pool, tmp_path):
+    project_id = project(tmp_path, 'p1', {'timeout': 1})
+
+    with pytest.raises(InvocationTimeoutException):
+        pool.invoke(project_id, 'nap', {'seconds': 3})
+    assert pool.timeout_for(project_id, 'nap') == 1
+
+
+def test_calls_within_the_timeout_complete(pool, tmp_path):
+    project_id = project(tmp_path, 'p1', {'timeout': 2})
+
+    assert json.loads(pool.invoke(project_id, 'nap', {'seconds': 0.2}).json()) == 'rested'
+    assert pool.get_stats()['timeouts'] == 0
+